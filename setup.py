@@ -46,6 +46,10 @@ setup(
         "openpyxl"
     ],
     extras_require={
+        # Bulk coercion of wide-format results (Nexion 350X)
+        "numpy": [
+            "numpy",
+        ],
         "test": [
             "Products.PloneTestCase",
             "plone.app.testing",
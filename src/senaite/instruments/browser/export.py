@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+import zipfile
+from tempfile import SpooledTemporaryFile
+
+from bika.lims import api
+from bika.lims.catalog import CATALOG_WORKSHEET_LISTING
+from DateTime import DateTime
+from Products.Five.browser import BrowserView
+from senaite.core.exportimport.instruments import IInstrumentExportInterface
+from senaite.instruments import logger
+from senaite.instruments.lookup import ExportLookup
+from senaite.instruments.profiling import PROFILE_HEADER
+from senaite.instruments.profiling import profile
+from senaite.instruments.profiling import requested as profile_requested
+from senaite.instruments.querycount import record_queries
+from senaite.instruments.querycount import report
+from zope.component import queryAdapter
+
+# Archives up to this size are built in memory
+SPOOL_SIZE = 8 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+class BulkExportView(BrowserView):
+    """Exports the sequence files of several worksheets as one ZIP archive.
+
+    The worksheets are given by UID or ID in the `worksheets` form value.
+    Each worksheet is exported with the `exporter` of the form (the name of
+    an export interface), or else with the data interface of its instrument.
+    The analyses of all the worksheets are fetched at once and shared by
+    the exports. Worksheets that can not be exported are listed in the
+    errors.txt file of the archive.
+    """
+
+    def __call__(self):
+        if not profile_requested(self.request, self.context):
+            return self.export_sequences()
+        with profile("export_sequences") as capture:
+            self.request.RESPONSE.setHeader(PROFILE_HEADER, capture.id)
+            return self.export_sequences()
+
+    def export_sequences(self):
+        with record_queries() as queries:
+            worksheets = self.get_worksheets()
+            archive, errors = self.export(worksheets)
+        report("export_sequences", queries)
+        logger.info("export_sequences: {} worksheets, {} errors".format(
+            len(worksheets), len(errors)))
+        return self.stream(archive)
+
+    def get_worksheets(self):
+        values = self.request.form.get("worksheets") or []
+        if isinstance(values, basestring):
+            values = values.split(",")
+        values = filter(None, [value.strip() for value in values])
+        if not values:
+            return []
+        worksheets = {}
+        for index in ("UID", "getId"):
+            query = {"portal_type": "Worksheet", index: values}
+            for brain in api.search(query, CATALOG_WORKSHEET_LISTING):
+                worksheets[api.get_uid(brain)] = api.get_object(brain)
+        # In the order they were first given, by UID or ID
+        order = {}
+        for index, value in enumerate(values):
+            order.setdefault(value, index)
+        return sorted(worksheets.values(), key=lambda ws: min(
+            order.get(api.get_uid(ws), len(values)),
+            order.get(api.get_id(ws), len(values))))
+
+    def get_exporter(self, worksheet):
+        name = self.request.form.get("exporter")
+        if not name:
+            instrument = worksheet.getInstrument()
+            name = instrument and instrument.getDataInterface() or None
+        if not name:
+            return None
+        return queryAdapter(worksheet, IInstrumentExportInterface, name=name)
+
+    def export(self, worksheets):
+        """Writes the sequence files of the worksheets to a temporary ZIP
+        archive. Returns the archive and the errors
+        """
+        lookup = ExportLookup()
+        lookup.prefetch([item["analysis_uid"]
+                         for worksheet in worksheets
+                         for item in worksheet.getLayout()])
+        archive = SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        errors = []
+        with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zf:
+            for worksheet in worksheets:
+                exporter = self.get_exporter(worksheet)
+                if exporter is None or not hasattr(exporter, "render"):
+                    errors.append("{}: no sequence exporter".format(
+                        api.get_id(worksheet)))
+                    continue
+                try:
+                    files = exporter.render(worksheet, lookup=lookup)
+                except Exception:
+                    logger.exception("export_sequences: {} failed".format(
+                        api.get_id(worksheet)))
+                    errors.append("{}: the export failed".format(
+                        api.get_id(worksheet)))
+                    continue
+                for filename, data in files:
+                    zf.writestr(filename, data)
+            if errors or not worksheets:
+                zf.writestr("errors.txt", "\n".join(
+                    errors or ["No worksheets selected"]) + "\n")
+        return archive, errors
+
+    def stream(self, archive):
+        filename = "sequences-{}.zip".format(
+            DateTime().strftime("%Y%m%d-%H%M"))
+        size = archive.tell()
+        archive.seek(0)
+        setheader = self.request.RESPONSE.setHeader
+        setheader("Content-Length", size)
+        setheader("Content-Type", "application/zip")
+        setheader("Content-Disposition",
+                  'attachment; filename="{}"'.format(filename))
+        while True:
+            chunk = archive.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            self.request.RESPONSE.write(chunk)
+        archive.close()
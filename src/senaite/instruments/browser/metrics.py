@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+import os
+
+from Products.Five.browser import BrowserView
+from senaite.instruments.metrics import get_metrics
+
+# Comma separated addresses of the clients allowed to read the metrics,
+# "*" for any client
+ALLOWED_ADDRESSES_ENV = "SENAITE_INSTRUMENTS_METRICS_ALLOW"
+LOCAL_ADDRESSES = ("127.0.0.1", "::1")
+# Headers set by proxies, the client is not the one of REMOTE_ADDR then
+FORWARDED_HEADERS = ("X-Forwarded-For", "X-Real-IP", "Forwarded")
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def get_allowed_addresses(env=ALLOWED_ADDRESSES_ENV):
+    """Returns the addresses of the clients allowed to read the metrics,
+    None to allow any
+    """
+    value = os.environ.get(env, "").strip()
+    if not value:
+        return LOCAL_ADDRESSES
+    if value == "*":
+        return None
+    return tuple(filter(None, [address.strip()
+                               for address in value.split(",")]))
+
+
+def is_allowed(request):
+    """Whether the client of the request may read the metrics
+    """
+    addresses = get_allowed_addresses()
+    if addresses is None:
+        return True
+    if any(request.getHeader(header) for header in FORWARDED_HEADERS):
+        return False
+    return request.get("REMOTE_ADDR") in addresses
+
+
+class MetricsView(BrowserView):
+    """Import metrics of this instance in Prometheus text format (see
+    metrics.py), for managers (the scraper authenticates with basic auth)
+    connecting from the allowed addresses
+    """
+
+    def __call__(self):
+        if not is_allowed(self.request):
+            self.request.RESPONSE.setStatus(403)
+            return "Forbidden\n"
+        self.request.RESPONSE.setHeader("Content-Type", CONTENT_TYPE)
+        return get_metrics().render()
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+import os
+
+from Products.Five.browser import BrowserView
+from senaite.instruments.profiling import get_profile_path
+
+
+class ProfileDownloadView(BrowserView):
+    """Downloads the cProfile stats of an import or export by the `id` form
+    value (see profiling.py). The file is read with pstats or any viewer of
+    its format, e.g. snakeviz
+    """
+
+    def __call__(self):
+        profile_id = self.request.form.get("id")
+        path = get_profile_path(profile_id)
+        if path is None:
+            self.request.RESPONSE.setStatus(404)
+            return "No profile {}\n".format(profile_id)
+        setheader = self.request.RESPONSE.setHeader
+        setheader("Content-Length", os.path.getsize(path))
+        setheader("Content-Type", "application/octet-stream")
+        setheader("Content-Disposition",
+                  'attachment; filename="{}"'.format(profile_id))
+        with open(path, "rb") as f:
+            return f.read()
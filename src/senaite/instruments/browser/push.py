@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+import json
+
+from Products.Five.browser import BrowserView
+from senaite.instruments.push import CONTENT_TYPES
+from senaite.instruments.push import PushRun
+from senaite.instruments.push import is_json_request
+from senaite.instruments.push import pushimport
+from zope.interface import alsoProvides
+
+try:
+    from plone.protect.interfaces import IDisableCSRFProtection
+except ImportError:
+    IDisableCSRFProtection = None
+
+
+class PushResultsView(BrowserView):
+    """Imports the results records posted as JSON by instrument middleware
+    (see push.py). Returns the messages of the import as JSON, like the
+    import interfaces.
+
+    Posted to a worksheet, the import is scoped to its samples.
+    """
+
+    def __call__(self):
+        self.request.RESPONSE.setHeader("Content-Type", "application/json")
+        if self.request.get("REQUEST_METHOD", "GET") != "POST":
+            self.request.RESPONSE.setStatus(405)
+            return json.dumps({"errors": ["The results must be posted"]})
+        if not is_json_request(self.request):
+            # A form posted cross-site can not be sent as JSON
+            self.request.RESPONSE.setStatus(415)
+            return json.dumps({"errors": [
+                "The results must be posted as {}".format(
+                    " or ".join(CONTENT_TYPES))]})
+        if IDisableCSRFProtection is not None:
+            # Posted by scripts as JSON, which hold no CSRF token
+            alsoProvides(self.request, IDisableCSRFProtection)
+        return PushRun(pushimport, self.context, self.request).run()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+from copy import copy
+
+from senaite.core.exportimport.instruments.resultsimport import \
+    InstrumentResultsFileParser
+
+
+def count_results(rawresults):
+    """Returns the number of analysis results in the raw results of a parser
+    """
+    return sum(len(values) for results in rawresults.values()
+               for values in results)
+
+
+def copy_results(rawresults):
+    """Returns a copy of the raw results of a parser for a results importer
+    to consume. The values of the records are not copied
+    """
+    return dict((resid, [dict((keyword, copy(values))
+                              for keyword, values in results.items())
+                         for results in resultslist])
+                for resid, resultslist in rawresults.items())
+
+
+def split_results(rawresults, size):
+    """Splits the raw results of a parser in chunks of `size` samples
+    """
+    resids = sorted(rawresults.keys())
+    for start in range(0, len(resids), size):
+        yield dict((resid, rawresults[resid])
+                   for resid in resids[start:start + size])
+
+
+class ResultsChunk(InstrumentResultsFileParser):
+    """Hands a subset of the results of an already parsed file to a results
+    importer.
+
+    The messages of the parse phase stay with the original parser, so they
+    are not repeated for every chunk. Any other attribute is looked up on
+    the original parser.
+    """
+
+    def __init__(self, parser, rawresults):
+        InstrumentResultsFileParser.__init__(
+            self, parser.getInputFile(), parser.getFileMimeType())
+        self._parser = parser
+        self._rawresults = rawresults
+
+    def __getattr__(self, name):
+        if name.startswith('__') or name == '_parser':
+            raise AttributeError(name)
+        return getattr(self._parser, name)
+
+    def parse(self):
+        return True
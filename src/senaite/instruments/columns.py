@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+import csv
+from operator import itemgetter
+
+
+def split_line(line, delimiter=","):
+    """Split a delimited line into stripped tokens.
+
+    Quoted tokens are honoured, so a header like `"Diff (Bio, mDa)"` is
+    kept as a single column instead of shifting every column after it.
+    """
+    tokens = next(csv.reader([line], delimiter=delimiter), [])
+    return [token.strip() for token in tokens]
+
+
+class Column(object):
+    """Declares one column to project out of a results row.
+
+    `labels` are the header texts the column is known by (first match
+    wins), `index` is the position used when none of the labels is
+    present in the header.  Columns flagged as `interim` are coerced and
+    returned by `ProjectionPlan.interims`.
+    """
+
+    def __init__(self, name, labels, index=None, interim=True):
+        if isinstance(labels, basestring):
+            labels = (labels, )
+        self.name = name
+        self.labels = tuple(labels)
+        self.index = index
+        self.interim = interim
+
+    def locate(self, header):
+        for label in self.labels:
+            if label in header:
+                return header.index(label)
+        return self.index
+
+
+class ProjectionPlan(object):
+    """A list of columns compiled against a header row.
+
+    The header is resolved once; every row afterwards is projected with a
+    single itemgetter call, and the interim columns are coerced in one
+    pass.
+    """
+
+    def __init__(self, columns, header=None):
+        self.columns = tuple(columns)
+        self.header = list(header or [])
+        self.missing = []
+        names = []
+        indexes = []
+        for column in self.columns:
+            index = column.locate(self.header)
+            if index is None:
+                self.missing.append(column.name)
+                continue
+            names.append(column.name)
+            indexes.append(index)
+        self.names = tuple(names)
+        self.indexes = tuple(indexes)
+        self.interim_names = tuple(
+            column.name for column in self.columns if column.interim)
+        self.width = max(indexes) + 1 if indexes else 0
+        self._getter = itemgetter(*indexes) if indexes else None
+
+    def project(self, splitted):
+        """Return a dict with the projected values of a split row.
+
+        Columns that could not be located in the header, and cells past
+        the end of a short row, are returned as empty strings.
+        """
+        projected = dict.fromkeys(self.missing, "")
+        if not self._getter:
+            return projected
+        if len(splitted) < self.width:
+            splitted = splitted + [""] * (self.width - len(splitted))
+        values = self._getter(splitted)
+        if len(self.indexes) == 1:
+            values = (values, )
+        projected.update(zip(self.names, values))
+        return projected
+
+    def interims(self, projected, coerce):
+        """Coerce the interim columns of a projected row.
+
+        `coerce` is called as coerce(column_name, value), like the
+        `get_result` method of the parsers.
+        """
+        return dict((name, coerce(name, projected[name]))
+                    for name in self.interim_names)
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+"""Chunk-parallel parsing of large CSV results files.
+
+Once the header of a results table is known every row of it is parsed on
+its own, so the rows after the header are split in chunks on line
+boundaries and parsed by the worker processes (see workers.py) at once.
+A chunk is parsed with the projection plan of the header, and its rows
+are sent back as plain tuples (cheaper to pickle than dicts), which the
+parser turns into raw results in file order.
+
+This module only depends on the standard library, so it can be used by the
+worker processes as well. The projection plans are built by the caller.
+"""
+
+# Header rules: the first cell starts with the label, or any cell is it
+PREFIX = "prefix"
+CELL = "cell"
+
+# Values the instruments write for no result
+NO_RESULT = ("", "ND")
+
+
+def is_header(splitted, rule):
+    """Returns whether the split row is a table header, by the rule of the
+    parser: (PREFIX, label) or (CELL, label)
+    """
+    kind, label = rule
+    if kind == PREFIX:
+        return bool(splitted) and splitted[0].startswith(label)
+    return label in splitted
+
+
+def coerce_result(value):
+    """Returns the float of a result cell, 0.0 for no or negative results
+    and None if the value is not a number
+    """
+    value = str(value)
+    if value.startswith("--") or value in NO_RESULT:
+        return 0.0
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value > 0.0 and value or 0.0
+
+
+def get_names(columns):
+    """Returns the names of the columns that are no interims and of the
+    interim columns, in the order of the values of the parsed rows
+    """
+    return (tuple(column.name for column in columns if not column.interim),
+            tuple(column.name for column in columns if column.interim))
+
+
+def split_ranges(data, start, end, count):
+    """Splits data[start:end] in at most `count` ranges of about the same
+    size, ending after a newline. `data` is a string or a mmap
+    """
+    size = end - start
+    if size <= 0:
+        return []
+    step = max(size // max(count, 1), 1)
+    ranges = []
+    while start < end:
+        stop = start + step
+        if stop >= end or len(ranges) == count - 1:
+            stop = end
+        else:
+            newline = data.find("\n", stop - 1, end)
+            stop = end if newline < 0 else newline + 1
+        ranges.append((start, stop))
+        start = stop
+    return ranges
+
+
+def read_range(task):
+    """Returns the data of a chunk task, read from the file at its path or
+    from its contents
+    """
+    if task.get("path"):
+        with open(task["path"], "rb") as f:
+            f.seek(task["start"])
+            return f.read(task["end"] - task["start"])
+    return task["contents"]
+
+
+def parse_chunk(data, task, make_plan, split):
+    """Parses the results rows of a chunk. Yields, in file order:
+
+        ("row", numline, values, interims, invalid)
+        ("header", numline, splitted)
+        ("end", lines, None)
+
+    The line numbers are relative to the chunk. `values` are the projected
+    cells of the columns that are no interims, `interims` the coerced
+    interim values (both in the order of get_names) and `invalid` the
+    (column, value) of the interims that are not numbers.
+    `make_plan(header)` returns the projection plan of a header,
+    `split(line, delimiter)` splits a line.
+    """
+    delimiter = task["delimiter"]
+    rule = tuple(task["header_rule"])
+    plan = make_plan(task["header"])
+    value_names, interim_names = get_names(plan.columns)
+    numline = 0
+    for line in data.splitlines():
+        numline += 1
+        line = line.strip()
+        if not line:
+            continue
+        splitted = split(line, delimiter)
+        if not any(splitted):
+            continue
+        if is_header(splitted, rule):
+            plan = make_plan(splitted)
+            yield ("header", numline, splitted)
+            continue
+        projected = plan.project(splitted)
+        interims = []
+        invalid = []
+        for name in interim_names:
+            value = coerce_result(projected[name])
+            if value is None:
+                invalid.append((name, projected[name]))
+            interims.append(value)
+        yield ("row", numline, tuple(projected[name] for name in value_names),
+               tuple(interims), tuple(invalid))
+    yield ("end", numline, None)
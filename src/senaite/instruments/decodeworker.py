@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+"""Spreadsheet decoding worker process.
+
+Started by senaite.instruments.workers.DecoderPool as a script, so it does
+not import Zope or the senaite packages. It reads tasks from stdin and
+writes the decoded lines (or parsed rows) to stdout in batches:
+
+    decode:  {"kind": "decode", "format": "xlsx", "worksheet": 0,
+              "delimiter": ",", "contents": "...", "path": None}
+    parse:   {"kind": "parse", "columns": [...], "header": [...],
+              "header_rule": ("prefix", "Score"), "delimiter": ",",
+              "contents": "...", "path": None, "start": 0, "end": 0}
+
+The path is given instead of the contents for files on disk, the parse
+tasks read the bytes from start to end of it (see csvchunks.py).
+    replies: ("batch", [...]) ... ("done", None) or ("error", "message")
+"""
+
+import cPickle
+import sys
+import traceback
+
+from columns import Column
+from columns import ProjectionPlan
+from columns import split_line
+from csvchunks import parse_chunk
+from csvchunks import read_range
+from spreadsheet import DECODERS
+
+BATCH_SIZE = 500
+
+
+def reply(stream, kind, payload):
+    cPickle.dump((kind, payload), stream, cPickle.HIGHEST_PROTOCOL)
+    stream.flush()
+
+
+def send(items, stream):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= BATCH_SIZE:
+            reply(stream, "batch", batch)
+            batch = []
+    if batch:
+        reply(stream, "batch", batch)
+
+
+def decode(task, stream):
+    decoder = DECODERS[task["format"]]
+    lines = decoder(task.get("contents"),
+                    worksheet=task["worksheet"],
+                    delimiter=task["delimiter"],
+                    path=task.get("path"))
+    send(lines, stream)
+
+
+def parse(task, stream):
+    columns = [Column(*args) for args in task["columns"]]
+
+    def make_plan(header):
+        return ProjectionPlan(columns, header)
+
+    send(parse_chunk(read_range(task), task, make_plan, split_line), stream)
+
+
+TASKS = {
+    "decode": decode,
+    "parse": parse,
+}
+
+
+def main():
+    stdin = sys.stdin
+    stdout = sys.stdout
+    # Stray prints must not corrupt the reply stream
+    sys.stdout = sys.stderr
+    while True:
+        try:
+            task = cPickle.load(stdin)
+        except EOFError:
+            break
+        try:
+            TASKS[task.get("kind", "decode")](task, stdout)
+        except Exception as e:
+            traceback.print_exc()
+            reply(stdout, "error", repr(e))
+        else:
+            reply(stdout, "done", None)
+
+
+if __name__ == "__main__":
+    main()
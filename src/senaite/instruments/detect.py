@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+"""Detection of the import interface of a results file.
+
+Every import interface of the registry lists the markers that distinguish
+its files (header labels mostly) in its `signatures` metadata. A file is
+recognised by looking for the markers in a sample of its text, without
+decoding it:
+
+- CSV/text files: the first SAMPLE_SIZE bytes
+- XLSX files: the first SAMPLE_SIZE bytes of the shared strings and of the
+  first sheet
+- XLS files: the first XLS_SAMPLE_SIZE bytes. Strings are stored as 8 bit
+  or UTF-16 text, but the strings table comes after the styles and the
+  embedded pictures of the workbook.
+"""
+
+import re
+import zipfile
+from xml.sax.saxutils import unescape
+
+from senaite.instruments.registry import IMPORT
+from senaite.instruments.registry import get_interfaces
+
+SAMPLE_SIZE = 16 * 1024
+XLS_SAMPLE_SIZE = 256 * 1024
+
+OLE2_MAGIC = "\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+ZIP_MAGIC = "PK\x03\x04"
+
+XLSX_MEMBERS = ("xl/sharedStrings.xml", "xl/worksheets/sheet1.xml")
+
+TAG_RE = re.compile(r"<[^>]*>")
+
+
+def read_xlsx_sample(infile, size=SAMPLE_SIZE):
+    """Returns the beginning of the text held by a XLSX file
+    """
+    try:
+        archive = zipfile.ZipFile(infile)
+        names = archive.namelist()
+        texts = []
+        for name in XLSX_MEMBERS:
+            if name in names:
+                member = archive.open(name)
+                texts.append(member.read(size))
+                member.close()
+    except (zipfile.BadZipfile, IOError):
+        return ""
+    return unescape(" ".join(TAG_RE.sub(" ", text) for text in texts))
+
+
+def read_sample(infile):
+    """Returns the file format (csv, xls or xlsx) and a sample of the text
+    of the file
+    """
+    infile.seek(0)
+    try:
+        head = infile.read(SAMPLE_SIZE)
+        if head.startswith(ZIP_MAGIC):
+            infile.seek(0)
+            return "xlsx", read_xlsx_sample(infile)
+        if head.startswith(OLE2_MAGIC):
+            infile.seek(0)
+            return "xls", infile.read(XLS_SAMPLE_SIZE).replace("\x00", "")
+        return "csv", head
+    finally:
+        infile.seek(0)
+
+
+def match(factory, file_format, text):
+    """Returns the number of markers of the best matching signature of the
+    interface, 0 if none matches
+    """
+    file_formats = factory.metadata.get("file_formats")
+    if file_formats and file_format not in file_formats:
+        return 0
+    matched = [len(markers)
+               for markers in factory.metadata.get("signatures", ())
+               if all(marker in text for marker in markers)]
+    return max(matched) if matched else 0
+
+
+def detect(infile, interfaces=None):
+    """Returns the registry entry (see registry.py) of the import interface
+    the file belongs to and the format of the file (csv, xls or xlsx).
+
+    The entry is None if no interface or more than one interface recognise
+    the file equally well.
+    """
+    if interfaces is None:
+        interfaces = get_interfaces(IMPORT)
+    file_format, text = read_sample(infile)
+    scores = [(match(factory, file_format, text), factory)
+              for factory in interfaces]
+    best = max([score for score, factory in scores] or [0])
+    found = [factory for score, factory in scores if score == best]
+    if not best or len(found) > 1:
+        return None, file_format
+    return found[0], file_format
@@ -0,0 +1,502 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+import json
+import os
+import traceback
+from contextlib import contextmanager
+from time import time
+
+import transaction
+from bika.lims import api
+from bika.lims import bikaMessageFactory as _
+from bika.lims.catalog import CATALOG_WORKSHEET_LISTING
+from bika.lims.interfaces import IWorksheet
+from bika.lims.utils import t
+from senaite.core.exportimport.instruments import IInstrumentAutoImportInterface
+from senaite.core.exportimport.instruments import IInstrumentImportInterface
+from senaite.core.exportimport.instruments.resultsimport import \
+    AnalysisResultsImporter
+from senaite.core.exportimport.instruments.utils import \
+    get_instrument_import_ar_allowed_states
+from senaite.core.exportimport.instruments.utils import \
+    get_instrument_import_override
+from senaite.instruments import logger
+from senaite.instruments.chunks import ResultsChunk
+from senaite.instruments.chunks import copy_results
+from senaite.instruments.chunks import count_results
+from senaite.instruments.chunks import split_results
+from senaite.instruments.incremental import ImportCursor
+from senaite.instruments.instrument import get_row_counts
+from senaite.instruments.instrument import xls_to_csv
+from senaite.instruments.instrument import xlsx_to_csv
+from senaite.instruments.lookup import WorksheetLookup
+from senaite.instruments.memprofile import MemoryProfile
+from senaite.instruments.memprofile import enabled as memory_profile_enabled
+from senaite.instruments.memprofile import memory_phase
+from senaite.instruments.memprofile import profile_memory
+from senaite.instruments.metrics import record_import
+from senaite.instruments.profiling import profile
+from senaite.instruments.profiling import requested as profile_requested
+from senaite.instruments.querycount import record_queries
+from senaite.instruments.querycount import report
+from senaite.instruments.session import ImportSession
+from senaite.instruments.unchanged import skip_unchanged
+from zope.interface import implements
+from ZODB.POSException import ConflictError
+
+# Times a chunk is retried after a conflict error on commit
+CHUNK_RETRIES = 3
+
+
+class ImportRun(object):
+    """One invocation of an import interface.
+
+    Reads the import form, runs the parser and the results importer and
+    collects the messages, timings, catalog query counts and (if enabled)
+    the memory profile for the JSON response.
+    """
+
+    def __init__(self, interface, context, request):
+        form = request.form
+        infile = form.get('instrument_results_file')
+        if isinstance(infile, list):
+            # Posted more than once, the first file uploaded is imported
+            infile = next((item for item in infile
+                           if hasattr(item, 'filename')), None)
+        self.interface = interface
+        self.context = context
+        self.request = request
+        self.form = form
+        self.infile = infile
+        self.instrument = form.get('instrument', None)
+        self.allowed_ar_states = get_instrument_import_ar_allowed_states(
+            form.get('artoapply'))
+        self.override = get_instrument_import_override(
+            form.get('results_override'))
+        self.session = ImportSession(self.instrument)
+        self.worksheet = None
+        self.cursor = None
+        self.chunks = []
+        # Conflict errors the chunks were retried after
+        self.conflicts = 0
+        # Results skipped because the analyses hold the same values already
+        self.unchanged = None
+        # For the metrics: bytes of the file, rows read and rejected by the
+        # parser, results committed
+        self.size = 0
+        self.rows = 0
+        self.rejected = 0
+        self.written = 0
+        self.errors = []
+        self.logs = []
+        self.warns = []
+        self.timings = []
+        self.chunk_size = self.get_chunk_size()
+        self.memory = None
+        if memory_profile_enabled(form):
+            self.memory = MemoryProfile()
+        # cProfile stats, for managers only
+        self.profile = None
+
+    @contextmanager
+    def phase(self, name):
+        start = time()
+        try:
+            with memory_phase(name):
+                yield
+        finally:
+            self.timings.append((name, time() - start))
+
+    def process_profiled(self):
+        if self.memory is None:
+            return self.process()
+        with profile_memory(self.memory):
+            self.process()
+        self.logs.append(self.memory.message())
+
+    def process_captured(self):
+        """Processes the import under cProfile if a manager asked for it
+        """
+        if not profile_requested(self.request, self.context):
+            return self.process_profiled()
+        with profile(self.interface.title) as self.profile:
+            self.process_profiled()
+        self.logs.append(self.profile.message())
+
+    def get_worksheet(self):
+        """Returns the worksheet the import is scoped to, if any: the one
+        with the ID or UID of the `worksheet` form value or the worksheet
+        imported from
+        """
+        value = (self.form.get('worksheet') or '').strip()
+        if value:
+            worksheet = api.get_object_by_uid(value, None)
+            if not worksheet:
+                query = dict(portal_type='Worksheet', getId=value)
+                brains = api.search(query, CATALOG_WORKSHEET_LISTING)
+                worksheet = brains and api.get_object(brains[0]) or None
+            if IWorksheet.providedBy(worksheet):
+                return worksheet
+            self.warns.append("Worksheet {} not found, results are "
+                              "imported for any sample".format(value))
+        if IWorksheet.providedBy(self.context):
+            return self.context
+        return None
+
+    def get_chunk_size(self):
+        """Returns the number of samples committed at once: the
+        `chunk_size` form value, or the default of the interface if there
+        is none or it is not a positive number
+        """
+        value = self.form.get('chunk_size')
+        try:
+            chunk_size = int(value or 0)
+        except (TypeError, ValueError):
+            chunk_size = -1
+        if chunk_size < 0:
+            self.warns.append(
+                "Invalid chunk size {}, the default is used".format(value))
+            chunk_size = 0
+        return chunk_size or self.interface.chunk_size
+
+    def get_size(self):
+        """Returns the size of the uploaded file in bytes
+        """
+        try:
+            return os.fstat(self.infile.fileno()).st_size
+        except (AttributeError, EnvironmentError, ValueError):
+            pass
+        try:
+            self.infile.seek(0, 2)
+            size = self.infile.tell()
+            self.infile.seek(0)
+            return size
+        except (AttributeError, EnvironmentError):
+            return 0
+
+    def decode(self, worksheet=0, delimiter=","):
+        """Returns the lines of the uploaded file, the rows of a sheet of
+        the XLSX and XLS files as CSV. The other spreadsheet format is
+        tried if the file is not of the format of its extension. None if
+        the file can not be decoded (the reason is added to the errors)
+        """
+        filename = self.infile.filename.lower()
+        order = ()
+        if '.xlsx' in filename:
+            order = (xlsx_to_csv, xls_to_csv)
+        elif '.xls' in filename:
+            order = (xls_to_csv, xlsx_to_csv)
+        elif '.csv' in filename:
+            self.infile.seek(0)
+            return self.infile.readlines()
+        with self.phase('decode'):
+            for to_csv in order:
+                try:
+                    return to_csv(self.infile, worksheet=worksheet,
+                                  delimiter=delimiter).readlines()
+                except Exception:
+                    pass
+        self.errors.append(_("Can't parse input file as XLS, XLSX, or CSV."))
+        return None
+
+    def validate(self):
+        if not hasattr(self.infile, 'filename'):
+            self.errors.append(_("No file selected"))
+            return False
+        file_formats = self.interface.file_formats
+        extension = self.infile.filename.split('.')[-1].lower()
+        if file_formats and extension not in file_formats:
+            self.errors.append(t(_(
+                "Input file format must be ${file_formats}",
+                mapping={"file_formats": ", ".join(file_formats)})))
+            return False
+        if self.interface.incremental and self.form.get('incremental') \
+                and not self.instrument:
+            # The lines imported before are remembered per instrument and
+            # file name, the files of any instrument can share a name
+            self.errors.append(_(
+                "Select the instrument to import its results incrementally"))
+            return False
+        return True
+
+    def process(self):
+        if not self.validate():
+            return
+        self.size = self.get_size()
+
+        self.worksheet = self.get_worksheet()
+        if self.worksheet:
+            with self.phase('preload'):
+                self.session.lookup = WorksheetLookup(self.worksheet)
+
+        if self.interface.incremental and self.form.get('incremental'):
+            self.cursor = ImportCursor(self.instrument, self.infile.filename)
+
+        parser = self.interface.get_parser(self)
+        if not parser:
+            return
+        tbex = ''
+        try:
+            with self.phase('parse'):
+                parsed = parser.parse()
+            self.rows, self.rejected = get_row_counts(parser)
+            # The results importer calls parse() again
+            parser.parse = lambda: parsed
+            if self.override[0]:
+                with self.phase('compare'):
+                    self.skip_unchanged(parser)
+            with self.phase('commit'):
+                if not parser.getRawResults():
+                    self.add_parser_messages(parser)
+                elif self.use_chunks(parser):
+                    self.process_chunks(parser)
+                else:
+                    self.process_results(parser)
+        except Exception:
+            tbex = traceback.format_exc()
+        if tbex:
+            self.errors.append(tbex)
+        elif self.cursor and not self.errors:
+            self.cursor.commit()
+
+    def skip_unchanged(self, parser):
+        """Removes the results of the analyses that hold the same values
+        already, so they are not written again
+        """
+        self.unchanged = skip_unchanged(
+            parser.getRawResults(), self.session.lookup,
+            empty=self.override[1])
+        if self.unchanged:
+            self.logs.append(
+                "{} unchanged results skipped".format(self.unchanged))
+
+    def add_parser_messages(self, parser):
+        self.errors.extend(parser.errors)
+        self.logs.extend(parser.logs)
+        self.warns.extend(parser.warns)
+
+    def use_chunks(self, parser):
+        if not self.chunk_size:
+            return False
+        return len(parser.getRawResults()) > self.chunk_size
+
+    def get_importer(self, parser):
+        importer = self.interface.get_importer(parser, self)
+        self.scope_importer(importer)
+        return importer
+
+    def scope_importer(self, importer):
+        """Makes the results importer resolve the samples known by the
+        session lookup (the samples of the worksheet, samples resolved by
+        UID or prefetched by the parser) rather than searching the catalogs.
+
+        Other IDs (e.g. reference samples) are searched as usual, see
+        search_analyses.
+        """
+        lookup = self.session.lookup
+        search = importer._getZODBAnalyses
+
+        def _getZODBAnalyses(objid):
+            if not lookup.has_sample(objid):
+                return self.search_analyses(search, objid)
+            sample = lookup.get_sample(objid)
+            allowed_states = importer.getAllowedAnalysisStates()
+            analyses = []
+            if api.get_review_status(sample) in \
+                    importer.getAllowedARStates():
+                analyses = [api.get_object(brain)
+                            for brains in lookup.get_analyses(sample).values()
+                            for brain in brains
+                            if brain.review_state in allowed_states]
+            if not analyses:
+                # As the results importer does for the samples it searches
+                importer.warn(
+                    "No analyses '${allowed_analysis_states}' states found "
+                    "for ${object_id}",
+                    mapping={"allowed_analysis_states": ", ".join(
+                        allowed_states), "object_id": objid})
+            return analyses
+
+        importer._getZODBAnalyses = _getZODBAnalyses
+
+    def search_analyses(self, search, objid):
+        """Returns the analyses of an ID the session lookup does not know,
+        found by the `search` of the results importer. An import scoped to
+        a worksheet only gets the analyses of the worksheet (e.g. those of
+        its reference samples), not those of samples elsewhere
+        """
+        analyses = search(objid)
+        if not self.worksheet:
+            return analyses
+        worksheet_uid = self.worksheet.UID()
+        analyses = [analysis for analysis in analyses
+                    if analysis.getWorksheetUID() == worksheet_uid]
+        if not analyses:
+            self.warns.append(
+                "{} is not in worksheet {}, its results are not "
+                "imported".format(objid, self.worksheet.getId()))
+        return analyses
+
+    def process_results(self, parser):
+        importer = self.get_importer(parser)
+        # The results importer consumes the values it imports
+        results = count_results(parser.getRawResults())
+        try:
+            importer.process()
+            self.written += results
+        finally:
+            self.errors.extend(importer.errors)
+            self.logs.extend(importer.logs)
+            self.warns.extend(importer.warns)
+
+    def process_chunks(self, parser):
+        """Imports the results committing every `chunk_size` samples.
+
+        Each chunk is imported within a savepoint and committed on its own,
+        so the write set and the connection cache stay bounded and a
+        conflict only retries the chunk it happened in. A chunk that fails
+        is rolled back and the import continues with the next one.
+        """
+        self.add_parser_messages(parser)
+        allresults = parser.getRawResults()
+        total = -(-len(allresults) // self.chunk_size)
+        chunks = split_results(allresults, self.chunk_size)
+        for number, rawresults in enumerate(chunks, 1):
+            status = self.process_chunk(parser, rawresults)
+            self.chunks.append(dict(
+                chunk=number, samples=len(rawresults), status=status))
+            self.logs.append("Chunk {}/{} ({} samples): {}".format(
+                number, total, len(rawresults), status))
+            if status == "committed":
+                # Released, the results are in the database now
+                for resid in rawresults:
+                    del allresults[resid]
+            api.get_portal()._p_jar.cacheGC()
+
+    def process_chunk(self, parser, rawresults):
+        results = count_results(rawresults)
+        values = rawresults
+        for attempt in range(CHUNK_RETRIES + 1):
+            # The results importer consumes the values it imports, a copy
+            # is kept for the attempt after a conflict, if any
+            retry = copy_results(values) if attempt < CHUNK_RETRIES else None
+            importer = self.get_importer(ResultsChunk(parser, values))
+            values = retry
+            savepoint = transaction.savepoint(optimistic=True)
+            try:
+                importer.process()
+            except ConflictError:
+                transaction.abort()
+                self.conflicts += 1
+                continue
+            except Exception:
+                savepoint.rollback()
+                self.errors.extend(importer.errors)
+                self.errors.append(traceback.format_exc())
+                return "failed"
+            try:
+                transaction.commit()
+            except ConflictError:
+                transaction.abort()
+                self.conflicts += 1
+                continue
+            self.errors.extend(importer.errors)
+            self.logs.extend(importer.logs)
+            self.warns.extend(importer.warns)
+            self.written += results
+            return "committed"
+        self.errors.append(
+            "Chunk not imported after {} conflict errors".format(attempt + 1))
+        return "conflict"
+
+    def get_stats(self):
+        return dict(status="failed" if self.errors else "ok",
+                    rows=self.rows,
+                    rejected_rows=self.rejected,
+                    results_written=self.written,
+                    decoded_bytes=self.size)
+
+    def run(self):
+        start = time()
+        with record_queries() as queries:
+            self.process_captured()
+        title = self.interface.title
+        record_import(title, self.get_stats(), self.timings, time() - start)
+        report(title, queries)
+        self.logs.append(queries.message())
+        if self.timings:
+            timings = ", ".join(
+                "{} {:.3f}s".format(name, seconds)
+                for name, seconds in self.timings)
+            logger.info("{}: {}".format(title, timings))
+            self.logs.append(timings)
+        results = {
+            'errors': self.errors,
+            'log': self.logs,
+            'warns': self.warns,
+            'catalog_queries': queries.summary(),
+            'timings': dict(self.timings),
+        }
+        if self.chunks:
+            results['chunks'] = self.chunks
+            results['conflicts'] = self.conflicts
+        if self.unchanged is not None:
+            results['unchanged'] = self.unchanged
+        if self.memory is not None:
+            results['memory'] = self.memory.summary()
+        if self.profile is not None:
+            results['profile'] = self.profile.summary()
+            results['profile']['url'] = "{}/import_profile?id={}".format(
+                api.get_url(api.get_portal()), self.profile.id)
+        return json.dumps(results)
+
+
+class ImportInterface(object):
+    """Base class for the import interfaces of this package.
+
+    The form handling, the results importer setup and the reporting are
+    done by ImportRun. Subclasses set the title and return their parser
+    from get_parser.
+    """
+    implements(IInstrumentImportInterface, IInstrumentAutoImportInterface)
+    title = None
+    # File extensions accepted, None to accept any
+    file_formats = None
+    # Whether the parser supports the incremental mode (ImportCursor)
+    incremental = False
+    # Commit every chunk_size samples, 0 to import in a single transaction.
+    # Can be set in the import form too.
+    chunk_size = 0
+    importer_class = AnalysisResultsImporter
+
+    def __init__(self, context):
+        self.context = context
+        self.request = None
+
+    @classmethod
+    def Import(cls, context, request):
+        return ImportRun(cls, context, request).run()
+
+    @classmethod
+    def get_parser(cls, run):
+        """Returns the parser for the uploaded file, or None if the file
+        can not be parsed (add the reason to run.errors)
+        """
+        run.errors.append(t(_(
+            "The import interface ${title} has no parser",
+            mapping={"title": cls.title or cls.__name__})))
+        return None
+
+    @classmethod
+    def get_importer(cls, parser, run):
+        return cls.importer_class(
+            parser=parser,
+            context=run.context,
+            allowed_ar_states=run.allowed_ar_states,
+            allowed_analysis_states=None,
+            override=run.override,
+            instrument_uid=run.instrument)
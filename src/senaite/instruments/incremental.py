@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+from hashlib import sha1
+from os.path import basename
+
+from BTrees.OOBTree import OOBTree
+from bika.lims import api
+from zope.annotation.interfaces import IAnnotations
+
+ANNOTATION_KEY = "senaite.instruments.incremental"
+
+
+def digest(line):
+    return sha1(line.rstrip("\r\n")).hexdigest()
+
+
+def get_storage(create=False):
+    """Returns the BTree holding the import cursors of the site
+    """
+    annotations = IAnnotations(api.get_portal())
+    storage = annotations.get(ANNOTATION_KEY)
+    if storage is None and create:
+        storage = annotations[ANNOTATION_KEY] = OOBTree()
+    return storage
+
+
+class ImportCursor(object):
+    """Remembers how many lines of a growing results file were imported.
+
+    Instruments that append rows to the same export during a run can be
+    imported repeatedly: only the lines after the ones imported before
+    are parsed. The cursor is identified by the instrument and the file
+    name, and is only trusted if the header line and the last imported
+    line are still the same, otherwise the whole file is imported again.
+    """
+
+    def __init__(self, instrument_uid, filename):
+        filename = basename(str(filename or "")).lower()
+        self.key = "{}:{}".format(instrument_uid or "", filename)
+        self._pending = None
+
+    def start(self, lines):
+        """Returns the number of leading lines that were already imported
+        """
+        self._pending = None
+        if lines:
+            self._pending = (len(lines), digest(lines[0]), digest(lines[-1]))
+        storage = get_storage()
+        if not storage or self.key not in storage:
+            return 0
+        count, header, last = storage[self.key]
+        if not count or count > len(lines):
+            return 0
+        if digest(lines[0]) != header or digest(lines[count - 1]) != last:
+            return 0
+        return count
+
+    def commit(self):
+        """Stores the lines seen by the last call to start as imported
+        """
+        if self._pending is None:
+            return
+        get_storage(create=True)[self.key] = self._pending
+
+    def reset(self):
+        storage = get_storage()
+        if storage and self.key in storage:
+            del storage[self.key]
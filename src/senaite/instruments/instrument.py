@@ -1,13 +1,107 @@
-import types
-
-import openpyxl
-from openpyxl import load_workbook
+from senaite.core.exportimport.instruments.resultsimport import InstrumentCSVResultsFileParser
 from senaite.core.exportimport.instruments.resultsimport import InstrumentResultsFileParser
+import mmap
+import os
 from cStringIO import StringIO
-from xlrd import open_workbook
+from itertools import izip
+from senaite.instruments import logger
+from senaite.instruments.columns import ProjectionPlan
+from senaite.instruments.columns import split_line
+from senaite.instruments.csvchunks import get_names
+from senaite.instruments.csvchunks import parse_chunk
+from senaite.instruments.csvchunks import split_ranges
+from senaite.instruments.memprofile import memory_phase
+from senaite.instruments.workers import get_parse_pool
+from senaite.instruments.workers import iter_lines
 from zope.publisher.browser import FileUpload
 
 
+def read_contents(infile):
+    """Returns the whole contents of an uploaded file
+    """
+    if hasattr(infile, "seek"):
+        infile.seek(0)
+    return infile.read()
+
+
+def get_source(infile):
+    """Returns where to decode an uploaded spreadsheet from: the path of
+    the file if it is on disk, else its contents, memory mapped if the
+    upload is backed by a file
+    """
+    name = getattr(infile, "name", None)
+    if isinstance(name, basestring) and os.path.isfile(name):
+        return dict(path=name)
+    try:
+        fileno = infile.fileno()
+        if os.fstat(fileno).st_size:
+            return dict(contents=mmap.mmap(
+                fileno, 0, access=mmap.ACCESS_READ))
+    except (AttributeError, EnvironmentError, ValueError):
+        pass
+    return dict(contents=read_contents(infile))
+
+
+def iter_decoded(lines, phase="decode"):
+    """Yields the lines, the ones after the first within a memory phase.
+
+    The phase starts when the second line is read and ends when the lines
+    are exhausted or the iterator is closed, so it accounts for the lines
+    decoded while they are parsed.
+    """
+    lines = iter(lines)
+    yield next(lines)
+    with memory_phase(phase):
+        for line in lines:
+            yield line
+
+
+class LineStream(object):
+    """Read-only file over the lines of a spreadsheet, decoded as they are
+    read.
+
+    The first line is decoded right away, so a file that can not be
+    decoded fails when the stream is created.
+    """
+
+    def __init__(self, lines):
+        self._lines = iter(lines)
+        self._pending = next(self._lines, "")
+
+    def close(self):
+        """Stops decoding the lines that were not read
+        """
+        self._pending = ""
+        if hasattr(self._lines, "close"):
+            self._lines.close()
+
+    def readline(self):
+        line = self._pending
+        if line:
+            self._pending = next(self._lines, "")
+        return line
+
+    def __iter__(self):
+        return iter(self.readline, "")
+
+    def readlines(self):
+        return list(self)
+
+    def read(self):
+        return "".join(self)
+
+
+def spreadsheet_lines(infile, fmt, worksheet=0, delimiter=","):
+    """Returns a LineStream over the rows of a XLS or XLSX sheet. Opening
+    the sheet is the open memory phase, decoding the rows while they are
+    read the decode one
+    """
+    with memory_phase("open"):
+        return LineStream(iter_decoded(iter_lines(
+            fmt, worksheet=worksheet, delimiter=delimiter,
+            **get_source(infile))))
+
+
 def xls_to_csv(infile, worksheet=0, delimiter=","):
     # TODO: Move to utility module
     """
@@ -15,27 +109,9 @@ def xls_to_csv(infile, worksheet=0, delimiter=","):
     convenience of the CSV library
 
     """
-    def find_sheet(wb, worksheet):
-        for sheet in wb.sheets():
-            if sheet.name == worksheet:
-                return sheet
-
-    wb = open_workbook(file_contents=infile.read())
-    sheet = wb.sheets()[worksheet]
-
-    buffer = StringIO()
-
-    # extract all rows
-    for row in sheet.get_rows():
-        line = []
-        for cell in row:
-            value = cell.value
-            if type(value) in types.StringTypes:
-                value = value.encode("utf8")
-            if value is None:
-                value = ""
-            line.append(str(value))
-        print >>buffer, delimiter.join(line)
+    lines = iter_lines("xls", worksheet=worksheet, delimiter=delimiter,
+                       **get_source(infile))
+    buffer = StringIO("".join(lines))
     buffer.seek(0)
     return buffer
 
@@ -46,24 +122,9 @@ def xlsx_to_csv(infile, worksheet=0, delimiter=","):
     convenience of the CSV library
 
     """
-    wb = load_workbook(filename=infile)
-    sheet = wb.worksheets[worksheet]
-    buffer = StringIO()
-
-    # extract all rows
-    rows = list(sheet.rows)
-    for row in rows:
-        line = []
-        for cell in row:
-            value = cell.value
-            try:
-                value = value.encode("utf8")
-            except:
-                pass
-            if value is None:
-                value = ""
-            line.append(str(value).split("\n")[0].strip())
-        buffer.write(delimiter.join(line) + "\n")
+    lines = iter_lines("xlsx", worksheet=worksheet, delimiter=delimiter,
+                       **get_source(infile))
+    buffer = StringIO("".join(lines))
     buffer.seek(0)
     return buffer
 
@@ -76,6 +137,32 @@ class FileStub:
         self.filename = name
 
 
+class RowCounts(object):
+    """Counts of the rows of the results table a parser read and rejected,
+    for the import metrics. Mixed into the parsers that do not keep the
+    line number in `_numline` and that warn about the rows they reject
+    """
+    rows_read = 0
+    rows_rejected = 0
+
+    def read_row(self):
+        self.rows_read += 1
+
+    def reject_row(self, msg, **kwargs):
+        """Warns about a row that is not imported
+        """
+        self.rows_rejected += 1
+        self.warn(msg, **kwargs)
+
+
+def get_row_counts(parser):
+    """Returns the number of rows the parser read and rejected
+    """
+    if isinstance(parser, RowCounts):
+        return parser.rows_read, parser.rows_rejected
+    return getattr(parser, '_numline', 0), len(parser.errors)
+
+
 class InstrumentXLSResultsFileParser(InstrumentResultsFileParser):
     """ Parser
     """
@@ -83,15 +170,15 @@ class InstrumentXLSResultsFileParser(InstrumentResultsFileParser):
         InstrumentResultsFileParser.__init__(self, infile, encoding.upper())
         # Convert xls to csv
         self._delimiter = delimiter if delimiter else "|"
-        if encoding == 'xlsx':
-            csv_data = xlsx_to_csv(
-                infile, worksheet=worksheet, delimiter=self._delimiter)
-        elif encoding == 'xls':
-            csv_data = xls_to_csv(
-                infile, worksheet=worksheet, delimiter=self._delimiter)
+        # The rows are decoded while they are parsed
+        if encoding in ('xlsx', 'xls'):
+            csv_data = spreadsheet_lines(
+                infile, encoding, worksheet=worksheet,
+                delimiter=self._delimiter)
 
         # adpat csv_data into a FileUpload for parse method
         self._infile = infile
+        self._csv_data = csv_data
         stub = FileStub(file=csv_data, name=str(infile.filename))
         self._csvfile = FileUpload(stub)
 
@@ -99,6 +186,13 @@ class InstrumentXLSResultsFileParser(InstrumentResultsFileParser):
         self._end_header = False
 
     def parse(self):
+        try:
+            return self.parse_lines()
+        finally:
+            # Ends the decode phase of the lines left
+            self._csv_data.close()
+
+    def parse_lines(self):
         infile = self._csvfile
         self.log("Parsing file ${file_name}",
                  mapping={"file_name": infile.filename})
@@ -110,7 +204,7 @@ class InstrumentXLSResultsFileParser(InstrumentResultsFileParser):
         except AttributeError:
             f = infile
 
-        for line in f.readlines():
+        for line in iter(f.readline, ''):
             self._numline += 1
             if jump == -1:
                 # Something went wrong. Finish
@@ -137,3 +231,160 @@ class InstrumentXLSResultsFileParser(InstrumentResultsFileParser):
                      "total_results": self.getResultsTotalCount()}
         )
         return True
+
+
+class ChunkedCSVResultsFileParser(InstrumentCSVResultsFileParser):
+    """CSV parser that parses the rows of the results table of large files
+    in chunks, in the parse worker processes (see csvchunks.py).
+
+    The lines up to the header row of the table are parsed as usual. The
+    rows after it are split in chunks, parsed with the projection plan of
+    the header and handed to add_result in file order. Subclasses set the
+    columns, the header_rule of the table and keep the plan in _plan.
+    """
+    columns = ()
+    # (csvchunks.PREFIX or csvchunks.CELL, label) of the table header row
+    header_rule = None
+    # Files from this size are parsed in chunks
+    chunk_threshold = 32 * 1024 * 1024
+    # Parsed in chunks only if there is a newline within this many bytes
+    line_probe = 64 * 1024
+
+    def __init__(self, infile, encoding=None):
+        InstrumentCSVResultsFileParser.__init__(self, infile, encoding)
+        # Only the parsers that add the results of the rows in add_result
+        # are parsed in chunks, the others as usual
+        self.chunked = bool(self.header_rule) and \
+            type(self).add_result != ChunkedCSVResultsFileParser.add_result
+
+    def make_plan(self, header=None):
+        return ProjectionPlan(self.columns, header)
+
+    def add_result(self, values, interims):
+        """Adds the raw result of a row: `values` are the projected cells of
+        the columns that are no interims, `interims` the coerced interim
+        values
+        """
+        raise NotImplementedError
+
+    def get_chunk_source(self):
+        """Returns the contents of the file to parse in chunks, a string or
+        a mmap, and its path if it is on disk. None if the file is to be
+        parsed as usual
+        """
+        if not self.chunked or get_parse_pool() is None:
+            return None
+        infile = self.getInputFile()
+        source = get_source(infile)
+        # The file is read from the start by a sequential parse
+        if hasattr(infile, "seek"):
+            infile.seek(0)
+        path = source.get("path")
+        if path:
+            if os.path.getsize(path) < self.chunk_threshold:
+                return None
+            with open(path, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            data = source["contents"]
+            if len(data) < self.chunk_threshold:
+                return None
+        if data.find("\n", 0, self.line_probe) < 0:
+            return None
+        return data, path
+
+    def parse(self):
+        source = self.get_chunk_source()
+        if source is None:
+            return InstrumentCSVResultsFileParser.parse(self)
+        data, path = source
+        try:
+            return self.parse_chunked(data, path)
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+    def parse_preamble(self, data):
+        """Parses the lines up to the header row of the results table.
+        Returns the offset of the line after it
+        """
+        offset = 0
+        while offset < len(data):
+            if self._end_header and self._plan.header:
+                break
+            end = data.find("\n", offset)
+            end = len(data) if end < 0 else end + 1
+            line = data[offset:end].strip()
+            offset = end
+            self._numline += 1
+            if line:
+                self._parseline(line)
+        return offset
+
+    def get_chunk_task(self, path, start, end, data):
+        task = {
+            "kind": "parse",
+            "columns": [(column.name, column.labels, column.index,
+                         column.interim) for column in self.columns],
+            "header": list(self._plan.header),
+            "header_rule": self.header_rule,
+            "delimiter": self._delimiter,
+            "path": path,
+            "start": start,
+            "end": end,
+            "contents": None,
+        }
+        if not path:
+            task["contents"] = data[start:end]
+        return task
+
+    def parse_chunked(self, data, path):
+        self.log("Parsing file ${file_name}",
+                 mapping={"file_name": self.getInputFile().filename})
+        pool = get_parse_pool()
+        offset = self.parse_preamble(data)
+        tasks = [self.get_chunk_task(path, start, end, data)
+                 for start, end in split_ranges(
+                     data, offset, len(data), pool.size)]
+        try:
+            replies = pool.map(tasks)
+        except Exception as e:
+            logger.warn("No parse worker available, parsing in-process: "
+                        "{}".format(e))
+            replies = iter([None] * len(tasks))
+        value_names, interim_names = get_names(self.columns)
+        header = list(self._plan.header)
+        base = self._numline
+        for task, rows in izip(tasks, replies):
+            if rows is None or task["header"] != header:
+                # The worker failed, or a header row in a previous chunk
+                # changed the plan
+                task["header"] = header
+                rows = parse_chunk(data[task["start"]:task["end"]], task,
+                                   self.make_plan, split_line)
+            for row in rows:
+                kind, numline = row[:2]
+                self._numline = base + numline
+                if kind == "row":
+                    values, interims, invalid = row[2:]
+                    for name, value in invalid:
+                        # Reports the value as a sequential parse does
+                        self.get_result(name, value, 0)
+                    self.add_result(dict(izip(value_names, values)),
+                                    dict(izip(interim_names, interims)))
+                elif kind == "header":
+                    header = row[2]
+                    self._header = header
+                    self._plan = self.make_plan(header)
+            base = self._numline
+
+        self.log("Parsed in ${chunks} chunks",
+                 mapping={"chunks": len(tasks)})
+        self.log(
+            "End of file reached successfully: ${total_objects} objects, "
+            "${total_analyses} analyses, ${total_results} results",
+            mapping={"total_objects": self.getObjectsTotalCount(),
+                     "total_analyses": self.getAnalysesTotalCount(),
+                     "total_results": self.getResultsTotalCount()}
+        )
+        return True
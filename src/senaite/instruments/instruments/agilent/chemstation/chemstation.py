@@ -1,101 +1,108 @@
 import csv
-import json
-import traceback
 from bika.lims import api
 from bika.lims import bikaMessageFactory as _
-from senaite.core.exportimport.instruments import IInstrumentAutoImportInterface
 from senaite.core.exportimport.instruments import IInstrumentExportInterface
-from senaite.core.exportimport.instruments import IInstrumentImportInterface
-from senaite.core.exportimport.instruments.instrument import format_keyword
-from senaite.core.exportimport.instruments.resultsimport import AnalysisResultsImporter
 from bika.lims.utils import t
 from cStringIO import StringIO
-from DateTime import DateTime
-from plone.i18n.normalizer.interfaces import IIDNormalizer
+from senaite.instruments.importer import ImportInterface
 from senaite.instruments.instrument import InstrumentXLSResultsFileParser
-from zope.component import getUtility
+from senaite.instruments.normalize import format_keyword
+from senaite.instruments.profiling import profiled
+from senaite.instruments.querycount import count_queries
+from senaite.instruments.rawresults import Schema
+from senaite.instruments.sequence import get_samples
+from senaite.instruments.sequence import get_tray_options
+from senaite.instruments.sequence import schedule
+from senaite.instruments.sequence import sequence_filename
+from senaite.instruments.sequence import stream_files
+from senaite.instruments.session import ExportSession
+from senaite.instruments.session import ImportSession
 from zope.interface import implements
 
 
 class chemstationexport(object):
     implements(IInstrumentExportInterface)
     title = "Agilent ChemStation Exporter"
+    content_type = 'text/comma-separated-values'
+    disposition = 'inline'
 
     def __init__(self, context):
         self.context = context
         self.request = None
 
+    @profiled
+    @count_queries
     def Export(self, context, request):
-        tray = 1
-        now = DateTime().strftime('%Y%m%d-%H%M')
-        uc = api.get_tool('uid_catalog')
-        instrument = context.getInstrument()
-        norm = getUtility(IIDNormalizer).normalize
+        files = self.render(context)
+        # stream file to browser
+        stream_files(request, files, self.content_type, self.disposition)
+
+    def render(self, context, lookup=None):
+        """Returns the sequence files of the worksheet, (filename, data)
+        pairs. The lookup can be shared by several worksheets.
+        """
+        session = ExportSession(context, defaults={
+            'dilute_factor': 1,
+            'method': 'F SO2 & T SO2'
+        }, lookup=lookup)
+        now = session.now.strftime('%Y%m%d-%H%M')
+        instrument = session.instrument
+        norm = session.normalize
         filename = '{}-{}.csv'.format(
             context.getId(), norm(instrument.getDataInterface()))
         listname = '{}_{}_{}'.format(
             context.getId(), norm(instrument.Title()), now)
-        options = {
-            'dilute_factor': 1,
-            'method': 'F SO2 & T SO2'
-        }
-        for k, v in instrument.getDataInterfaceOptions():
-            options[k] = v
+        options = session.options
 
         # for looking up "cup" number (= slot) of ARs
-        parent_to_slot = {}
         layout = context.getLayout()
-        for x in range(len(layout)):
-            a_uid = layout[x]['analysis_uid']
-            p_uid = uc(UID=a_uid)[0].getObject().aq_parent.UID()
-            layout[x]['parent_uid'] = p_uid
-            if p_uid not in parent_to_slot.keys():
-                parent_to_slot[p_uid] = int(layout[x]['position'])
-
-        # write rows, one per PARENT
-        header = [listname, options['method']]
-        rows = []
-        rows.append(header)
-        tmprows = []
-        ARs_exported = []
-        for x in range(len(layout)):
-            # create batch header row
-            c_uid = layout[x]['container_uid']
-            p_uid = layout[x]['parent_uid']
-            if p_uid in ARs_exported:
-                continue
-            cup = parent_to_slot[p_uid]
-            tmprows.append([tray,
-                            cup,
-                            p_uid,
-                            c_uid,
-                            options['dilute_factor'],
-                            ""])
-            ARs_exported.append(p_uid)
-        tmprows.sort(lambda a, b: cmp(a[1], b[1]))
-        rows += tmprows
-
-        ramdisk = StringIO()
-        writer = csv.writer(ramdisk, delimiter=';')
-        assert(writer)
-        writer.writerows(rows)
-        result = ramdisk.getvalue()
-        ramdisk.close()
-
-        # stream file to browser
-        setheader = request.RESPONSE.setHeader
-        setheader('Content-Length', len(result))
-        setheader('Content-Type', 'text/comma-separated-values')
-        setheader('Content-Disposition', 'inline; filename=%s' % filename)
-        request.RESPONSE.write(result)
+        lookup = session.lookup
+        lookup.prefetch([item['analysis_uid'] for item in layout])
+        for item in layout:
+            item['parent_uid'] = lookup.get_parent_uid(item['analysis_uid'])
+
+        # pack the ARs in the trays of the autosampler
+        capacity, trays = get_tray_options(options)
+        methods = {}
+        if capacity:
+            methods = lookup.get_methods(
+                [item['analysis_uid'] for item in layout])
+        sequences = schedule(get_samples(layout, methods), capacity, trays)
+
+        # write rows, one per PARENT, one file per sequence
+        files = []
+        for number, sequence in enumerate(sequences or [[]], 1):
+            name = listname
+            if len(sequences) > 1:
+                name = '{}-{}'.format(listname, number)
+            rows = [[name, options['method']]]
+            for item in sequence:
+                rows.append([item['tray'],
+                             item['vial'],
+                             item['parent_uid'],
+                             item['container_uid'],
+                             options['dilute_factor'],
+                             ""])
+            ramdisk = StringIO()
+            writer = csv.writer(ramdisk, delimiter=';')
+            writer.writerows(rows)
+            files.append((sequence_filename(filename, number, len(sequences)),
+                          ramdisk.getvalue()))
+            ramdisk.close()
+        return files
 
 
 class ChemStationParser(InstrumentXLSResultsFileParser):
     """ Parser
     """
-    def __init__(self, infile, encoding=None):
+    # Fields of the raw result records, shared by all of them
+    schema = Schema(('DefaultResult', 'Remarks', 'Amount', 'ReturnTime',
+                     'Area', 'QVal'))
+
+    def __init__(self, infile, encoding=None, session=None):
         InstrumentXLSResultsFileParser.__init__(
             self, infile, worksheet=2, encoding=encoding)
+        self.session = session if session else ImportSession()
         self._end_header = False
         self._ar_id = None
 
@@ -116,7 +123,9 @@ class ChemStationParser(InstrumentXLSResultsFileParser):
             self._end_header = True
 
         if splitted[0].startswith('Sample Name:'):
-            self._ar_id = splitted[0].split(':')[1].strip()
+            # The exporter names the samples after their UID
+            self._ar_id = self.session.lookup.resolve(
+                splitted[0].split(':')[1].strip())
 
         return 0
 
@@ -133,10 +142,9 @@ class ChemStationParser(InstrumentXLSResultsFileParser):
             return 0
 
         # No default
-        record = {
-            'DefaultResult': None,
-            'Remarks': ''
-        }
+        record = self.schema.record(
+            DefaultResult=None,
+            Remarks='')
         # 4 Interim fields
         value_column = 'Amount'
         result = splitted[4]
@@ -181,70 +189,15 @@ class ChemStationParser(InstrumentXLSResultsFileParser):
         return
 
 
-class chemstationimport(object):
-    implements(IInstrumentImportInterface, IInstrumentAutoImportInterface)
+class chemstationimport(ImportInterface):
     title = "Agilent ChemStation"
 
-    def __init__(self, context):
-        self.context = context
-        self.request = None
-
-    def Import(self, context, request):
-        """ Import Form
-        """
-        infile = request.form['instrument_results_file']
-        fileformat = request.form.get(
-            'instrument_results_file_format', 'xls')
-        artoapply = request.form['artoapply']
-        override = request.form['results_override']
-        instrument = request.form.get('instrument', None)
-        errors = []
-        logs = []
-        warns = []
-
-        # Load the most suitable parser according to file extension/options/etc...
-        parser = None
-        if not hasattr(infile, 'filename'):
-            errors.append(_("No file selected"))
-        if fileformat in ('xls', 'xlsx'):
-            parser = ChemStationParser(infile, encoding=fileformat)
-        else:
-            errors.append(t(_("Unrecognized file format ${fileformat}",
-                              mapping={"fileformat": fileformat})))
-
-        if parser:
-            # Load the importer
-            status = ['sample_received', 'attachment_due', 'to_be_verified']
-            if artoapply == 'received':
-                status = ['sample_received']
-            elif artoapply == 'received_tobeverified':
-                status = ['sample_received', 'attachment_due', 'to_be_verified']
-
-            over = [False, False]
-            if override == 'nooverride':
-                over = [False, False]
-            elif override == 'override':
-                over = [True, False]
-            elif override == 'overrideempty':
-                over = [True, True]
-
-            importer = AnalysisResultsImporter(
-                parser=parser,
-                context=context,
-                allowed_ar_states=status,
-                allowed_analysis_states=None,
-                override=over,
-                instrument_uid=instrument)
-            tbex = ''
-            try:
-                importer.process()
-                errors = importer.errors
-                logs = importer.logs
-                warns = importer.warns
-            except Exception as e:
-                tbex = traceback.format_exc()
-                errors.append(tbex)
-
-        results = {'errors': errors, 'log': logs, 'warns': warns}
-
-        return json.dumps(results)
+    @classmethod
+    def get_parser(cls, run):
+        fileformat = run.form.get('instrument_results_file_format', 'xls')
+        if fileformat not in ('xls', 'xlsx'):
+            run.errors.append(t(_("Unrecognized file format ${fileformat}",
+                                  mapping={"fileformat": fileformat})))
+            return None
+        return ChemStationParser(run.infile, encoding=fileformat,
+                                 session=run.session)
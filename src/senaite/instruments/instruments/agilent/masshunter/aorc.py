@@ -1,30 +1,39 @@
-import json
-import traceback
 from bika.lims import api
 from bika.lims import bikaMessageFactory as _
-from senaite.core.exportimport.instruments import IInstrumentAutoImportInterface
-from senaite.core.exportimport.instruments import IInstrumentImportInterface
-from senaite.core.exportimport.instruments.instrument import format_keyword
-from senaite.core.exportimport.instruments.resultsimport import AnalysisResultsImporter
 from bika.lims.utils import t
-from DateTime import DateTime
+from senaite.instruments.importer import ImportInterface
 from senaite.instruments.instrument import InstrumentXLSResultsFileParser
-from zope.interface import implements
+from senaite.instruments.normalize import format_keyword
+from senaite.instruments.rawresults import Schema
+from senaite.instruments.session import ImportSession
+
+
+# Fields of an AORC record that are not interim values
+RECORD_FIELDS = ('DefaultResult', 'Remarks', 'DateTime')
 
 
 class AORCParser(InstrumentXLSResultsFileParser):
     """ Parser
+
+    A report holds a block per molecule: the retention times and the ion
+    lines of the molecule, closed by the "PARAMETERS TO BE CONSIDERED" line.
+    Only the block being read is kept and its record is added when the
+    block is closed.
     """
-    def __init__(self, infile, encoding=None):
+    # Fields of the raw result records, shared by all of them. The ion
+    # fields are added as they are found.
+    schema = Schema(RECORD_FIELDS + ('RetentionTime', 'RetentionTimeRef'))
+
+    def __init__(self, infile, encoding=None, session=None):
         InstrumentXLSResultsFileParser.__init__(
             self, infile, worksheet=0, encoding=encoding)
+        self.session = session if session else ImportSession()
         self._end_header = False
         self._delimiter = '|'
         self._ar_id = None
         self._kw = None
-        self._retentiontime = None
-        self._retentiontimeref = None
-        self._ions = []
+        # Record of the molecule block being read, if any
+        self._block = None
 
     def _parseline(self, line):
         if self._end_header:
@@ -48,57 +57,65 @@ class AORCParser(InstrumentXLSResultsFileParser):
         # AR id
         if splitted[0] == 'Laboratory number':
             self._ar_id = splitted[2]
+            self._block = None
             return 0
 
         if splitted[0] == 'Molecule':
-            self._kw = format_keyword(splitted[2])
+            self.start_block(splitted[2])
+            return 0
+
+        if self._block is None:
+            # Not within a molecule block
             return 0
 
         if splitted[0] == 'Retention time in the molecule':
-            if self._retentiontime:
-                self._retentiontimeref = splitted[1]
+            if self._block['RetentionTime']:
+                self._block['RetentionTimeRef'] = splitted[1]
             else:
-                self._retentiontime = splitted[1]
+                self._block['RetentionTime'] = splitted[1]
             return 0
 
         if splitted[0].startswith('ion'):
             ion_number = splitted[0].split(' ')[1]
             mz_values = splitted[1].split('---')
-            self._ions.append({
-                'Ion{}mzmax'.format(ion_number): mz_values[0],
-                'Ion{}mzmin'.format(ion_number): mz_values[1],
-                'Ion{}Area'.format(ion_number): splitted[2],
-                'Ion{}AreaRef'.format(ion_number): splitted[3],
-                'Ion{}SigNseRat'.format(ion_number): splitted[4],
-            })
+            prefix = 'Ion{}'.format(ion_number)
+            self._block[prefix + 'mzmax'] = mz_values[0]
+            self._block[prefix + 'mzmin'] = mz_values[1]
+            self._block[prefix + 'Area'] = splitted[2]
+            self._block[prefix + 'AreaRef'] = splitted[3]
+            self._block[prefix + 'SigNseRat'] = splitted[4]
+            return 0
 
         if splitted[0] == 'PARAMETERS TO BE CONSIDERED FOR THE CALCULATION':
-            # No result field
-            record = {
-                'DefaultResult': None,
-                'Remarks': '',
-                'DateTime': str(DateTime())[:16]
-            }
-
-            # Interim values
-            column_name = 'RetentionTime'
-            record[column_name] = self.get_result(
-                column_name, self._retentiontime, 0)
-
-            column_name = 'RetentionTimeRef'
-            record[column_name] = self.get_result(
-                column_name, self._retentiontimeref, 0)
-
-            for ion in self._ions:
-                for interim_key in ion.keys():
-                    record[interim_key] = self.get_result(
-                        interim_key, ion[interim_key], 0)
-
-            # Append record
-            self._addRawResult(self._ar_id, {self._kw: record})
+            self.end_block()
 
         return 0
 
+    def start_block(self, molecule):
+        """Starts the record of a molecule, dropping an unfinished one
+        """
+        self._kw = format_keyword(molecule)
+        # No result field
+        self._block = self.schema.record(
+            DefaultResult=None,
+            Remarks='',
+            DateTime=self.session.result_date(),
+            RetentionTime=None,
+            RetentionTimeRef=None)
+
+    def end_block(self):
+        """Adds the record of the current molecule
+        """
+        record, self._block = self._block, None
+        # Interim values
+        for column_name in record.keys():
+            if column_name not in RECORD_FIELDS:
+                record[column_name] = self.get_result(
+                    column_name, record[column_name], 0)
+
+        # Append record
+        self._addRawResult(self._ar_id, {self._kw: record})
+
     def get_result(self, column_name, result, line):
         result = str(result)
         if result.startswith('--') or result == '' or result == 'ND':
@@ -115,70 +132,15 @@ class AORCParser(InstrumentXLSResultsFileParser):
         return
 
 
-class aorcimport(object):
-    implements(IInstrumentImportInterface, IInstrumentAutoImportInterface)
+class aorcimport(ImportInterface):
     title = "Quanti AORC"
 
-    def __init__(self, context):
-        self.context = context
-        self.request = None
-
-    def Import(self, context, request):
-        """ Import Form
-        """
-        infile = request.form['instrument_results_file']
-        fileformat = request.form.get(
-            'instrument_results_file_format', 'xls')
-        artoapply = request.form['artoapply']
-        override = request.form['results_override']
-        instrument = request.form.get('instrument', None)
-        errors = []
-        logs = []
-        warns = []
-
-        # Load the most suitable parser according to file extension/options/etc...
-        parser = None
-        if not hasattr(infile, 'filename'):
-            errors.append(_("No file selected"))
-        if fileformat in ('xls', 'xlsx'):
-            parser = AORCParser(infile, encoding=fileformat)
-        else:
-            errors.append(t(_("Unrecognized file format ${fileformat}",
-                              mapping={"fileformat": fileformat})))
-
-        if parser:
-            # Load the importer
-            status = ['sample_received', 'attachment_due', 'to_be_verified']
-            if artoapply == 'received':
-                status = ['sample_received']
-            elif artoapply == 'received_tobeverified':
-                status = ['sample_received', 'attachment_due', 'to_be_verified']
-
-            over = [False, False]
-            if override == 'nooverride':
-                over = [False, False]
-            elif override == 'override':
-                over = [True, False]
-            elif override == 'overrideempty':
-                over = [True, True]
-
-            importer = AnalysisResultsImporter(
-                parser=parser,
-                context=context,
-                allowed_ar_states=status,
-                allowed_analysis_states=None,
-                override=over,
-                instrument_uid=instrument)
-            tbex = ''
-            try:
-                importer.process()
-                errors = importer.errors
-                logs = importer.logs
-                warns = importer.warns
-            except Exception as e:
-                tbex = traceback.format_exc()
-                errors.append(tbex)
-
-        results = {'errors': errors, 'log': logs, 'warns': warns}
-
-        return json.dumps(results)
+    @classmethod
+    def get_parser(cls, run):
+        fileformat = run.form.get('instrument_results_file_format', 'xls')
+        if fileformat not in ('xls', 'xlsx'):
+            run.errors.append(t(_("Unrecognized file format ${fileformat}",
+                                  mapping={"fileformat": fileformat})))
+            return None
+        return AORCParser(run.infile, encoding=fileformat,
+                          session=run.session)
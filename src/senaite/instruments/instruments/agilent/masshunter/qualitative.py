@@ -1,31 +1,63 @@
-import json
-import traceback
 import xml.etree.cElementTree as ET
-from bika.lims import api
-from bika.lims import bikaMessageFactory as _
-from senaite.core.exportimport.instruments import IInstrumentAutoImportInterface
 from senaite.core.exportimport.instruments import IInstrumentExportInterface
-from senaite.core.exportimport.instruments import IInstrumentImportInterface
-from senaite.core.exportimport.instruments.instrument import format_keyword
 from senaite.core.exportimport.instruments.resultsimport import AnalysisResultsImporter
-from senaite.core.exportimport.instruments.resultsimport import InstrumentCSVResultsFileParser
-from bika.lims.utils import t
-from DateTime import DateTime
-from plone.i18n.normalizer.interfaces import IIDNormalizer
 from senaite.app.supermodel.interfaces import ISuperModel
+from senaite.instruments.columns import Column
+from senaite.instruments.columns import split_line
+from senaite.instruments.csvchunks import PREFIX
+from senaite.instruments.csvchunks import coerce_result
+from senaite.instruments.csvchunks import is_header
+from senaite.instruments.importer import ImportInterface
+from senaite.instruments.instrument import ChunkedCSVResultsFileParser
+from senaite.instruments.normalize import format_keyword
+from senaite.instruments.profiling import profiled
+from senaite.instruments.querycount import count_queries
+from senaite.instruments.rawresults import Schema
+from senaite.instruments.sequence import get_samples
+from senaite.instruments.sequence import get_tray_options
+from senaite.instruments.sequence import schedule
+from senaite.instruments.sequence import sequence_filename
+from senaite.instruments.sequence import stream_files
+from senaite.instruments.session import ExportSession
+from senaite.instruments.session import ImportSession
+from senaite.instruments.uidtoken import embed_uid
 from zope.component import getAdapter
-from zope.component import getUtility
 from zope.interface import implements
 
-
-class QualitativeParser(InstrumentCSVResultsFileParser):
+# Columns used from the results table. The positions are the ones of the
+# MassHunter version this interface was written for, and are only used when
+# the header row does not contain the label.
+COLUMNS = (
+    Column('ar_id', 'Sample Name', 104, interim=False),
+    Column('kw', 'Name', 18, interim=False),
+    Column('Label', 'Label', 22),
+    Column('Area', 'Area', 48),
+    Column('File', 'File', 54),
+    Column('End', 'End', 55),
+    Column('mz', 'm/z', 67),
+    Column('mzProd', 'm/z (prod.)', 68),
+    Column('ReturnTime', 'RT', 69),
+    Column('Start', 'Start', 71),
+    Column('Width', 'Width', 72),
+    Column('AcqMethod', 'Acq Method', 110),
+)
+
+
+class QualitativeParser(ChunkedCSVResultsFileParser):
     """ Parser
     """
-
-    def __init__(self, infile, encoding=None):
-        InstrumentCSVResultsFileParser.__init__(self, infile)
+    columns = COLUMNS
+    header_rule = (PREFIX, "Score")
+    # Fields of the raw result records, shared by all of them
+    schema = Schema(('DefaultResult', 'Remarks', 'DateTime') + tuple(
+        column.name for column in COLUMNS if column.interim))
+
+    def __init__(self, infile, encoding=None, session=None):
+        ChunkedCSVResultsFileParser.__init__(self, infile)
+        self.session = session if session else ImportSession()
         self._end_header = False
         self._delimiter = ','
+        self._plan = self.make_plan()
 
     def _parseline(self, line):
         if self._end_header:
@@ -51,56 +83,44 @@ class QualitativeParser(InstrumentCSVResultsFileParser):
     def parse_resultsline(self, line):
         """ Parses result lines
         """
-        splitted = [token.strip() for token in line.split(self._delimiter)]
+        splitted = split_line(line, self._delimiter)
         if len(filter(lambda x: len(x), splitted)) == 0:
             return 0
 
         # Header
-        if splitted[0].startswith('Score'):
+        if is_header(splitted, self.header_rule):
             self._header = splitted
+            self._plan = self.make_plan(splitted)
             return 0
 
-        ar_id = splitted[104]
-        kw = format_keyword(splitted[18])
-        analysis_date = str(DateTime())[:16]
+        projected = self._plan.project(splitted)
+        interims = self._plan.interims(projected, self.coerce)
+        self.add_result(projected, interims)
 
+        return 0
+
+    def add_result(self, values, interims):
+        ar_id = self.session.lookup.resolve(values['ar_id'])
+        kw = format_keyword(values['kw'])
         # Result field
-        record = {
-            'DefaultResult': None,
-            'Remarks': '',
-            'DateTime': analysis_date
-        }
+        record = self.schema.record(
+            DefaultResult=None,
+            Remarks='',
+            DateTime=self.session.result_date())
 
         # Interim values can get added to record here
-        interims = [
-            ('Label', 22),
-            ('Area', 48),
-            ('File', 54),
-            ('End', 55),
-            ('mz', 67),
-            ('mzProd', 68),
-            ('ReturnTime', 69),
-            ('Start', 71),
-            ('Width', 72),
-            ('AcqMethod', 110),
-        ]
-        for column_name, column_number in interims:
-            result = splitted[column_number]
-            record[column_name] = self.get_result(column_name, result, 0)
+        record.update(interims)
 
         # Append record
         self._addRawResult(ar_id, {kw: record})
 
-        return 0
+    def coerce(self, column_name, result):
+        return self.get_result(column_name, result, 0)
 
     def get_result(self, column_name, result, line):
-        result = str(result)
-        if result.startswith('--') or result == '' or result == 'ND':
-            return 0.0
-
-        if api.is_floatable(result):
-            result = api.to_float(result)
-            return result > 0.0 and result or 0.0
+        value = coerce_result(result)
+        if value is not None:
+            return value
 
         self.err("No valid number ${result} in column (${column_name})",
                  mapping={"result": result,
@@ -114,90 +134,26 @@ class QualitativeImporter(AnalysisResultsImporter):
     """
 
 
-class qualitativeimport(object):
-    implements(IInstrumentImportInterface, IInstrumentAutoImportInterface)
+class qualitativeimport(ImportInterface):
     title = "Agilent Masshunter Qualitative"
+    file_formats = ('csv', )
+    importer_class = QualitativeImporter
 
-    def __init__(self, context):
-        self.context = context
-        self.request = None
-
-    def Import(self, context, request):
-        """ Import Form
-        """
-        infile = request.form['instrument_results_file']
-        artoapply = request.form['artoapply']
-        override = request.form['results_override']
-        instrument = request.form.get('instrument', None)
-        errors = []
-        logs = []
-        warns = []
-
-        if not hasattr(infile, 'filename'):
-            errors.append(_("No file selected"))
-            results = {'errors': errors, 'log': logs, 'warns': warns}
-            return json.dumps(results)
-
-        file_formats = ['csv', ]
-        if infile.filename.split('.')[-1].lower() not in file_formats:
-            errors.append(t(_("Input file format must be ${file_formats}",
-                              mapping={"file_formats": file_formats[0]})))
-            results = {'errors': errors, 'log': logs, 'warns': warns}
-            return json.dumps(results)
-
-        parser = QualitativeParser(infile)
-
-        # Load the importer
-        status = ['sample_received', 'attachment_due', 'to_be_verified']
-        if artoapply == 'received':
-            status = ['sample_received']
-        elif artoapply == 'received_tobeverified':
-            status = ['sample_received', 'attachment_due', 'to_be_verified']
-
-        over = [False, False]
-        if override == 'nooverride':
-            over = [False, False]
-        elif override == 'override':
-            over = [True, False]
-        elif override == 'overrideempty':
-            over = [True, True]
-
-        importer = QualitativeImporter(
-            parser=parser,
-            context=context,
-            allowed_ar_states=status,
-            allowed_analysis_states=None,
-            override=over,
-            instrument_uid=instrument)
-        tbex = ''
-        try:
-            importer.process()
-            errors = importer.errors
-            logs = importer.logs
-            warns = importer.warns
-        except Exception as e:
-            tbex = traceback.format_exc()
-            errors.append(tbex)
-
-        results = {'errors': errors, 'log': logs, 'warns': warns}
-        return json.dumps(results)
+    @classmethod
+    def get_parser(cls, run):
+        return QualitativeParser(run.infile, session=run.session)
 
 
 class qualitativeexport(object):
     implements(IInstrumentExportInterface)
     title = "Agilent Masshunter Qualitative Exporter"
+    content_type = 'text/xml'
 
     def __init__(self, context):
         self.context = context
         self.request = None
 
-    def Export(self, context, request):
-        tray = 1
-        norm = getUtility(IIDNormalizer).normalize
-        filename = '{}-{}.xml'.format(
-            context.getId(), norm(self.title))
-        now = str(DateTime())[:16]
-
+    def get_sequence_table(self, session):
         root = ET.Element('SequenceTableDataSet')
         root.set('SchemaVersion', "1.0")
         root.set('SequenceComment', "")
@@ -210,59 +166,51 @@ class qualitativeexport(object):
         root.set('SequenceReProcessing', "False")
         root.set('SequenceInjectBarCodeMismatch', "OnBarcodeMismatchInjectAnyway")
         root.set('SequenceOverwriteExistingData', "False")
-        root.set('SequenceModifiedTimeStamp', now)
+        root.set('SequenceModifiedTimeStamp', session.timestamp)
         root.set('SequenceFileECMPath', "")
+        return root
 
-        # for looking up "cup" number (= slot) of ARs
-        parent_to_slot = {}
-        layout = context.getLayout()
-        for item in layout:
-            p_uid = item.get('parent_uid')
-            if not p_uid:
-                p_uid = item.get('container_uid')
-            if p_uid not in parent_to_slot.keys():
-                parent_to_slot[p_uid] = int(item['position'])
-
-        rows = []
-        sequences = []
-        for item in layout:
-            # create batch header row
-            p_uid = item.get('parent_uid')
-            if not p_uid:
-                p_uid = item.get('container_uid')
-            if not p_uid:
-                continue
-            if p_uid in sequences:
-                continue
-            sequences.append(p_uid)
-            cup = parent_to_slot[p_uid]
-            rows.append({
-                'tray': tray,
-                'cup': cup,
-                'analysis_uid': getAdapter(item['analysis_uid'], ISuperModel),
-                'sample': getAdapter(item['container_uid'], ISuperModel)
-            })
-        rows.sort(lambda a, b: cmp(a['cup'], b['cup']))
-
-        cnt = 0
-        for row in rows:
-            seq = ET.SubElement(root, 'Sequence')
-            ET.SubElement(seq, 'SequenceID').text = str(row['tray'])
-            ET.SubElement(seq, 'SampleID').text = str(cnt)
-            ET.SubElement(seq, 'AcqMethodFileName').text = 'Dunno'
-            ET.SubElement(seq, 'AcqMethodPathName').text = 'Dunno'
-            ET.SubElement(seq, 'DataFileName').text = row['sample'].Title()
-            ET.SubElement(seq, 'DataPathName').text = 'Dunno'
-            ET.SubElement(seq, 'SampleName').text = row['sample'].Title()
-            ET.SubElement(seq, 'SampleType').text = row['sample'].SampleType.Title()
-            ET.SubElement(seq, 'Vial').text = str(row['cup'])
-            cnt += 1
-
-        xml = ET.tostring(root, method='xml')
+    @profiled
+    @count_queries
+    def Export(self, context, request):
+        files = self.render(context)
         # stream file to browser
-        setheader = request.RESPONSE.setHeader
-        setheader('Content-Length', len(xml))
-        setheader('Content-Disposition',
-                  'attachment; filename="%s"' % filename)
-        setheader('Content-Type', 'text/xml')
-        request.RESPONSE.write(xml)
+        stream_files(request, files, self.content_type)
+
+    def render(self, context, lookup=None):
+        """Returns the sequence files of the worksheet, (filename, data)
+        pairs. The lookup can be shared by several worksheets.
+        """
+        session = ExportSession(context, lookup=lookup)
+        filename = '{}-{}.xml'.format(
+            context.getId(), session.normalize(self.title))
+
+        # pack the samples in the trays of the autosampler
+        layout = context.getLayout()
+        capacity, trays = get_tray_options(session.options)
+        methods = {}
+        if capacity:
+            methods = session.lookup.get_methods(
+                [item['analysis_uid'] for item in layout])
+        sequences = schedule(get_samples(layout, methods), capacity, trays)
+
+        files = []
+        for number, sequence in enumerate(sequences or [[]], 1):
+            root = self.get_sequence_table(session)
+            for cnt, item in enumerate(sequence):
+                sample = getAdapter(item['container_uid'], ISuperModel)
+                seq = ET.SubElement(root, 'Sequence')
+                ET.SubElement(seq, 'SequenceID').text = str(item['tray'])
+                ET.SubElement(seq, 'SampleID').text = str(cnt)
+                ET.SubElement(seq, 'AcqMethodFileName').text = 'Dunno'
+                ET.SubElement(seq, 'AcqMethodPathName').text = 'Dunno'
+                ET.SubElement(seq, 'DataFileName').text = sample.Title()
+                ET.SubElement(seq, 'DataPathName').text = 'Dunno'
+                # The UID token lets the import find the sample by UID
+                ET.SubElement(seq, 'SampleName').text = embed_uid(
+                    sample.Title(), item['container_uid'])
+                ET.SubElement(seq, 'SampleType').text = sample.SampleType.Title()
+                ET.SubElement(seq, 'Vial').text = str(item['vial'])
+            files.append((sequence_filename(filename, number, len(sequences)),
+                          ET.tostring(root, method='xml')))
+        return files
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+from bika.lims import bikaMessageFactory as _
+from senaite.instruments.detect import detect
+from senaite.instruments.importer import ImportInterface
+from senaite.instruments.importer import ImportRun
+
+
+class AutoImportRun(ImportRun):
+    """An import with the interface detected from the contents of the file.
+
+    The interface is detected before the file is validated, so the run is
+    set up and validated like one of the detected interface.
+    """
+
+    def validate(self):
+        if hasattr(self.infile, 'filename') and not self.detect():
+            return False
+        return super(AutoImportRun, self).validate()
+
+    def detect(self):
+        factory, file_format = detect(self.infile)
+        if factory is None:
+            self.errors.append(_(
+                "The instrument of the file could not be detected, please "
+                "select its import interface"))
+            return False
+        self.logs.append("Detected {} file".format(factory.title))
+        self.form.setdefault('instrument_results_file_format', file_format)
+        # The parser and the results importer of the detected interface are
+        # used, with its default chunk size
+        self.interface = factory.resolve()
+        self.chunk_size = self.chunk_size or self.interface.chunk_size
+        return True
+
+
+class autoimport(ImportInterface):
+    """Imports a results file with the interface detected from its contents
+    """
+    title = "Detect the instrument from the file"
+
+    @classmethod
+    def Import(cls, context, request):
+        return AutoImportRun(cls, context, request).run()
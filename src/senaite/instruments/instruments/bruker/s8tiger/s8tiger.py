@@ -18,28 +18,18 @@
 # Copyright 2018-2019 by it's authors.
 # Some rights reserved, see README and LICENSE.
 import csv
-import json
-import traceback
 from mimetypes import guess_type
 from os.path import basename
 from os.path import splitext
-from re import subn
 
-from senaite.core.exportimport.instruments import IInstrumentAutoImportInterface
-from senaite.core.exportimport.instruments import IInstrumentImportInterface
-from senaite.core.exportimport.instruments.resultsimport import \
-    AnalysisResultsImporter
 from senaite.core.exportimport.instruments.resultsimport import \
     InstrumentResultsFileParser
 
-from bika.lims import api
-from bika.lims import bikaMessageFactory as _
-from bika.lims.catalog import CATALOG_ANALYSIS_REQUEST_LISTING
-from senaite.instruments.instrument import FileStub
-from senaite.instruments.instrument import xls_to_csv
-from senaite.instruments.instrument import xlsx_to_csv
-from zope.interface import implements
-from zope.publisher.browser import FileUpload
+from senaite.instruments.importer import ImportInterface
+from senaite.instruments.instrument import RowCounts
+from senaite.instruments.lookup import SampleLookup
+from senaite.instruments.normalize import strip_non_numeric
+from senaite.instruments.rawresults import Schema
 
 field_interim_map = {
     "Formula": "formula",
@@ -67,47 +57,27 @@ class AnalysisNotFound(Exception):
     pass
 
 
-class S8TigerParser(InstrumentResultsFileParser):
+class S8TigerParser(RowCounts, InstrumentResultsFileParser):
     ar = None
+    # Fields of the raw result records, shared by all of them
+    schema = Schema(sorted(field_interim_map.values()) + [
+        'DefaultResult', 'pct', 'ppm', 'reading'])
 
-    def __init__(self, infile, worksheet=None, encoding=None,
-                 final_result_unit=None, delimiter=None):
+    def __init__(self, infile, lines, worksheet=None, encoding=None,
+                 final_result_unit=None, delimiter=None, lookup=None):
         self.delimiter = delimiter if delimiter else ','
+        self.lookup = lookup if lookup else SampleLookup()
         self.unit = final_result_unit if final_result_unit else "pct"
         self.ar = None
         self.analyses = None
         self.worksheet = worksheet if worksheet else 0
         self.infile = infile
-        self.csv_data = None
-        self.csv_data = None
+        self.lines = lines
         self.sample_id = None
         mimetype=guess_type(self.infile.filename)
         InstrumentResultsFileParser.__init__(self, infile, mimetype)
 
     def parse(self):
-        order = []
-        if '.xlsx' in self.infile.filename.lower():
-            order = (xlsx_to_csv, xls_to_csv)
-        elif '.xls' in self.infile.filename.lower():
-            order = (xls_to_csv, xlsx_to_csv)
-        elif '.csv' in self.infile.filename.lower():
-            self.csv_data = self.infile
-        if order:
-            for importer in order:
-                try:
-                    self.csv_data = importer(
-                        infile=self.infile,
-                        worksheet=self.worksheet,
-                        delimiter=self.delimiter)
-                    break
-                except Exception as e: # noqa
-                    pass
-            else:
-                self.warn("Can't parse input file as XLS, XLSX, or CSV.")
-                return -1
-        stub = FileStub(file=self.csv_data, name=str(self.infile.filename))
-        self.csv_data = FileUpload(stub)
-
         try:
             sample_id, ext = splitext(basename(self.infile.filename))
             # maybe the filename is a sample ID, just the way it is
@@ -127,14 +97,15 @@ class S8TigerParser(InstrumentResultsFileParser):
         except Exception as e:
             self.err(repr(e))
             return False
-        lines = self.csv_data.readlines()
-        reader = csv.DictReader(lines)
+        reader = csv.DictReader(self.lines)
         for row in reader:
             self.parse_row(reader.line_num, row)
 
     def parse_row(self, row_nr, row):
+        self.read_row()
         # convert row to use interim field names
-        parsed = {field_interim_map[k]: v for k, v in row.items()}
+        parsed = self.schema.record(
+            (field_interim_map[k], v) for k, v in row.items())
         default_result = 'reading'
         parsed.update({'DefaultResult': default_result})
 
@@ -143,15 +114,15 @@ class S8TigerParser(InstrumentResultsFileParser):
             analysis = self.get_analysis(formula)
             keyword = analysis.getKeyword
         except Exception as e:
-            self.warn(msg="Error getting analysis for '${f}': ${e}",
-                      mapping={'f': formula, 'e': repr(e)},
-                      numline=row_nr, line=str(row))
+            self.reject_row(msg="Error getting analysis for '${f}': ${e}",
+                            mapping={'f': formula, 'e': repr(e)},
+                            numline=row_nr, line=str(row))
             return
 
         # Concentration can be PPM or PCT as it likes, I'll save both.
         concentration = parsed['concentration']
         try:
-            val = float(subn(r'[^.\d]', '', str(concentration))[0])
+            val = float(strip_non_numeric(str(concentration)))
         except (TypeError, ValueError, IndexError):
             self.warn(msg="Can't extract numerical value from `concentration`",
                       numline=row_nr, line=str(row))
@@ -166,8 +137,9 @@ class S8TigerParser(InstrumentResultsFileParser):
                 parsed['pct'] = val
                 parsed['ppm'] = 1 / 0.0001 * val
             else:
-                self.warn("Can't decide if concentration units are PPM or %",
-                          numline=row_nr, line=str(row))
+                self.reject_row(
+                    "Can't decide if concentration units are PPM or %",
+                    numline=row_nr, line=str(row))
                 return 0
             reading = parsed['ppm'] if self.unit == 'ppm' else parsed['pct']
             parsed['reading'] = reading
@@ -175,22 +147,15 @@ class S8TigerParser(InstrumentResultsFileParser):
         self._addRawResult(self.sample_id, {keyword: parsed})
         return 0
 
-    @staticmethod
-    def get_ar(sample_id):
-        query = dict(portal_type="AnalysisRequest", getId=sample_id)
-        brains = api.search(query, CATALOG_ANALYSIS_REQUEST_LISTING)
-        try:
-            return api.get_object(brains[0])
-        except IndexError:
-            pass
+    def get_ar(self, sample_id):
+        return self.lookup.get_sample(sample_id)
 
-    @staticmethod
-    def get_analyses(ar):
-        analyses = ar.getAnalyses()
-        return dict((a.getKeyword, a) for a in analyses)
+    def get_analyses(self, ar):
+        return self.lookup.get_analyses(ar)
 
     def get_analysis(self, f):
-        analyses = [v for k, v in self.analyses.items() if k.startswith(f)]
+        analyses = [v[0] for k, v in self.analyses.items()
+                    if k.startswith(f)]
         if len(analyses) < 1:
             msg = "No analysis found matching Formula '${formula}'",
             raise AnalysisNotFound(msg)
@@ -200,62 +165,15 @@ class S8TigerParser(InstrumentResultsFileParser):
         return analyses[0]
 
 
-class importer(object):
-    implements(IInstrumentImportInterface, IInstrumentAutoImportInterface)
+class importer(ImportInterface):
     title = "Bruker S8 Tiger"
 
-    def __init__(self, context):
-        self.context = context
-        self.request = None
-
-    @staticmethod
-    def Import(context, request):
-        errors = []
-        logs = []
-        warns = []
-
-        infile = request.form['instrument_results_file']
-        if not hasattr(infile, 'filename'):
-            errors.append(_("No file selected"))
-
-        artoapply = request.form['artoapply']
-        override = request.form['results_override']
-        instrument = request.form.get('instrument', None)
-
-        final_result_unit = request.form['final_result_unit']
-        parser = S8TigerParser(infile, final_result_unit=final_result_unit)
-        if parser:
-
-            status = ['sample_received', 'attachment_due', 'to_be_verified']
-            if artoapply == 'received':
-                status = ['sample_received']
-            elif artoapply == 'received_tobeverified':
-                status = ['sample_received', 'attachment_due', 'to_be_verified']
-
-            over = [False, False]
-            if override == 'nooverride':
-                over = [False, False]
-            elif override == 'override':
-                over = [True, False]
-            elif override == 'overrideempty':
-                over = [True, True]
-
-            importer = AnalysisResultsImporter(
-                parser=parser,
-                context=context,
-                allowed_ar_states=status,
-                allowed_analysis_states=None,
-                override=over,
-                instrument_uid=instrument)
-
-            try:
-                importer.process()
-                errors = importer.errors
-                logs = importer.logs
-                warns = importer.warns
-            except Exception as e:
-                errors.extend([repr(e), traceback.format_exc()])
-
-        results = {'errors': errors, 'log': logs, 'warns': warns}
-
-        return json.dumps(results)
+    @classmethod
+    def get_parser(cls, run):
+        final_result_unit = run.form.get('final_result_unit')
+        lines = run.decode()
+        if lines is None:
+            return None
+        return S8TigerParser(run.infile, lines,
+                             final_result_unit=final_result_unit,
+                             lookup=run.session.lookup)
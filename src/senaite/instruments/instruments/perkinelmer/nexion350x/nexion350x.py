@@ -18,26 +18,19 @@
 # Copyright 2018-2019 by it's authors.
 # Some rights reserved, see README and LICENSE.
 import csv
-import json
-import traceback
 from mimetypes import guess_type
-from re import subn
 
-from senaite.core.exportimport.instruments import IInstrumentAutoImportInterface
-from senaite.core.exportimport.instruments import IInstrumentImportInterface
-from senaite.core.exportimport.instruments.resultsimport import \
-    AnalysisResultsImporter
 from senaite.core.exportimport.instruments.resultsimport import \
     InstrumentResultsFileParser
 
-from bika.lims import api
-from bika.lims import bikaMessageFactory as _
-from bika.lims.catalog import CATALOG_ANALYSIS_REQUEST_LISTING
-from senaite.instruments.instrument import FileStub
-from senaite.instruments.instrument import xls_to_csv
-from senaite.instruments.instrument import xlsx_to_csv
-from zope.interface import implements
-from zope.publisher.browser import FileUpload
+from senaite.instruments.importer import ImportInterface
+from senaite.instruments.instrument import RowCounts
+from senaite.instruments.lookup import SampleLookup
+from senaite.instruments.matrix import numeric_mask
+from senaite.instruments.matrix import to_matrix
+from senaite.instruments.normalize import normalize_keyword
+from senaite.instruments.normalize import normalize_sample_id
+from senaite.instruments.rawresults import Schema
 
 non_analyte_row_headers = [
     "Sample Id",
@@ -57,101 +50,125 @@ class AnalysisNotFound(Exception):
     pass
 
 
-class Nexion350x(InstrumentResultsFileParser):
+class Nexion350x(RowCounts, InstrumentResultsFileParser):
     ar = None
+    # Fields of the raw result records, shared by all of them
+    schema = Schema(('reading', 'DefaultResult'))
 
-    def __init__(self, infile, encoding=None, delimiter=None):
+    def __init__(self, infile, lines, encoding=None, delimiter=None,
+                 cursor=None, lookup=None):
         self.delimiter = delimiter if delimiter else ','
         self.encoding = encoding
         self.infile = infile
-        self.csv_data = None
-        self.csv_data = None
+        self.lookup = lookup if lookup else SampleLookup()
+        self.lines = lines
         self.sample_id = None
+        self.cursor = cursor
         mimetype = guess_type(self.infile.filename)
         InstrumentResultsFileParser.__init__(self, infile, mimetype)
 
     def parse(self):
-        order = []
-        if '.xlsx' in self.infile.filename.lower():
-            order = (xlsx_to_csv, xls_to_csv)
-        elif '.xls' in self.infile.filename.lower():
-            order = (xls_to_csv, xlsx_to_csv)
-        elif '.csv' in self.infile.filename.lower():
-            self.csv_data = self.infile
-        if order:
-            for importer in order:
-                try:
-                    self.csv_data = importer(
-                        infile=self.infile,
-                        delimiter=self.delimiter)
-                    break
-                except Exception as e:  # noqa
-                    pass
+        lines = self.lines
+        start = self.cursor.start(lines) if self.cursor else 0
+        if start > 1:
+            self.log("Skipping ${nr_lines} lines imported before",
+                     mapping={"nr_lines": start - 1})
+            lines = lines[:1] + lines[start:]
+            start -= 1
+        else:
+            start = 0
+        reader = csv.DictReader(lines)
+        rows = [(reader.line_num + start, row) for row in reader]
+        self.lookup.prefetch(
+            [self.get_sample_id(row) for row_nr, row in rows])
+        analytes = self.get_analytes(reader.fieldnames or [])
+        # Coerce the whole analytes block at once if numpy is available
+        matrix = to_matrix([row for row_nr, row in rows],
+                           [key for key, kw in analytes])
+        if matrix is not None:
+            mask = numeric_mask(matrix)
+        for index, (row_nr, row) in enumerate(rows):
+            if matrix is None:
+                self.parse_row(row_nr, row, analytes)
             else:
-                self.warn("Can't parse input file as XLS, XLSX, or CSV.")
-                return -1
-        stub = FileStub(file=self.csv_data, name=str(self.infile.filename))
-        self.csv_data = FileUpload(stub)
+                # Python floats and booleans of the row, in one call
+                self.parse_row(row_nr, row, analytes,
+                               values=matrix[index].tolist(),
+                               numeric=mask[index].tolist())
 
-        lines = self.csv_data.readlines()
-        reader = csv.DictReader(lines)
-        for row in reader:
-            self.parse_row(reader.line_num, row)
+    @staticmethod
+    def get_sample_id(row):
+        return normalize_sample_id(row.get('Sample Id', ""))
 
-    def parse_row(self, row_nr, row):
+    @staticmethod
+    def get_analytes(fieldnames):
+        """Returns (header, keyword) of the analyte columns, in file order
+        """
+        analytes = []
+        for key in fieldnames:
+            if key in non_analyte_row_headers:
+                continue
+            kw = normalize_keyword(key)
+            if kw:
+                analytes.append((key, kw))
+        return analytes
+
+    def parse_row(self, row_nr, row, analytes, values=None, numeric=None):
+        """Adds the results of a sample row. `values` and `numeric` are the
+        lists of the row of the coerced analytes matrix, if any.
+        """
         if row['Sample Id'].lower().strip() in (
                 "sample id", "blk", "rblk", "calibration curves"):
             return 0
+        self.read_row()
 
         # Get sample for this row
-        sample_id = subn(r'[^\w\d\-_]*', '', row.get('Sample Id', ""))[0]
+        sample_id = self.get_sample_id(row)
         ar = self.get_ar(sample_id)
         if not ar:
             msg = "Sample not found for {}".format(sample_id)
-            self.warn(msg, numline=row_nr, line=str(row))
+            self.reject_row(msg, numline=row_nr, line=str(row))
             return 0
         # Get sample analyses
         analyses = self.get_analyses(ar)
-        __import__('pdb').set_trace()
-        # Search for rows who's headers are analyte keys
-        for key in row.keys():
-            if key in non_analyte_row_headers:
+        results = {}
+        for position, (key, kw) in enumerate(analytes):
+            an = [a[0] for k, a in analyses.items() if k.startswith(kw)]
+            if not an:
+                msg = "Can't find analysis with keyword {}".format(kw)
+                self.warn(msg, numline=row_nr, line=str(row))
                 continue
-            kw = subn(r"[^\w\d]*", "", key)[0]
-            if not kw:
-                return 0
-            try:
-                an = [a for a in analyses if a.getKeyword.startswith(kw)]
-                if not an:
-                    print(kw)
-                    msg = "Can't find analysis with keyword {}".format(kw)
-                    self.warn(msg, numline=row_nr, line=str(row))
-                    return 0
-                parsed = dict(reading=float(row[kw]), DefaultResult='reading')
-                self._addRawResult(sample_id, {kw: parsed})
-            except (TypeError, ValueError):
+            if values is None:
+                try:
+                    value = float(row[key])
+                except (TypeError, ValueError):
+                    value = None
+            elif numeric[position]:
+                value = values[position]
+            else:
+                value = None
+            if value is None:
                 msg = "Can't coerce value for keyword {} to a number".format(kw)
                 self.warn(msg, numline=row_nr, line=str(row))
-
+                continue
+            results[kw] = self.schema.record(
+                reading=value, DefaultResult='reading')
+        if results:
+            self._addRawResult(sample_id, results)
+        elif analytes:
+            # The reasons were given for every analyte
+            self.rows_rejected += 1
         return 0
 
-    @staticmethod
-    def get_ar(sample_id):
-        query = dict(portal_type="AnalysisRequest", getId=sample_id)
-        brains = api.search(query, CATALOG_ANALYSIS_REQUEST_LISTING)
-        try:
-            return api.get_object(brains[0])
-        except IndexError:
-            pass
+    def get_ar(self, sample_id):
+        return self.lookup.get_sample(sample_id)
 
-    @staticmethod
-    def get_analyses(ar):
-        analyses = ar.getAnalyses()
-        return dict((a.getKeyword, a) for a in analyses)
+    def get_analyses(self, ar):
+        return self.lookup.get_analyses(ar)
 
     def get_analysis(self, ar, kw):
         analyses = self.get_analyses(ar)
-        analyses = [v for k, v in analyses.items() if k.startswith(kw)]
+        analyses = [v[0] for k, v in analyses.items() if k.startswith(kw)]
         if len(analyses) < 1:
             msg = "No analysis found matching Formula '${formula}'",
             raise AnalysisNotFound(msg)
@@ -161,61 +178,14 @@ class Nexion350x(InstrumentResultsFileParser):
         return analyses[0]
 
 
-class importer(object):
-    implements(IInstrumentImportInterface, IInstrumentAutoImportInterface)
+class importer(ImportInterface):
     title = "Perkin Elmer Nexion 350X"
-
-    def __init__(self, context):
-        self.context = context
-        self.request = None
-
-    @staticmethod
-    def Import(context, request):
-        errors = []
-        logs = []
-        warns = []
-
-        infile = request.form['instrument_results_file']
-        if not hasattr(infile, 'filename'):
-            errors.append(_("No file selected"))
-
-        artoapply = request.form['artoapply']
-        override = request.form['results_override']
-        instrument = request.form.get('instrument', None)
-
-        parser = Nexion350x(infile)
-        if parser:
-
-            status = ['sample_received', 'attachment_due', 'to_be_verified']
-            if artoapply == 'received':
-                status = ['sample_received']
-            elif artoapply == 'received_tobeverified':
-                status = ['sample_received', 'attachment_due', 'to_be_verified']
-
-            over = [False, False]
-            if override == 'nooverride':
-                over = [False, False]
-            elif override == 'override':
-                over = [True, False]
-            elif override == 'overrideempty':
-                over = [True, True]
-
-            importer = AnalysisResultsImporter(
-                parser=parser,
-                context=context,
-                allowed_ar_states=status,
-                allowed_analysis_states=None,
-                override=over,
-                instrument_uid=instrument)
-
-            try:
-                importer.process()
-                errors = importer.errors
-                logs = importer.logs
-                warns = importer.warns
-            except Exception as e:
-                errors.extend([repr(e), traceback.format_exc()])
-
-        results = {'errors': errors, 'log': logs, 'warns': warns}
-
-        return json.dumps(results)
+    incremental = True
+
+    @classmethod
+    def get_parser(cls, run):
+        lines = run.decode()
+        if lines is None:
+            return None
+        return Nexion350x(run.infile, lines, cursor=run.cursor,
+                          lookup=run.session.lookup)
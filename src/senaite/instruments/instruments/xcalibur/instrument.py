@@ -1,151 +1,114 @@
 import csv
-import json
-import re
-import traceback
 from cStringIO import StringIO
-from DateTime import DateTime
 from bika.lims import api
 from bika.lims.catalog import CATALOG_ANALYSIS_REQUEST_LISTING
-from senaite.core.exportimport.instruments import IInstrumentAutoImportInterface
 from senaite.core.exportimport.instruments import IInstrumentExportInterface
-from senaite.core.exportimport.instruments import IInstrumentImportInterface
-from senaite.core.exportimport.instruments.utils import \
-    get_instrument_import_ar_allowed_states
-from senaite.core.exportimport.instruments.utils import \
-    get_instrument_import_override
 from senaite.core.exportimport.instruments.resultsimport import AnalysisResultsImporter
 from senaite.core.exportimport.instruments.resultsimport import \
     InstrumentCSVResultsFileParser
-from plone.i18n.normalizer.interfaces import IIDNormalizer
-from zope.component import getUtility
+from senaite.instruments.importer import ImportInterface
+from senaite.instruments.normalize import strip_non_word
+from senaite.instruments.profiling import profiled
+from senaite.instruments.querycount import count_queries
+from senaite.instruments.session import ExportSession
+from senaite.instruments.sequence import get_samples
+from senaite.instruments.sequence import get_tray_options
+from senaite.instruments.sequence import schedule
+from senaite.instruments.sequence import sequence_filename
+from senaite.instruments.sequence import stream_files
 from zope.interface import implements
 
 
 class xcaliburexport(object):
     implements(IInstrumentExportInterface)
     title = "XCalibur Exporter"
+    content_type = 'text/comma-separated-values'
+    disposition = 'inline'
 
     def __init__(self, context):
         self.context = context
         self.request = None
 
+    @profiled
+    @count_queries
     def Export(self, context, request):
-        tray = 1
-        now = DateTime().strftime('%Y%m%d-%H%M')
-        uc = api.get_tool('uid_catalog')
-        instrument = context.getInstrument()
-        norm = getUtility(IIDNormalizer).normalize
+        files = self.render(context)
+        # stream file to browser
+        stream_files(request, files, self.content_type, self.disposition)
+
+    def render(self, context, lookup=None):
+        """Returns the sequence files of the worksheet, (filename, data)
+        pairs. The lookup can be shared by several worksheets.
+        """
+        session = ExportSession(context, defaults={
+            'dilute_factor': 1,
+            'method': 'F SO2 & T SO2'
+        }, lookup=lookup)
+        now = session.now.strftime('%Y%m%d-%H%M')
+        instrument = session.instrument
+        norm = session.normalize
         filename = '{}-{}.csv'.format(
             context.getId(), norm(instrument.getDataInterface()))
         listname = '{}_{}_{}'.format(
             context.getId(), norm(instrument.Title()), now)
-        options = {
-            'dilute_factor': 1,
-            'method': 'F SO2 & T SO2'
-        }
-        for k, v in instrument.getDataInterfaceOptions():
-            options[k] = v
+        options = session.options
 
         # for looking up "cup" number (= slot) of ARs
-        parent_to_slot = {}
         layout = context.getLayout()
-        for x in range(len(layout)):
-            a_uid = layout[x]['analysis_uid']
-            p_uid = uc(UID=a_uid)[0].getObject().aq_parent.UID()
-            layout[x]['parent_uid'] = p_uid
-            if p_uid not in parent_to_slot.keys():
-                parent_to_slot[p_uid] = int(layout[x]['position'])
-
-        # write rows, one per PARENT
-        header = [listname, options['method']]
-        rows = []
-        rows.append(header)
-        tmprows = []
-        ARs_exported = []
-        for x in range(len(layout)):
-            # create batch header row
-            c_uid = layout[x]['container_uid']
-            p_uid = layout[x]['parent_uid']
-            if p_uid in ARs_exported:
-                continue
-            cup = parent_to_slot[p_uid]
-            tmprows.append([tray,
-                            cup,
-                            p_uid,
-                            c_uid,
-                            options['dilute_factor'],
-                            ""])
-            ARs_exported.append(p_uid)
-        tmprows.sort(lambda a, b: cmp(a[1], b[1]))
-        rows += tmprows
-
-        ramdisk = StringIO()
-        writer = csv.writer(ramdisk, delimiter=';')
-        assert(writer)
-        writer.writerows(rows)
-        result = ramdisk.getvalue()
-        ramdisk.close()
-
-        # stream file to browser
-        setheader = request.RESPONSE.setHeader
-        setheader('Content-Length', len(result))
-        setheader('Content-Type', 'text/comma-separated-values')
-        setheader('Content-Disposition', 'inline; filename=%s' % filename)
-        request.RESPONSE.write(result)
-
-
-class xcaliburimport(object):
-    implements(IInstrumentImportInterface, IInstrumentAutoImportInterface)
+        lookup = session.lookup
+        lookup.prefetch([item['analysis_uid'] for item in layout])
+        for item in layout:
+            item['parent_uid'] = lookup.get_parent_uid(item['analysis_uid'])
+
+        # pack the ARs in the trays of the autosampler
+        capacity, trays = get_tray_options(options)
+        methods = {}
+        if capacity:
+            methods = lookup.get_methods(
+                [item['analysis_uid'] for item in layout])
+        sequences = schedule(get_samples(layout, methods), capacity, trays)
+
+        # write rows, one per PARENT, one file per sequence
+        files = []
+        for number, sequence in enumerate(sequences or [[]], 1):
+            name = listname
+            if len(sequences) > 1:
+                name = '{}-{}'.format(listname, number)
+            rows = [[name, options['method']]]
+            for item in sequence:
+                rows.append([item['tray'],
+                             item['vial'],
+                             item['parent_uid'],
+                             item['container_uid'],
+                             options['dilute_factor'],
+                             ""])
+            ramdisk = StringIO()
+            writer = csv.writer(ramdisk, delimiter=';')
+            writer.writerows(rows)
+            files.append((sequence_filename(filename, number, len(sequences)),
+                          ramdisk.getvalue()))
+            ramdisk.close()
+        return files
+
+
+class xcaliburimport(ImportInterface):
     title = "XCalibur"
+    incremental = True
 
-    def __init__(self, context):
-        self.context = context
-        self.request = None
+    @classmethod
+    def get_parser(cls, run):
+        return XCaliburCSVParser(run.infile, cursor=run.cursor)
 
-    def Import(self, context, request):
-        """ Read Dimensional-CSV analysis results
-        """
-        form = request.form
-        # TODO form['file'] sometimes returns a list
-        infile = form['instrument_results_file'][0] if \
-            isinstance(form['instrument_results_file'], list) else \
-            form['instrument_results_file']
-        artoapply = form['artoapply']
-        override = form['results_override']
-
-        instrument = form.get('instrument', None)
-        errors = []
-        logs = []
-
-        # Load the most suitable parser according to file extension/options/etc...
-        parser = None
-        if not hasattr(infile, 'filename'):
-            errors.append(_("No file selected"))
-        parser = XCaliburCSVParser(infile)
-        status = get_instrument_import_ar_allowed_states(artoapply)
-        over = get_instrument_import_override(override)
-        importer = XCaliburImporter(
+    @classmethod
+    def get_importer(cls, parser, run):
+        return XCaliburImporter(
             parser=parser,
-            context=context,
-            allowed_ar_states=status,
+            context=run.context,
+            allowed_ar_states=run.allowed_ar_states,
             allowed_analysis_states=None,
-            override=over,
-            instrument_uid=instrument,
-            form=form)
-        tbex = ''
-        try:
-            importer.process()
-        except Exception as e:
-            tbex = traceback.format_exc()
-        errors = importer.errors
-        logs = importer.logs
-        warns = importer.warns
-        if tbex:
-            errors.append(tbex)
-
-        results = {'errors': errors, 'log': logs, 'warns': warns}
-
-        return json.dumps(results)
+            override=run.override,
+            instrument_uid=run.instrument,
+            form=run.form)
 
 
 def is_keyword(kw):
@@ -212,15 +175,31 @@ class XCaliburCSVParser(InstrumentCSVResultsFileParser):
                                           'Title32', 'Title41', 'Title42',
                                           'Title43',)
 
-    def __init__(self, csv):
+    def __init__(self, csv, cursor=None):
         InstrumentCSVResultsFileParser.__init__(self, csv)
         self._end_header = False
         self._keywords = []
         self._quantitationresultsheader = []
         self._numline = 0
+        self._cursor = cursor
+        self._skiplines = 0
+
+    def parse(self):
+        if self._cursor:
+            infile = self.getInputFile()
+            lines = infile.readlines()
+            infile.seek(0)
+            self._skiplines = self._cursor.start(lines)
+            if self._skiplines:
+                self.log("Skipping ${nr_lines} lines imported before",
+                         mapping={"nr_lines": self._skiplines})
+        return InstrumentCSVResultsFileParser.parse(self)
 
     def _parseline(self, line):
         if self._end_header:
+            if self._numline <= self._skiplines:
+                # Already imported in a previous run
+                return 0
             return self.parse_resultsline(line)
         return self.parse_headerline(line)
 
@@ -285,7 +264,7 @@ class XCaliburCSVParser(InstrumentCSVResultsFileParser):
             result = self.get_result(column_name, result, line)
             quantitation[quantitation['DefaultResult']] = result
 
-            kw = re.sub(r"\W", "", self._keywords[i])
+            kw = strip_non_word(self._keywords[i])
             if not is_keyword(kw):
                 new_kw = find_kw(quantitation['AR'], kw)
                 if new_kw:
@@ -306,7 +285,7 @@ class XCaliburCSVParser(InstrumentCSVResultsFileParser):
                             quantitation[interim] = keyword_value_dict[interim]
                             list_of_interim_results.append(quantitation)
                     kw = new_kw
-                    kw = re.sub(r"\W", "", kw)
+                    kw = strip_non_word(kw)
 
             self._addRawResult(quantitation['AR'],
                                values={kw: quantitation},
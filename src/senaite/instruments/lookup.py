@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+from bika.lims import api
+from bika.lims.catalog import CATALOG_ANALYSIS_LISTING
+from bika.lims.catalog import CATALOG_ANALYSIS_REQUEST_LISTING
+from senaite.instruments.memprofile import memory_phase
+from senaite.instruments.uidtoken import split_uid
+
+
+def add_analysis(analyses, brain):
+    """Adds the analysis brain to the dict of keyword -> list of brains
+    """
+    analyses.setdefault(brain.getKeyword, []).append(brain)
+
+
+class SampleLookup(object):
+    """Resolves samples and their analyses once per import.
+
+    Parsers look up the same sample for every row that belongs to it, so
+    the results are kept for the duration of the import.  When the sample
+    IDs are known up front they can be prefetched with a single catalog
+    query.  Sample names holding a UID token (see uidtoken.py) are resolved
+    by UID.
+    """
+
+    def __init__(self):
+        self._samples = {}
+        self._analyses = {}
+        self._uids = {}
+
+    def resolve(self, value):
+        """Returns the sample ID for a sample name read from a results file.
+
+        If the name holds a UID token the sample is fetched by UID, else the
+        name is returned as is.
+        """
+        name, uid = split_uid(value)
+        if not uid:
+            return value
+        if uid not in self._uids:
+            self._uids[uid] = self.resolve_uid(uid) or name or value
+        return self._uids[uid]
+
+    def resolve_uid(self, uid):
+        """Returns the ID of the sample with the given UID, if any
+        """
+        sample = api.get_object_by_uid(uid, None)
+        if not sample or api.get_portal_type(sample) != "AnalysisRequest":
+            return None
+        sample_id = api.get_id(sample)
+        self._samples[sample_id] = sample
+        return sample_id
+
+    def has_sample(self, sample_id):
+        """Returns whether the sample was looked up already and exists
+        """
+        return self._samples.get(sample_id) is not None
+
+    def prefetch(self, sample_ids):
+        """Resolves all the sample IDs not resolved yet in one query
+        """
+        sample_ids = filter(None, set(sample_ids))
+        sample_ids = [sid for sid in sample_ids if sid not in self._samples]
+        if not sample_ids:
+            return
+        query = dict(portal_type="AnalysisRequest", getId=sample_ids)
+        with memory_phase("resolve"):
+            for brain in api.search(query, CATALOG_ANALYSIS_REQUEST_LISTING):
+                self._samples[api.get_id(brain)] = api.get_object(brain)
+        for sample_id in sample_ids:
+            self._samples.setdefault(sample_id, None)
+
+    def get_sample(self, sample_id):
+        if sample_id not in self._samples:
+            self.prefetch([sample_id])
+        return self._samples.get(sample_id)
+
+    def get_analyses(self, sample):
+        """Returns a dict of keyword -> list of analysis brains for the
+        sample. A retest shares the keyword of the retracted analysis, so
+        there can be more than one analysis per keyword
+        """
+        uid = api.get_uid(sample)
+        if uid not in self._analyses:
+            analyses = {}
+            for brain in sample.getAnalyses():
+                add_analysis(analyses, brain)
+            self._analyses[uid] = analyses
+        return self._analyses[uid]
+
+    def prefetch_analyses(self, samples):
+        """Fetches the analyses of the samples not fetched yet in one query
+        """
+        uids = [api.get_uid(sample) for sample in filter(None, samples)]
+        uids = [uid for uid in set(uids) if uid not in self._analyses]
+        if not uids:
+            return
+        for uid in uids:
+            self._analyses[uid] = {}
+        query = dict(portal_type="Analysis", getRequestUID=uids)
+        with memory_phase("resolve"):
+            for brain in api.search(query, CATALOG_ANALYSIS_LISTING):
+                add_analysis(self._analyses[brain.getRequestUID], brain)
+
+
+class WorksheetLookup(SampleLookup):
+    """Resolves the samples and analyses of a worksheet only.
+
+    The routine analyses of the worksheet and their samples are loaded up
+    front with two catalog queries, whatever the number of rows of the
+    file. Samples can be looked up by ID or by Client Sample ID, samples
+    that are not in the worksheet are not found.
+    """
+
+    def __init__(self, worksheet):
+        super(WorksheetLookup, self).__init__()
+        self.worksheet = worksheet
+        self._aliases = {}
+        self._uid_ids = {}
+        self.preload()
+
+    def preload(self):
+        query = dict(portal_type="Analysis",
+                     getWorksheetUID=api.get_uid(self.worksheet))
+        analyses = {}
+        for brain in api.search(query, CATALOG_ANALYSIS_LISTING):
+            add_analysis(analyses.setdefault(brain.getRequestUID, {}), brain)
+        if not analyses:
+            return
+        query = dict(portal_type="AnalysisRequest", UID=analyses.keys())
+        for brain in api.search(query, CATALOG_ANALYSIS_REQUEST_LISTING):
+            sample_id = api.get_id(brain)
+            uid = api.get_uid(brain)
+            self._samples[sample_id] = api.get_object(brain)
+            self._analyses[uid] = analyses[uid]
+            self._uid_ids[uid] = sample_id
+            if brain.getClientSampleID:
+                self._aliases[brain.getClientSampleID] = sample_id
+
+    def prefetch(self, sample_ids):
+        """Nothing to do, all the samples of the worksheet are loaded
+        """
+
+    def resolve_uid(self, uid):
+        return self._uid_ids.get(uid)
+
+    def has_sample(self, sample_id):
+        return sample_id in self._samples or sample_id in self._aliases
+
+    def get_sample(self, sample_id):
+        if sample_id not in self._samples:
+            sample_id = self._aliases.get(sample_id)
+        return self._samples.get(sample_id)
+
+    def get_analyses(self, sample):
+        return self._analyses.get(api.get_uid(sample), {})
+
+
+class ExportLookup(object):
+    """Resolves the analyses of the worksheets exported.
+
+    The analyses of all the worksheets of an export are fetched with a
+    single catalog query, the parent and method UIDs being read from the
+    catalog metadata.
+    """
+
+    def __init__(self):
+        self._brains = {}
+
+    def prefetch(self, analysis_uids):
+        """Fetches the analyses not fetched yet in one query
+        """
+        analysis_uids = filter(None, set(analysis_uids))
+        analysis_uids = [uid for uid in analysis_uids
+                         if uid not in self._brains]
+        if not analysis_uids:
+            return
+        query = dict(UID=analysis_uids)
+        for brain in api.search(query, CATALOG_ANALYSIS_LISTING):
+            self._brains[api.get_uid(brain)] = brain
+
+    def get_object(self, analysis_uid):
+        brain = self._brains.get(analysis_uid)
+        if brain is None:
+            return api.get_object_by_uid(analysis_uid)
+        return api.get_object(brain)
+
+    def get_parent_uid(self, analysis_uid):
+        parent_uid = getattr(self._brains.get(analysis_uid), 'getParentUID',
+                             None)
+        if parent_uid is None:
+            parent_uid = self.get_object(analysis_uid).aq_parent.UID()
+        return parent_uid
+
+    def get_methods(self, analysis_uids):
+        """Returns the method UIDs of the analyses by analysis UID
+        """
+        self.prefetch(analysis_uids)
+        methods = {}
+        for uid in filter(None, set(analysis_uids)):
+            method = getattr(self._brains.get(uid), 'getMethodUID', None)
+            if method is None:
+                method = self.get_object(uid).getMethodUID()
+            methods[uid] = method
+        return methods
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+"""Bulk coercion of wide-format (samples x analytes) results.
+
+NumPy is optional (`senaite.instruments[numpy]`). Without it, to_matrix
+returns None and the parsers coerce the cells one at a time.
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def to_float_or_nan(value):
+    """Returns the float of a cell, NaN if it is empty or not numeric
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+def to_matrix(rows, keys):
+    """Returns the cells of the given columns as a rows x keys float array.
+
+    Cells that are empty or not numeric are NaN, see `numeric_mask`. The
+    cells are converted by NumPy a whole column at a time, only the cells
+    of the columns holding text are converted one by one.
+    """
+    if numpy is None:
+        return None
+    if not rows or not keys:
+        return numpy.empty((len(rows), len(keys)))
+    cells = numpy.char.strip(numpy.array(
+        [[row.get(key) or "" for key in keys] for row in rows], dtype=str))
+    cells[cells == ""] = "nan"
+    try:
+        return cells.astype(float)
+    except ValueError:
+        pass
+    matrix = numpy.empty(cells.shape)
+    for index in range(len(keys)):
+        column = cells[:, index]
+        try:
+            matrix[:, index] = column.astype(float)
+        except ValueError:
+            matrix[:, index] = [to_float_or_nan(cell) for cell in column]
+    return matrix
+
+
+def numeric_mask(matrix):
+    """Returns a boolean array, True for the cells holding a number
+    """
+    return ~numpy.isnan(matrix)
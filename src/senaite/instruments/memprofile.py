@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+"""Memory profile of an import, per phase.
+
+Enabled for one import with the `memory_profile` form value, or for all of
+them with the SENAITE_INSTRUMENTS_MEMORY_PROFILE environment variable.
+
+With tracemalloc (Python 3, or the pytracemalloc build of Python 2) the
+peak of the traced allocations and the top allocation sites (file:line)
+of every phase are reported. Without it the growth of the RSS of the
+process and the object types with the most new instances are reported
+instead, the peak of a phase is not known then.
+
+Phases can be nested (the decode phase of the spreadsheet formats and the
+resolve phase of the sample lookups run within the parse phase): the peak
+of a phase includes the peaks of the phases within it. Decoding in a worker process (see workers.py) is only
+accounted for the decoded lines it sends back.
+
+tracemalloc traces the whole process, so the profiled imports run one at
+a time: an import waits for the profiled import of another thread to end
+before it starts.
+"""
+
+import gc
+import os
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from senaite.instruments import logger
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+MEMORY_PROFILE_ENV = "SENAITE_INSTRUMENTS_MEMORY_PROFILE"
+
+TOP_SITES = 10
+# Frames kept per traced allocation
+TRACE_FRAMES = 1
+
+_local = threading.local()
+# Held by the thread running a profiled import
+_lock = threading.RLock()
+
+
+def enabled(form=None):
+    """Whether the import of the form is to be profiled
+    """
+    if form and form.get("memory_profile"):
+        return True
+    return os.environ.get(MEMORY_PROFILE_ENV, "") not in ("", "0")
+
+
+def get_rss_peak():
+    """Returns the peak resident set size of the process in bytes
+    """
+    if resource is None:
+        return 0
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def get_rss():
+    """Returns the resident set size of the process in bytes, the peak
+    one where the current one can not be read
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+    except (EnvironmentError, ValueError, IndexError):
+        return get_rss_peak()
+    return pages * resource.getpagesize()
+
+
+def count_types():
+    return Counter(type(obj).__name__ for obj in gc.get_objects())
+
+
+class PhaseProfile(object):
+    """Memory used by one phase
+    """
+
+    def __init__(self, name, tracing):
+        self.name = name
+        self.tracing = tracing
+        self.peak = 0
+        self.growth = 0
+        self.top = []
+        if tracing:
+            self.snapshot = tracemalloc.take_snapshot()
+            self.start = tracemalloc.get_traced_memory()[0]
+            self.types = None
+        else:
+            self.snapshot = None
+            self.start = get_rss()
+            self.types = count_types()
+            # Not known from the RSS
+            self.peak = None
+
+    def traced_peak(self):
+        """Returns the traced peak since the phase started, and resets it
+        for the phase within it
+        """
+        peak = tracemalloc.get_traced_memory()[1]
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        return peak
+
+    def enter_child(self):
+        if self.tracing:
+            self.peak = max(self.peak, self.traced_peak())
+
+    def exit_child(self, child):
+        if self.tracing:
+            self.peak = max(self.peak, child.peak)
+
+    def finish(self, limit=TOP_SITES):
+        if self.tracing:
+            self.peak = max(self.peak, self.traced_peak())
+            self.growth = tracemalloc.get_traced_memory()[0] - self.start
+            stats = tracemalloc.take_snapshot().compare_to(
+                self.snapshot, "lineno")
+            self.top = [
+                dict(site="{}:{}".format(stat.traceback[0].filename,
+                                         stat.traceback[0].lineno),
+                     size=stat.size_diff, count=stat.count_diff)
+                for stat in stats[:limit] if stat.size_diff > 0]
+        else:
+            self.growth = get_rss() - self.start
+            types = count_types()
+            types.subtract(self.types)
+            self.top = [dict(site=name, count=count)
+                        for name, count in types.most_common(limit)
+                        if count > 0]
+        self.snapshot = self.types = None
+
+    def summary(self):
+        return dict(phase=self.name, peak=self.peak, growth=self.growth,
+                    top=self.top)
+
+    def message(self):
+        if self.peak is None:
+            return "{} rss {:+.1f}MB".format(
+                self.name, self.growth / 1048576.0)
+        return "{} peak {:.1f}MB (+{:.1f}MB)".format(
+            self.name, self.peak / 1048576.0, self.growth / 1048576.0)
+
+
+class MemoryProfile(object):
+    """Memory profile of one import
+    """
+
+    def __init__(self):
+        self.tracer = "tracemalloc" if tracemalloc else "rusage"
+        self.phases = []
+        self.stack = []
+        self.started = False
+
+    def start(self):
+        if tracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACE_FRAMES)
+            self.started = True
+
+    def stop(self):
+        if self.started:
+            tracemalloc.stop()
+            self.started = False
+
+    @contextmanager
+    def phase(self, name):
+        tracing = tracemalloc is not None and tracemalloc.is_tracing()
+        if self.stack:
+            self.stack[-1].enter_child()
+        profile = PhaseProfile(name, tracing)
+        self.stack.append(profile)
+        try:
+            yield profile
+        finally:
+            # Not the last one if a phase of a generator ended late
+            self.stack.remove(profile)
+            profile.finish()
+            if self.stack:
+                self.stack[-1].exit_child(profile)
+            self.phases.append(profile)
+
+    def summary(self):
+        return dict(tracer=self.tracer,
+                    rss_peak=get_rss_peak(),
+                    phases=[profile.summary() for profile in self.phases])
+
+    def message(self):
+        return "Memory: {}".format(
+            ", ".join(profile.message() for profile in self.phases))
+
+
+@contextmanager
+def profile_memory(profile):
+    """Makes `profile` the memory profile of this thread within the block.
+    Waits for the profiled block of another thread to end first
+    """
+    with _lock:
+        previous = getattr(_local, "profile", None)
+        _local.profile = profile
+        profile.start()
+        try:
+            yield profile
+        finally:
+            profile.stop()
+            _local.profile = previous
+            logger.info(profile.message())
+
+
+@contextmanager
+def memory_phase(name):
+    """Records a phase in the memory profile of this thread, if any
+    """
+    profile = getattr(_local, "profile", None)
+    if profile is None:
+        yield None
+        return
+    with profile.phase(name) as phase:
+        yield phase
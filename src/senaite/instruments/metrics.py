@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+"""Import metrics per import interface, in Prometheus text format.
+
+Every import run (see importer.py) adds to the counters and histograms of
+its interface title. The metrics are cumulative since the start of the
+process: every Zope instance counts its own imports, and is scraped on its
+own (see browser/metrics.py).
+"""
+
+import threading
+
+PREFIX = "senaite_instruments_import_"
+
+# Upper bounds of the duration histograms, in seconds
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0,
+           300.0, float("inf"))
+
+# name, type, help
+METRICS = (
+    ("files_total", "counter", "Files imported"),
+    ("rows_total", "counter", "Rows read by the parsers"),
+    ("rejected_rows_total", "counter", "Rows rejected by the parsers"),
+    ("results_written_total", "counter", "Results committed"),
+    ("decoded_bytes_total", "counter", "Bytes of the files imported"),
+    ("duration_seconds", "histogram", "Duration of the imports"),
+    ("phase_seconds", "histogram", "Duration of the phases of the imports"),
+)
+
+
+def escape(value):
+    if isinstance(value, unicode):
+        value = value.encode("utf-8")
+    value = str(value)
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace(
+        "\n", "\\n")
+
+
+def format_labels(labels):
+    return "{{{}}}".format(",".join(
+        "{}=\"{}\"".format(name, escape(value)) for name, value in labels))
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, (int, long)):
+        return str(value)
+    return repr(value)
+
+
+class Histogram(object):
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        """Yields the (name, labels, value) of the cumulative buckets, the
+        sum and the count
+        """
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield (name + "_bucket", labels + (("le", format_value(bound)), ),
+                   cumulative)
+        yield name + "_sum", labels, self.sum
+        yield name + "_count", labels, self.count
+
+
+class Metrics(object):
+    """Counters and histograms by name and labels
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(labels))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(labels))
+        with self.lock:
+            histogram = self.values.get(key)
+            if histogram is None:
+                histogram = self.values[key] = Histogram()
+            histogram.observe(value)
+
+    def render(self):
+        """Returns the metrics in Prometheus text format
+        """
+        lines = []
+        with self.lock:
+            values = sorted(self.values.items())
+            for name, kind, description in METRICS:
+                lines.append("# HELP {}{} {}".format(
+                    PREFIX, name, description))
+                lines.append("# TYPE {}{} {}".format(PREFIX, name, kind))
+                for (key, labels), value in values:
+                    if key != name:
+                        continue
+                    if kind == "histogram":
+                        samples = value.samples(PREFIX + name, labels)
+                    else:
+                        samples = [(PREFIX + name, labels, value)]
+                    for sample, sample_labels, sample_value in samples:
+                        lines.append("{}{} {}".format(
+                            sample, format_labels(sample_labels),
+                            format_value(sample_value)))
+        return "\n".join(lines) + "\n"
+
+
+_metrics = Metrics()
+
+
+def get_metrics():
+    return _metrics
+
+
+def record_import(interface, stats, timings, duration):
+    """Adds an import run to the metrics of its interface title. `stats`
+    holds the status, rows, rejected_rows, results_written and
+    decoded_bytes of the run, `timings` the (phase, seconds) of it
+    """
+    labels = (("interface", interface), )
+    _metrics.inc("files_total", labels + (("status", stats["status"]), ))
+    for name in ("rows", "rejected_rows", "results_written",
+                 "decoded_bytes"):
+        _metrics.inc(name + "_total", labels, stats.get(name) or 0)
+    _metrics.observe("duration_seconds", labels, duration)
+    for phase, seconds in timings:
+        _metrics.observe("phase_seconds", labels + (("phase", phase), ),
+                         seconds)
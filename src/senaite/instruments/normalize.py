@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+import re
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from senaite.core.exportimport.instruments.instrument import \
+    format_keyword as core_format_keyword
+
+CACHE_SIZE = 4096
+
+# Only letters, numbers, dashes and underscores remain in sample IDs
+SAMPLE_ID_RE = re.compile(r"[^\w\d\-_]+")
+# Only letters and numbers remain in analyte names
+KEYWORD_RE = re.compile(r"[^\w\d]+")
+# Word characters only
+NON_WORD_RE = re.compile(r"\W+")
+# Digits and the decimal point only
+NON_NUMERIC_RE = re.compile(r"[^.\d]+")
+
+
+def lru_cache(maxsize=CACHE_SIZE):
+    """Caches the results of a one-argument function, least recently used
+    entries are dropped first when the cache is full
+    """
+    def decorator(func):
+        cache = OrderedDict()
+        lock = threading.Lock()
+
+        @wraps(func)
+        def wrapper(value):
+            with lock:
+                try:
+                    result = cache.pop(value)
+                except KeyError:
+                    pass
+                else:
+                    cache[value] = result
+                    return result
+            result = func(value)
+            with lock:
+                cache[value] = result
+                if len(cache) > maxsize:
+                    cache.popitem(last=False)
+            return result
+
+        wrapper.cache = cache
+        return wrapper
+    return decorator
+
+
+@lru_cache()
+def normalize_sample_id(value):
+    return SAMPLE_ID_RE.sub("", value or "")
+
+
+@lru_cache()
+def normalize_keyword(value):
+    return KEYWORD_RE.sub("", value or "")
+
+
+@lru_cache()
+def strip_non_word(value):
+    return NON_WORD_RE.sub("", value or "")
+
+
+def strip_non_numeric(value):
+    """Not cached, this is used for values rather than names
+    """
+    return NON_NUMERIC_RE.sub("", value)
+
+
+@lru_cache()
+def format_keyword(value):
+    return core_format_keyword(value)
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+"""On demand profiling of one import or export.
+
+A manager runs one import or export under cProfile by adding the `profile`
+form value. The stats are stored in the profiles directory, read from the
+SENAITE_INSTRUMENTS_PROFILE_DIR environment variable (default a folder in
+the temporary directory), and are downloaded with the `import_profile`
+view of the site (see browser/profile.py).
+
+The results of an import hold the ID of the stats and the functions with
+the most cumulative time. An export sends the ID in the X-Profile header.
+"""
+
+import cProfile
+import os
+import pstats
+import re
+import tempfile
+import time
+from contextlib import contextmanager
+from cStringIO import StringIO
+from functools import wraps
+from uuid import uuid4
+
+from AccessControl import getSecurityManager
+from Products.CMFCore.permissions import ManagePortal
+from senaite.instruments import logger
+
+PROFILE_DIR_ENV = "SENAITE_INSTRUMENTS_PROFILE_DIR"
+PROFILE_DIR = "senaite.instruments-profiles"
+PROFILE_HEADER = "X-Profile"
+
+TOP_FUNCTIONS = 20
+# Stats files kept, the oldest are removed
+KEEP_PROFILES = 50
+
+PROFILE_ID_RE = re.compile(r"^[\w.-]+\.prof$")
+NON_NAME_RE = re.compile(r"[^\w.-]+")
+
+
+def get_profile_dir():
+    path = os.environ.get(PROFILE_DIR_ENV) or os.path.join(
+        tempfile.gettempdir(), PROFILE_DIR)
+    if not os.path.isdir(path):
+        os.makedirs(path, 0700)
+    return path
+
+
+def get_profile_path(profile_id):
+    """Returns the path of the stats file with the given ID, None if there
+    is none
+    """
+    if not profile_id or not PROFILE_ID_RE.match(profile_id):
+        return None
+    path = os.path.join(get_profile_dir(), profile_id)
+    return path if os.path.isfile(path) else None
+
+
+def remove_old_profiles(keep=KEEP_PROFILES):
+    path = get_profile_dir()
+    names = sorted(name for name in os.listdir(path)
+                   if PROFILE_ID_RE.match(name))
+    for name in names[:-keep]:
+        try:
+            os.remove(os.path.join(path, name))
+        except OSError:
+            pass
+
+
+def requested(request, context):
+    """Whether the import or export of the request is to be profiled: the
+    `profile` form value is set, by a manager
+    """
+    form = getattr(request, "form", None) or {}
+    if not form.get("profile"):
+        return False
+    if getSecurityManager().checkPermission(ManagePortal, context):
+        return True
+    logger.warn("Profiling requested by a user who is no manager")
+    return False
+
+
+class Profile(object):
+    """cProfile stats of one import or export
+    """
+
+    def __init__(self, name):
+        self.id = "{}-{}-{}.prof".format(
+            time.strftime("%Y%m%d-%H%M%S"), NON_NAME_RE.sub("-", name),
+            uuid4().hex[:8])
+        self.profiler = cProfile.Profile()
+
+    def save(self):
+        self.profiler.dump_stats(os.path.join(get_profile_dir(), self.id))
+        remove_old_profiles()
+
+    def top(self, limit=TOP_FUNCTIONS):
+        """Returns the functions with the most cumulative time
+        """
+        stats = pstats.Stats(self.profiler, stream=StringIO())
+        stats.sort_stats("cumulative")
+        top = []
+        for func in stats.fcn_list[:limit]:
+            primitive_calls, calls, tottime, cumtime = stats.stats[func][:4]
+            top.append(dict(function=pstats.func_std_string(func),
+                            calls=calls,
+                            primitive_calls=primitive_calls,
+                            tottime=round(tottime, 4),
+                            cumtime=round(cumtime, 4)))
+        return top
+
+    def summary(self, limit=TOP_FUNCTIONS):
+        return dict(id=self.id, top=self.top(limit))
+
+    def message(self):
+        return "Profile stats saved as {}".format(self.id)
+
+
+@contextmanager
+def profile(name):
+    """Profiles the block, the stats are saved when it ends
+    """
+    capture = Profile(name)
+    capture.profiler.enable()
+    try:
+        yield capture
+    finally:
+        capture.profiler.disable()
+        capture.save()
+        logger.info("{}: {}".format(name, capture.message()))
+
+
+def profiled(func):
+    """Decorator for the Export methods of the interfaces: runs the export
+    under the profiler if requested. The export writes the response, so
+    the ID of the stats is sent in a header before it starts
+    """
+    @wraps(func)
+    def wrapper(self, context, request, *args, **kwargs):
+        if not requested(request, context):
+            return func(self, context, request, *args, **kwargs)
+        with profile(self.title) as capture:
+            request.RESPONSE.setHeader(PROFILE_HEADER, capture.id)
+            return func(self, context, request, *args, **kwargs)
+    return wrapper
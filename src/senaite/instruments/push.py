@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+"""Results pushed by instrument middleware as JSON.
+
+The results are posted to the `push_results` view (see browser/push.py)
+as records, without a results file to decode:
+
+    {"sample": "W-0001", "keyword": "Cu", "interims": {"Conc": 1.2}}
+
+The optional "result" is the result of the analysis, "remarks" its
+remarks and "date" the date of the result. The body is a JSON list of
+records, an object with the "records" and the import options (see
+OPTIONS) or one record per line (JSON lines).
+
+The body must be posted as application/json (or JSON lines as
+application/x-ndjson): browsers do not send these types cross-site without
+asking first, so the view can do without a CSRF token.
+
+The records are imported like the results of a file: the samples are
+resolved by the session lookup and the results committed by ImportRun.
+"""
+
+import json
+
+from senaite.core.exportimport.instruments.resultsimport import \
+    InstrumentResultsFileParser
+from senaite.instruments.importer import ImportInterface
+from senaite.instruments.importer import ImportRun
+from senaite.instruments.instrument import FileStub
+from senaite.instruments.rawresults import Schema
+
+# Import form values that can be given in the posted object
+OPTIONS = ("instrument", "worksheet", "artoapply", "results_override",
+           "chunk_size")
+
+# Content types the results can be posted as
+CONTENT_TYPES = ("application/json", "application/x-ndjson")
+
+# Name of the pushed results in the messages
+PUSH_FILENAME = "results.json"
+
+
+def to_str(value):
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    return value
+
+
+def decode_payload(body):
+    """Returns the import options and the records of a posted body.
+    Raises a ValueError if it can not be read
+    """
+    body = (body or "").strip()
+    if not body:
+        raise ValueError("No results posted")
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        payload = []
+        for numline, line in enumerate(body.splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                payload.append(json.loads(line))
+            except ValueError as e:
+                raise ValueError("Line {}: {}".format(numline, e))
+    options = {}
+    if isinstance(payload, dict):
+        if "records" not in payload:
+            # A single record
+            payload = dict(records=[payload])
+        options = dict((name, to_str(payload[name])) for name in OPTIONS
+                       if payload.get(name) is not None)
+        payload = payload["records"]
+    if not isinstance(payload, list):
+        raise ValueError("The records are no list")
+    return options, payload
+
+
+def check_record(record):
+    """Returns why the posted record can not be imported, None if it can
+    """
+    if not isinstance(record, dict):
+        return "The record is no object"
+    for name in ("sample", "keyword"):
+        if not isinstance(record.get(name), basestring) or \
+                not record[name].strip():
+            return "The record has no {}".format(name)
+    interims = record.get("interims")
+    if interims is not None and not isinstance(interims, dict):
+        return "The interims of the record are no object"
+    if not interims and record.get("result") is None:
+        return "The record has no result nor interims"
+    return None
+
+
+def is_json_request(request):
+    """Returns whether the body of the request is posted as JSON
+    """
+    content_type = request.getHeader("Content-Type") or ""
+    return content_type.split(";")[0].strip().lower() in CONTENT_TYPES
+
+
+def read_body(request):
+    body = request.get("BODY")
+    if body is None:
+        request.stdin.seek(0)
+        body = request.stdin.read()
+    return body
+
+
+class PushParser(InstrumentResultsFileParser):
+    """Turns the posted records into raw results
+    """
+    # Fields of the raw result records, the interims are added as they come
+    schema = Schema(("DefaultResult", "Remarks", "DateTime", "result"))
+
+    def __init__(self, infile, records, session):
+        InstrumentResultsFileParser.__init__(self, infile, "JSON")
+        self.records = records
+        self.session = session
+
+    def parse(self):
+        self.log("Parsing ${count} pushed records",
+                 mapping={"count": len(self.records)})
+        lookup = self.session.lookup
+        lookup.prefetch([to_str(record.get("sample")) for record in
+                         self.records if not check_record(record)])
+        for numline, record in enumerate(self.records, 1):
+            self._numline = numline
+            error = check_record(record)
+            if error:
+                self.err(error, numline=numline)
+                continue
+            self.add_record(record)
+        self.log(
+            "End of file reached successfully: ${total_objects} objects, "
+            "${total_analyses} analyses, ${total_results} results",
+            mapping={"total_objects": self.getObjectsTotalCount(),
+                     "total_analyses": self.getAnalysesTotalCount(),
+                     "total_results": self.getResultsTotalCount()}
+        )
+        return True
+
+    def add_record(self, record):
+        sample = self.session.lookup.resolve(to_str(record["sample"]).strip())
+        keyword = to_str(record["keyword"]).strip()
+        values = self.schema.record(
+            DefaultResult=None,
+            Remarks=to_str(record.get("remarks") or ""),
+            DateTime=self.session.result_date(to_str(record.get("date"))))
+        if record.get("result") is not None:
+            values.update(result=to_str(record["result"]),
+                          DefaultResult="result")
+        for name, value in (record.get("interims") or {}).items():
+            values[to_str(name)] = to_str(value)
+        self._addRawResult(sample, {keyword: values})
+
+
+class PushRun(ImportRun):
+    """An import of the results posted to the push API.
+
+    The import options are read from the form (the query string) or from
+    the posted object.
+    """
+
+    def __init__(self, interface, context, request):
+        self.records = []
+        self.payload_error = None
+        options = {}
+        body = read_body(request)
+        self.body_size = len(body or "")
+        try:
+            options, self.records = decode_payload(body)
+        except ValueError as e:
+            self.payload_error = str(e)
+        for name, value in options.items():
+            request.form.setdefault(name, value)
+        super(PushRun, self).__init__(interface, context, request)
+        self.infile = FileStub(file=None, name=PUSH_FILENAME)
+
+    def get_size(self):
+        return self.body_size
+
+    def validate(self):
+        if self.payload_error:
+            self.errors.append(self.payload_error)
+            return False
+        if not self.records:
+            self.errors.append("No results posted")
+            return False
+        return True
+
+
+class pushimport(ImportInterface):
+    title = "Results pushed as JSON"
+    # Pushed batches can be large, they are committed every 100 samples
+    chunk_size = 100
+
+    @classmethod
+    def get_parser(cls, run):
+        return PushParser(run.infile, run.records, session=run.session)
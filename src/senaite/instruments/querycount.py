@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+import json
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from time import time
+
+from senaite.instruments import logger
+
+TOP_QUERIES = 5
+
+_local = threading.local()
+_lock = threading.Lock()
+_installed = []
+
+
+class QueryRecorder(object):
+    """Counts and times the catalog queries issued by one import or export
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.queries = {}
+
+    def record(self, catalog_id, query, elapsed):
+        self.count += 1
+        self.time += elapsed
+        key = query_key(catalog_id, query)
+        stats = self.queries.setdefault(key, [0, 0.0])
+        stats[0] += 1
+        stats[1] += elapsed
+
+    def top(self, limit=TOP_QUERIES):
+        """Returns the queries issued more than once, most repeated first
+        """
+        repeated = [(key, stats) for key, stats in self.queries.items()
+                    if stats[0] > 1]
+        repeated.sort(key=lambda item: (-item[1][0], -item[1][1]))
+        return [dict(query=key, count=stats[0], time=round(stats[1], 4))
+                for key, stats in repeated[:limit]]
+
+    def summary(self):
+        return dict(count=self.count,
+                    time=round(self.time, 4),
+                    top=self.top())
+
+    def message(self):
+        return "{} catalog queries in {:.3f}s".format(self.count, self.time)
+
+
+def query_key(catalog_id, query):
+    items = sorted((k, v) for k, v in query.items() if k != "REQUEST")
+    terms = ", ".join("{}={!r}".format(k, v) for k, v in items)
+    return "{}({})".format(catalog_id, terms)
+
+
+def _recording(func):
+    """Wraps a catalog search method, keeping its signature: the query is
+    given as the first positional argument (REQUEST) or as keywords
+    """
+    @wraps(func)
+    def wrapper(self, *args, **kw):
+        recorder = getattr(_local, "recorder", None)
+        if recorder is None or getattr(_local, "busy", False):
+            return func(self, *args, **kw)
+        _local.busy = True
+        start = time()
+        try:
+            return func(self, *args, **kw)
+        finally:
+            _local.busy = False
+            query = args[0] if args else kw.get("REQUEST")
+            terms = dict(query) if isinstance(query, dict) else {}
+            terms.update(kw)
+            recorder.record(self.getId(), terms, time() - start)
+    return wrapper
+
+
+def install():
+    """Wraps ZCatalog searches so they can be recorded per thread.
+
+    The wrapper does nothing but delegate unless a recorder is active in
+    the current thread. CatalogTool based catalogs (portal_catalog and the
+    senaite catalogs) end up in ZCatalog.searchResults, plain catalogs like
+    the uid_catalog are called directly.
+    """
+    if _installed:
+        return
+    from Products.ZCatalog.ZCatalog import ZCatalog
+    with _lock:
+        if _installed:
+            return
+        ZCatalog.searchResults = _recording(ZCatalog.searchResults.im_func)
+        ZCatalog.__call__ = _recording(ZCatalog.__call__.im_func)
+        _installed.append(True)
+
+
+@contextmanager
+def record_queries():
+    """Records the catalog queries issued in this thread within the block
+    """
+    install()
+    recorder = QueryRecorder()
+    previous = getattr(_local, "recorder", None)
+    _local.recorder = recorder
+    try:
+        yield recorder
+    finally:
+        _local.recorder = previous
+
+
+def report(name, recorder):
+    logger.info("{}: {}".format(name, recorder.message()))
+    for query in recorder.top():
+        logger.info("{}: {count}x {time}s {query}".format(name, **query))
+
+
+def count_queries(func):
+    """Decorator for the Import and Export methods of the interfaces.
+
+    The summary is written to the log. Import results are extended with a
+    log line and a `catalog_queries` entry.
+    """
+    name = "{}.{}".format(func.__module__.split(".")[-1], func.__name__)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with record_queries() as recorder:
+            result = func(*args, **kwargs)
+        report(name, recorder)
+        if not isinstance(result, basestring):
+            return result
+        try:
+            results = json.loads(result)
+        except ValueError:
+            return result
+        results.setdefault('log', []).append(recorder.message())
+        results['catalog_queries'] = recorder.summary()
+        return json.dumps(results)
+    return wrapper
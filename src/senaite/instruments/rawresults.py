@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+"""Compact records for the raw results of the parsers.
+
+The results importer expects a mapping of interim/field names to values for
+every analysis result. A dict per result repeats the same keys (and a hash
+table sized for them) for every line of the file. A Record instead keeps a
+plain list of values, positioned by a Schema shared by all the records of a
+parser, which holds the interned field names once.
+"""
+
+import threading
+from copy import deepcopy
+
+
+class _Missing(object):
+    """Marks the fields a record has no value for
+    """
+
+    def __repr__(self):
+        return "MISSING"
+
+    def __reduce__(self):
+        return "MISSING"
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+MISSING = _Missing()
+
+
+class Schema(object):
+    """Ordered field names shared by records.
+
+    Fields not known in advance (e.g. AORC's per ion fields) are appended
+    when first set, positions never change.
+    """
+
+    def __init__(self, fields=()):
+        self.fields = []
+        self.positions = {}
+        self.lock = threading.Lock()
+        for name in fields:
+            self.position(name, create=True)
+
+    def position(self, name, create=False):
+        try:
+            return self.positions[name]
+        except KeyError:
+            if not create:
+                raise
+        with self.lock:
+            if name not in self.positions:
+                if isinstance(name, str):
+                    name = intern(name)
+                self.positions[name] = len(self.fields)
+                self.fields.append(name)
+            return self.positions[name]
+
+    def record(self, *args, **kwargs):
+        """Returns a new record, with the values of a mapping and/or keyword
+        arguments like dict()
+        """
+        record = Record(self)
+        record.update(*args, **kwargs)
+        return record
+
+    def __getstate__(self):
+        return self.fields
+
+    def __setstate__(self, fields):
+        self.__init__(fields)
+
+
+class Record(object):
+    """Mapping of field names to values, stored in the order of a Schema.
+
+    Supports the dict API used by the results importer.
+    """
+    __slots__ = ("schema", "_values")
+
+    def __init__(self, schema, values=()):
+        self.schema = schema
+        self._values = list(values)
+
+    def __getitem__(self, key):
+        try:
+            value = self._values[self.schema.positions[key]]
+        except (KeyError, IndexError):
+            raise KeyError(key)
+        if value is MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        position = self.schema.position(key, create=True)
+        missing = position + 1 - len(self._values)
+        if missing > 0:
+            self._values.extend([MISSING] * missing)
+        self._values[position] = value
+
+    def __delitem__(self, key):
+        self[key]
+        self._values[self.schema.positions[key]] = MISSING
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    has_key = __contains__
+
+    def __len__(self):
+        return len(self._values) - self._values.count(MISSING)
+
+    def iteritems(self):
+        for name, value in zip(self.schema.fields, self._values):
+            if value is not MISSING:
+                yield name, value
+
+    def iterkeys(self):
+        for name, value in self.iteritems():
+            yield name
+
+    __iter__ = iterkeys
+
+    def itervalues(self):
+        for name, value in self.iteritems():
+            yield value
+
+    def items(self):
+        return list(self.iteritems())
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def values(self):
+        return list(self.itervalues())
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def setdefault(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            self[key] = default
+            return default
+
+    def pop(self, key, *default):
+        try:
+            value = self[key]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        del self[key]
+        return value
+
+    def update(self, *args, **kwargs):
+        for other in args + (kwargs, ):
+            if hasattr(other, "keys"):
+                pairs = [(key, other[key]) for key in other.keys()]
+            else:
+                pairs = other
+            for key, value in pairs:
+                self[key] = value
+
+    def copy(self):
+        return Record(self.schema, self._values)
+
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        # the schema is shared, not copied
+        return Record(self.schema, deepcopy(self._values, memo))
+
+    def __reduce__(self):
+        return Record, (self.schema, self._values)
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            other = dict(other.iteritems())
+        return dict(self.iteritems()) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(dict(self.iteritems()))
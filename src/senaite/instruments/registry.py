@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+"""Registry of the instrument interfaces of this package.
+
+The adapters of instruments/configure.zcml are registered with the lazy
+factories of this module, so the vendor modules (and the spreadsheet and
+senaite.core modules they import) are only loaded when an interface is
+used for the first time. The titles and metadata of the interfaces are
+available here without loading them.
+"""
+
+import threading
+from collections import OrderedDict
+
+from zope.dottedname.resolve import resolve
+
+IMPORT = "import"
+EXPORT = "export"
+
+PACKAGE = "senaite.instruments.instruments"
+
+# name -> LazyFactory
+REGISTRY = OrderedDict()
+
+
+class LazyFactory(object):
+    """Adapter factory importing the interface class on first call
+    """
+
+    def __init__(self, name, dotted_name, title, kind, **metadata):
+        self.name = name
+        self.dotted_name = dotted_name
+        self.title = title
+        self.kind = kind
+        self.metadata = metadata
+        self._factory = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._factory is not None
+
+    def resolve(self):
+        """Returns the interface class, importing its module if needed
+        """
+        if self._factory is None:
+            with self._lock:
+                if self._factory is None:
+                    self._factory = resolve(self.dotted_name)
+        return self._factory
+
+    def __call__(self, context):
+        return self.resolve()(context)
+
+    def __repr__(self):
+        return "<LazyFactory {} ({})>".format(self.name, self.dotted_name)
+
+
+def register(name, module, class_name, title, kind, **metadata):
+    """Adds an interface to the registry and returns its lazy factory.
+
+    Metadata used by this package:
+    - file_formats: the file extensions the interface reads
+    - signatures: tuples of markers all found in the files of the interface
+      (see detect.py)
+    """
+    dotted_name = "{}.{}.{}".format(PACKAGE, module, class_name)
+    factory = LazyFactory(name, dotted_name, title, kind, **metadata)
+    REGISTRY[name] = factory
+    return factory
+
+
+def get_interfaces(kind=None):
+    """Returns the lazy factories of the registered interfaces
+    """
+    return [factory for factory in REGISTRY.values()
+            if kind is None or factory.kind == kind]
+
+
+def get_interface(name):
+    return REGISTRY.get(name)
+
+
+chemstation_importer = register(
+    "chemstation_importer",
+    "agilent.chemstation.chemstation", "chemstationimport",
+    "Agilent ChemStation", IMPORT,
+    file_formats=("xls", "xlsx"),
+    signatures=(("Sample Name:", "Comp #"),))
+
+masshunter_qualitative_importer = register(
+    "masshunter_qualitative_importer",
+    "agilent.masshunter.qualitative", "qualitativeimport",
+    "Agilent Masshunter Qualitative", IMPORT,
+    file_formats=("csv",),
+    signatures=(("Score (", "Sample Name"),))
+
+masshunter_qualitative_exporter = register(
+    "masshunter_qualitative_exporter",
+    "agilent.masshunter.qualitative", "qualitativeexport",
+    "Agilent Masshunter Qualitative Exporter", EXPORT)
+
+masshunter_quantitative_importer = register(
+    "masshunter_quantitative_importer",
+    "agilent.masshunter.quantitative", "quantitativeimport",
+    "Agilent Masshunter Quantitative", IMPORT,
+    file_formats=("csv",),
+    signatures=(("Acq. Date-Time", "Data File", " Method"),))
+
+masshunter_quantitative_exporter = register(
+    "masshunter_quantitative_exporter",
+    "agilent.masshunter.quantitative", "quantitativeexport",
+    "Agilent Masshunter Quantitative Exporter", EXPORT)
+
+masshunter_aorc_importer = register(
+    "masshunter_aorc_importer",
+    "agilent.masshunter.aorc", "aorcimport",
+    "Quanti AORC", IMPORT,
+    file_formats=("xls", "xlsx"),
+    signatures=(("Laboratory number", "Molecule"),))
+
+s8tiger_importer = register(
+    "s8tiger_importer",
+    "bruker.s8tiger.s8tiger", "importer",
+    "Bruker S8 Tiger", IMPORT,
+    file_formats=("csv", "xls", "xlsx"),
+    signatures=(("Formula", "Net int."),))
+
+pe900h8300_importer = register(
+    "pe900h8300_importer",
+    "perkinelmer.winlab32.winlab32", "importer",
+    "Perkin Elmer Winlab32", IMPORT,
+    file_formats=("csv", "xls", "xlsx"),
+    signatures=(("Sample ID", "Reported Conc (Calib)"),))
+
+nexion350x_importer = register(
+    "nexion350x_importer",
+    "perkinelmer.nexion350x.nexion350x", "importer",
+    "Perkin Elmer Nexion 350X", IMPORT,
+    file_formats=("csv", "xls", "xlsx"))
+
+auto_importer = register(
+    "auto_importer",
+    "auto.auto", "autoimport",
+    "Detect the instrument from the file", IMPORT)
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+"""Autosampler trays of the sequence exporters.
+
+Without a tray capacity the samples are exported as before: all of them in
+tray 1, the vial being the worksheet position. With the `tray_capacity`
+data interface option of the instrument, the samples are packed in trays
+of that many vials instead:
+
+- the samples are grouped by the methods of their analyses, the groups in
+  the order of the worksheet, so the instrument switches methods as little
+  as possible
+- with the `trays` option (the trays the autosampler holds) the groups are
+  packed in as many sequences as needed, a group only being split across
+  sequences if it does not fit in one
+"""
+
+import zipfile
+from collections import OrderedDict
+from cStringIO import StringIO
+
+TRAY_CAPACITY_OPTION = "tray_capacity"
+TRAYS_OPTION = "trays"
+
+
+def get_int_option(options, name):
+    try:
+        return max(int(options.get(name) or 0), 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def get_tray_options(options):
+    """Returns the tray capacity and the number of trays of the data
+    interface options, 0 if not set
+    """
+    return (get_int_option(options, TRAY_CAPACITY_OPTION),
+            get_int_option(options, TRAYS_OPTION))
+
+
+def get_samples(layout, methods=None):
+    """Returns one item per sample of the worksheet layout, in layout order.
+
+    An item is a dict with the parent_uid, container_uid and analysis_uid
+    of the first slot of the sample, its position and its method: the
+    method UIDs of its analyses in the worksheet (from `methods`, analysis
+    UID -> method UID)
+    """
+    methods = methods or {}
+    samples = OrderedDict()
+    for item in layout:
+        p_uid = item.get('parent_uid') or item.get('container_uid')
+        if not p_uid:
+            continue
+        if p_uid not in samples:
+            samples[p_uid] = dict(
+                parent_uid=p_uid,
+                container_uid=item.get('container_uid'),
+                analysis_uid=item.get('analysis_uid'),
+                position=int(item['position']),
+                method=set())
+        samples[p_uid]['method'].add(methods.get(item.get('analysis_uid')))
+    for sample in samples.values():
+        sample['method'] = tuple(sorted(filter(None, sample['method'])))
+    return samples.values()
+
+
+def first_position(items):
+    return items[0]['position']
+
+
+def pack(groups, size):
+    """Packs the groups of items in sequences of at most `size` items.
+
+    Groups larger than a sequence fill whole sequences first. The rest are
+    packed first fit, largest first. The sequences and the groups in them
+    are in worksheet order.
+    """
+    sequences = []
+    pieces = []
+    for group in groups:
+        while len(group) > size:
+            sequences.append([group[:size]])
+            group = group[size:]
+        if group:
+            pieces.append(group)
+    bins = []
+    for piece in sorted(pieces, key=len, reverse=True):
+        for packed in bins:
+            if sum(map(len, packed)) + len(piece) <= size:
+                packed.append(piece)
+                break
+        else:
+            bins.append([piece])
+    sequences.extend(bins)
+    sequences = [sum(sorted(packed, key=first_position), [])
+                 for packed in sequences]
+    return sorted(sequences, key=first_position)
+
+
+def schedule(items, capacity=0, trays=0):
+    """Sets the tray and vial of the items (dicts with the position and the
+    method of a sample) and returns them as a list of sequences
+    """
+    items = sorted(items, key=lambda item: item['position'])
+    if not items:
+        return []
+    if not capacity:
+        for item in items:
+            item['tray'] = 1
+            item['vial'] = item['position']
+        return [items]
+    groups = OrderedDict()
+    for item in items:
+        groups.setdefault(item.get('method'), []).append(item)
+    if trays:
+        sequences = pack(groups.values(), capacity * trays)
+    else:
+        sequences = [sum(groups.values(), [])]
+    for sequence in sequences:
+        for index, item in enumerate(sequence):
+            item['tray'] = index // capacity + 1
+            item['vial'] = index % capacity + 1
+    return sequences
+
+
+def sequence_filename(filename, number, total):
+    """Returns the name of the file of a sequence, numbered if there is
+    more than one
+    """
+    if total < 2:
+        return filename
+    base, dot, extension = filename.rpartition('.')
+    if not dot:
+        return "{}-{}".format(filename, number)
+    return "{}-{}.{}".format(base, number, extension)
+
+
+def zip_files(files):
+    """Returns a ZIP archive of the (filename, data) pairs
+    """
+    archive = StringIO()
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for filename, data in files:
+            zf.writestr(filename, data)
+    return archive.getvalue()
+
+
+def stream_files(request, files, content_type, disposition='attachment'):
+    """Writes the sequence files to the response, a ZIP archive of them if
+    there is more than one
+    """
+    filename, data = files[0]
+    if len(files) > 1:
+        filename = "{}.zip".format(filename.rpartition('-')[0])
+        data = zip_files(files)
+        content_type = 'application/zip'
+        disposition = 'attachment'
+    setheader = request.RESPONSE.setHeader
+    setheader('Content-Length', len(data))
+    setheader('Content-Type', content_type)
+    setheader('Content-Disposition',
+              '{}; filename="{}"'.format(disposition, filename))
+    request.RESPONSE.write(data)
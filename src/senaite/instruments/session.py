@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+from datetime import datetime
+
+from bika.lims import api
+from DateTime import DateTime
+from DateTime.interfaces import DateTimeError
+from plone.i18n.normalizer.interfaces import IIDNormalizer
+from senaite.instruments.lookup import ExportLookup
+from senaite.instruments.lookup import SampleLookup
+from zope.component import getUtility
+
+# Format of the 'DateTime' of raw results, as read by AnalysisResultsImporter
+RESULT_DATE_FORMAT = "%Y%m%d %H:%M:%S"
+
+
+class Session(object):
+    """Values that are the same for a whole import or export run.
+
+    Created once per run and handed to every stage of it, so the per row
+    code does not compute them again.
+    """
+
+    def __init__(self, instrument=None, options=None):
+        self.now = DateTime()
+        self.instrument = instrument
+        self.options = options or {}
+        self._normalize = None
+
+    @property
+    def timestamp(self):
+        """The time of the run, to the minute
+        """
+        return str(self.now)[:16]
+
+    @property
+    def normalize(self):
+        """The ID normalizer
+        """
+        if self._normalize is None:
+            self._normalize = getUtility(IIDNormalizer).normalize
+        return self._normalize
+
+
+class ImportSession(Session):
+    """An import run. Holds the samples and analyses looked up so far
+    """
+
+    def __init__(self, instrument_uid=None, options=None, lookup=None):
+        super(ImportSession, self).__init__(None, options)
+        self.instrument_uid = instrument_uid
+        self.lookup = lookup if lookup else SampleLookup()
+        self._result_date = self.now.asdatetime().strftime(RESULT_DATE_FORMAT)
+        self._dates = {}
+
+    def result_date(self, value=None, date_format=None):
+        """Returns the 'DateTime' for a raw result: the date and time
+        `value` from the file if it can be read, in `date_format` (a
+        strptime format) if given, the time of the run otherwise
+        """
+        if not value:
+            return self._result_date
+        key = (value, date_format)
+        if key not in self._dates:
+            try:
+                if date_format:
+                    date = datetime.strptime(value.strip(), date_format)
+                else:
+                    date = DateTime(value).asdatetime()
+                self._dates[key] = date.strftime(RESULT_DATE_FORMAT)
+            except (DateTimeError, ValueError):
+                self._dates[key] = self._result_date
+        return self._dates[key]
+
+    def get_instrument(self):
+        """Returns the instrument results are imported for, if any
+        """
+        if self.instrument is None and self.instrument_uid:
+            self.instrument = api.get_object_by_uid(self.instrument_uid, None)
+        return self.instrument
+
+
+class ExportSession(Session):
+    """An export run for a worksheet. The options are the given defaults
+    updated with the data interface options of the worksheet's instrument.
+    The lookup can be shared by the exports of several worksheets.
+    """
+
+    def __init__(self, context, defaults=None, lookup=None):
+        instrument = context.getInstrument()
+        options = dict(defaults or {})
+        if instrument:
+            for k, v in instrument.getDataInterfaceOptions():
+                options[k] = v
+        super(ExportSession, self).__init__(instrument, options)
+        self.context = context
+        self.lookup = lookup if lookup else ExportLookup()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+"""Spreadsheet decoding.
+
+This module only depends on the spreadsheet libraries, so it can be used
+by the decoding worker processes (see decodeworker.py) as well.
+"""
+
+import types
+from io import BytesIO
+
+
+def iter_xls_lines(contents=None, worksheet=0, delimiter=",", path=None):
+    """Yields the rows of a legacy Excel (BIFF) sheet as delimited lines.
+
+    The workbook is opened on demand: only the requested sheet is parsed,
+    and it is released once its rows are read. The file is memory mapped
+    when a path is given, `contents` can be a mmap too.
+    """
+    from xlrd import open_workbook
+    if path:
+        wb = open_workbook(filename=path, on_demand=True, use_mmap=True)
+    else:
+        wb = open_workbook(file_contents=contents, on_demand=True)
+    try:
+        sheet = wb.sheet_by_index(worksheet)
+
+        # extract all rows
+        for row in sheet.get_rows():
+            line = []
+            for cell in row:
+                value = cell.value
+                if type(value) in types.StringTypes:
+                    value = value.encode("utf8")
+                if value is None:
+                    value = ""
+                line.append(str(value))
+            yield delimiter.join(line) + "\n"
+        wb.unload_sheet(worksheet)
+    finally:
+        wb.release_resources()
+
+
+def iter_xlsx_lines(contents=None, worksheet=0, delimiter=",", path=None):
+    """Yields the rows of an Office Open XML sheet as delimited lines.
+
+    Only the first line of multi-line cells is kept. `contents` can be a
+    mmap, it is copied as BytesIO does not take one on Python 2.
+    """
+    from openpyxl import load_workbook
+    if not path and not isinstance(contents, str):
+        contents = contents[:]
+    wb = load_workbook(filename=path or BytesIO(contents))
+    sheet = wb.worksheets[worksheet]
+
+    # extract all rows
+    for row in sheet.rows:
+        line = []
+        for cell in row:
+            value = cell.value
+            try:
+                value = value.encode("utf8")
+            except:  # noqa
+                pass
+            if value is None:
+                value = ""
+            line.append(str(value).split("\n")[0].strip())
+        yield delimiter.join(line) + "\n"
+
+
+DECODERS = {
+    "xls": iter_xls_lines,
+    "xlsx": iter_xlsx_lines,
+}
@@ -0,0 +1,494 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+"""Concurrent import load test.
+
+Starts a ZEO server on a copy of the instance's Data.fs and several ZEO
+client processes importing synthetic Winlab32, Nexion 350X, S8 Tiger and
+MassHunter Quantitative files at the same time, for the same pool of
+synthetic samples. Reports the throughput, the conflict errors retried and
+the latency percentiles of every interface.
+
+Run it from the buildout directory, with the instance stopped::
+
+    bin/instance run src/senaite/instruments/tests/loadtest.py run \\
+        --site senaite --clients 4 --samples 200 --rounds 5
+
+The instance's database is not modified. Options:
+
+    --site        id of the SENAITE site (default senaite)
+    --user        Zope user the imports run as (default admin)
+    --clients     number of client processes (default 4)
+    --samples     number of synthetic samples created (default 100)
+    --batch       samples per imported file (default 20)
+    --rounds      imports per interface and client (default 3)
+    --chunk-size  chunk_size of the imports, 0 for one transaction
+    --interfaces  comma separated, default winlab32,nexion350x,s8tiger,
+                  quantitative
+    --instance    the instance script (default bin/instance)
+    --zope-conf   the instance's zope.conf (default the one of the instance)
+    --datafs      the Data.fs to copy (default the one of the instance)
+
+The `setup` and `client` commands are run by the `run` command in the
+client processes.
+"""
+
+import json
+import optparse
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from cStringIO import StringIO
+
+SERVICES = ("Au", "Ag", "Cu", "Zn")
+OXIDES = ("Fe2O3", "SiO2", "Al2O3")
+QUANT_KEYWORD = "LoadQuant"
+QUANT_INTERIMS = ("ReturnTime", "Resp", "CalcConc", "FinalConc",
+                  "Accuracy", "Ratio", "MI")
+
+INTERFACES = {
+    "winlab32": "senaite.instruments.instruments.perkinelmer.winlab32"
+                ".winlab32.importer",
+    "nexion350x": "senaite.instruments.instruments.perkinelmer.nexion350x"
+                  ".nexion350x.importer",
+    "s8tiger": "senaite.instruments.instruments.bruker.s8tiger.s8tiger"
+               ".importer",
+    "quantitative": "senaite.instruments.instruments.agilent.masshunter"
+                    ".quantitative.quantitativeimport",
+}
+
+# Commit retries of an import done in a single transaction, as the
+# publisher does
+COMMIT_RETRIES = 3
+
+UPDATED_RE = re.compile(r"(\d+) results updated")
+
+ZEO_CONF = """<zodb_db main>
+    mount-point /
+    <zeoclient>
+        server {address}
+        storage 1
+        name zeostorage
+        var {var}
+        cache-size 64MB
+    </zeoclient>
+</zodb_db>"""
+
+
+def get_options(args):
+    parser = optparse.OptionParser()
+    parser.add_option("--site", default="senaite")
+    parser.add_option("--user", default="admin")
+    parser.add_option("--clients", type="int", default=4)
+    parser.add_option("--samples", type="int", default=100)
+    parser.add_option("--batch", type="int", default=20)
+    parser.add_option("--rounds", type="int", default=3)
+    parser.add_option("--chunk-size", type="int", default=0)
+    parser.add_option("--interfaces", default=",".join(sorted(INTERFACES)))
+    parser.add_option("--instance", default="bin/instance")
+    parser.add_option("--zope-conf", default=None)
+    parser.add_option("--datafs", default=None)
+    parser.add_option("--index", type="int", default=0)
+    parser.add_option("--sample-ids", default=None)
+    return parser.parse_args(args)
+
+
+# Synthetic files
+
+def winlab32_file(sample_ids, rnd):
+    lines = ["Sample ID,Analyte Name,Date,Time,Reported Conc (Calib),"
+             "Units (Samp)"]
+    for sample_id in sample_ids:
+        for keyword in SERVICES:
+            lines.append("{},{},28-05-21,12:40:54 PM,{:.3f},mg/kg".format(
+                sample_id, keyword, rnd.uniform(0, 10)))
+    return [("results.csv", "\n".join(lines) + "\n")]
+
+
+def nexion350x_file(sample_ids, rnd):
+    lines = [",".join(("Sample Id",) + SERVICES)]
+    for sample_id in sample_ids:
+        values = ["{:.4f}".format(rnd.uniform(0, 10)) for k in SERVICES]
+        lines.append(",".join([sample_id] + values))
+    return [("results.csv", "\n".join(lines) + "\n")]
+
+
+def s8tiger_file(sample_ids, rnd):
+    """One file per sample, named after it
+    """
+    header = ("Formula,Concentration,Z,Status,Line 1,Net int.,LLD,"
+              "Stat. error,Analyzed layer,Bound %")
+    files = []
+    for sample_id in sample_ids:
+        lines = [header]
+        for formula in OXIDES:
+            lines.append(
+                "{},{:.2f} %,26,XRF 1,Fe KA1-HR-Tr,1930,100.3 PPM,0.13%,"
+                "67 um,".format(formula, rnd.uniform(0, 50)))
+        files.append(("{}.csv".format(sample_id), "\n".join(lines) + "\n"))
+    return files
+
+
+def quantitative_file(sample_ids, rnd):
+    lines = [
+        "Sample,,,,,,,{0} Method,{0} Results,,,,,,".format(QUANT_KEYWORD),
+        ",,Name,Data File,Type,Level,Acq. Date-Time,Exp. Conc.,RT,Resp.,"
+        "Calc. Conc.,Final Conc.,Accuracy,Ratio,MI",
+    ]
+    for sample_id in sample_ids:
+        lines.append(
+            "!,!,{},,Sample,,2/28/2019 12:14 AM,,{:.3f},{},{:.4f},{:.4f},,"
+            "3,FALSE".format(sample_id, rnd.uniform(20, 30),
+                             rnd.randint(1000, 2000000),
+                             rnd.uniform(0, 1), rnd.uniform(0, 1)))
+    return [("results.csv", "\n".join(lines) + "\n")]
+
+
+FILES = {
+    "winlab32": winlab32_file,
+    "nexion350x": nexion350x_file,
+    "s8tiger": s8tiger_file,
+    "quantitative": quantitative_file,
+}
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile
+    """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = int(round(percent / 100.0 * len(values) + 0.5))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+# Orchestration (no database access)
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def wait_for_port(port, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), 1).close()
+            return
+        except socket.error:
+            time.sleep(0.2)
+    raise RuntimeError("ZEO server did not start on port {}".format(port))
+
+
+def subprocess_env():
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, sys.path))
+    return env
+
+
+def start_zeo(datafs, port):
+    return subprocess.Popen(
+        [sys.executable, "-m", "ZEO.runzeo",
+         "-a", "127.0.0.1:{}".format(port), "-f", datafs],
+        env=subprocess_env())
+
+
+def write_client_conf(zope_conf, address, tmpdir):
+    """Writes the instance's zope.conf with the main database served by
+    the load test ZEO server
+    """
+    with open(zope_conf) as conf:
+        text = conf.read()
+    zeo = ZEO_CONF.format(address=address, var=tmpdir)
+    text, count = re.subn(r"<zodb_db main>.*?</zodb_db>", lambda m: zeo,
+                          text, flags=re.S)
+    if not count:
+        raise RuntimeError("No main database in {}".format(zope_conf))
+    path = os.path.join(tmpdir, "zope.conf")
+    with open(path, "w") as conf:
+        conf.write(text)
+    return path
+
+
+def run_command(options, conf, command, *args):
+    """Runs a command of this script in an instance process, returns the
+    JSON it prints last
+    """
+    cmd = [options.instance, "-C", conf, "run", os.path.abspath(__file__),
+           command, "--site", options.site, "--user", options.user]
+    cmd.extend(args)
+    return subprocess.Popen(cmd, stdout=subprocess.PIPE)
+
+
+def read_output(process):
+    output = process.communicate()[0]
+    if process.returncode:
+        raise RuntimeError("Load test process failed ({})".format(
+            process.returncode))
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def aggregate(reports, elapsed):
+    summary = {}
+    for report in reports:
+        for name, stats in report.items():
+            total = summary.setdefault(name, dict(
+                imports=0, files=0, results=0, errors=0, conflicts=0,
+                latencies=[]))
+            for key in ("imports", "files", "results", "errors",
+                        "conflicts"):
+                total[key] += stats[key]
+            total["latencies"].extend(stats["latencies"])
+    for name, total in summary.items():
+        latencies = total.pop("latencies")
+        total["throughput"] = dict(
+            imports=round(total["imports"] / elapsed, 3),
+            results=round(total["results"] / elapsed, 3))
+        total["latency"] = dict(
+            (key, round(percentile(latencies, percent), 3))
+            for key, percent in (("p50", 50), ("p90", 90), ("p99", 99),
+                                 ("max", 100)))
+    return summary
+
+
+def run(app, options):
+    from App.config import getConfiguration
+
+    zope_conf = options.zope_conf or os.path.join(
+        getConfiguration().instancehome, "etc", "zope.conf")
+    datafs = options.datafs or app._p_jar.db().storage.getName()
+    if not os.path.isfile(datafs):
+        raise RuntimeError("No Data.fs at {}, use --datafs".format(datafs))
+    app._p_jar.close()
+
+    tmpdir = tempfile.mkdtemp(prefix="senaite-loadtest-")
+    zeo = None
+    try:
+        copy = os.path.join(tmpdir, "Data.fs")
+        shutil.copyfile(datafs, copy)
+        port = free_port()
+        zeo = start_zeo(copy, port)
+        wait_for_port(port)
+        conf = write_client_conf(
+            zope_conf, "127.0.0.1:{}".format(port), tmpdir)
+
+        setup = run_command(options, conf, "setup",
+                            "--samples", str(options.samples))
+        sample_ids = read_output(setup)["samples"]
+        ids_file = os.path.join(tmpdir, "samples.json")
+        with open(ids_file, "w") as f:
+            json.dump(sample_ids, f)
+
+        start = time.time()
+        clients = [
+            run_command(options, conf, "client",
+                        "--index", str(index),
+                        "--sample-ids", ids_file,
+                        "--batch", str(options.batch),
+                        "--rounds", str(options.rounds),
+                        "--chunk-size", str(options.chunk_size),
+                        "--interfaces", options.interfaces)
+            for index in range(options.clients)]
+        reports = [read_output(client) for client in clients]
+        elapsed = time.time() - start
+    finally:
+        if zeo is not None:
+            zeo.terminate()
+            zeo.wait()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    print(json.dumps(dict(
+        clients=options.clients,
+        samples=options.samples,
+        batch=options.batch,
+        rounds=options.rounds,
+        chunk_size=options.chunk_size,
+        elapsed=round(elapsed, 3),
+        interfaces=aggregate(reports, elapsed)), indent=2, sort_keys=True))
+
+
+# Client processes
+
+def get_portal(app, options):
+    from AccessControl.SecurityManagement import newSecurityManager
+    from Testing.makerequest import makerequest
+    from zope.component.hooks import setSite
+
+    app = makerequest(app)
+    user = app.acl_users.getUser(options.user)
+    newSecurityManager(None, user.__of__(app.acl_users))
+    portal = app[options.site]
+    setSite(portal)
+    return portal
+
+
+def create_service(portal, keyword, category, interims=None):
+    from bika.lims import api
+
+    setup = portal.bika_setup
+    service = api.create(setup.bika_analysisservices, "AnalysisService",
+                         title=keyword, Keyword=keyword, Category=category)
+    if interims:
+        calculation = api.create(setup.bika_calculations, "Calculation",
+                                 title="{} calculation".format(keyword))
+        fields = [dict(keyword=name, title=name, hidden=False)
+                  for name in interims]
+        calculation.setInterimFields(fields)
+        calculation.setFormula("[FinalConc]")
+        service.setUseDefaultCalculation(False)
+        service.setCalculation(calculation)
+        service.setInterimFields(fields)
+    return service
+
+
+def setup(app, options):
+    """Creates the synthetic samples, received and with all the services
+    of the interfaces
+    """
+    import transaction
+    from bika.lims import api
+    from bika.lims.utils.analysisrequest import create_analysisrequest
+    from DateTime import DateTime
+
+    portal = get_portal(app, options)
+    setup = portal.bika_setup
+    client = api.create(portal.clients, "Client", Name="Load test",
+                        ClientID="LOAD")
+    contact = api.create(client, "Contact", Firstname="Load",
+                         Surname="Test")
+    sampletype = api.create(setup.bika_sampletypes, "SampleType",
+                            title="Load test", Prefix="LOAD",
+                            MinimumVolume="100 ml")
+    category = api.create(setup.bika_analysiscategories,
+                          "AnalysisCategory", title="Load test")
+    services = [create_service(portal, keyword, category)
+                for keyword in SERVICES + OXIDES]
+    services.append(
+        create_service(portal, QUANT_KEYWORD, category, QUANT_INTERIMS))
+    transaction.commit()
+
+    service_uids = [api.get_uid(service) for service in services]
+    now = DateTime().strftime("%Y-%m-%d")
+    values = dict(Client=api.get_uid(client), Contact=api.get_uid(contact),
+                  SamplingDate=now, DateSampled=now,
+                  SampleType=api.get_uid(sampletype))
+    sample_ids = []
+    for number in range(options.samples):
+        sample = create_analysisrequest(
+            client, portal.REQUEST, values, service_uids)
+        api.do_transition_for(sample, "receive")
+        sample_ids.append(api.get_id(sample))
+        if number % 20 == 19:
+            transaction.commit()
+    transaction.commit()
+    print(json.dumps(dict(samples=sample_ids)))
+
+
+class UploadStub(object):
+
+    def __init__(self, filename, data):
+        self.file = StringIO(data)
+        self.headers = {}
+        self.filename = filename
+
+
+def import_file(portal, interface, filename, data, chunk_size):
+    """Imports one file, returns the import results and the conflict
+    errors retried
+    """
+    import transaction
+    from ZODB.POSException import ConflictError
+    from zope.publisher.browser import FileUpload
+    from zope.publisher.browser import TestRequest
+
+    conflicts = 0
+    for attempt in range(COMMIT_RETRIES + 1):
+        request = TestRequest(form=dict(
+            submitted=True,
+            artoapply="received_tobeverified",
+            results_override="override",
+            instrument_results_file=FileUpload(UploadStub(filename, data)),
+            instrument_results_file_format="csv",
+            final_result_unit="pct",
+            chunk_size=str(chunk_size or ""),
+            instrument=""))
+        results = json.loads(interface.Import(portal, request))
+        try:
+            transaction.commit()
+        except ConflictError:
+            transaction.abort()
+            conflicts += 1
+            continue
+        return results, conflicts + results.get("conflicts", 0)
+    results["errors"].append("Not imported after {} conflict errors".format(
+        conflicts))
+    return results, conflicts
+
+
+def client(app, options):
+    """Imports the synthetic files of every interface `rounds` times. The
+    samples of each file are picked at random, so the clients write the
+    same samples now and then
+    """
+    from zope.dottedname.resolve import resolve
+
+    portal = get_portal(app, options)
+    with open(options.sample_ids) as f:
+        sample_ids = json.load(f)
+    rnd = random.Random(options.index)
+    names = [name.strip() for name in options.interfaces.split(",")]
+    report = dict((name, dict(imports=0, files=0, results=0, errors=0,
+                              conflicts=0, latencies=[]))
+                  for name in names)
+    for attempt in range(options.rounds):
+        for name in names:
+            interface = resolve(INTERFACES[name])
+            batch = rnd.sample(sample_ids, min(options.batch,
+                                               len(sample_ids)))
+            stats = report[name]
+            start = time.time()
+            for filename, data in FILES[name](batch, rnd):
+                results, conflicts = import_file(
+                    portal, interface, filename, data, options.chunk_size)
+                stats["files"] += 1
+                stats["conflicts"] += conflicts
+                stats["errors"] += len(results["errors"])
+                for line in results["log"]:
+                    match = UPDATED_RE.search(line)
+                    if match:
+                        stats["results"] += int(match.group(1))
+            stats["imports"] += 1
+            stats["latencies"].append(time.time() - start)
+            app._p_jar.sync()
+    print(json.dumps(report))
+
+
+COMMANDS = {
+    "run": run,
+    "setup": setup,
+    "client": client,
+}
+
+
+def main(app, args):
+    options, args = get_options(args)
+    if not args or args[0] not in COMMANDS:
+        sys.exit("Usage: loadtest.py run|setup|client [options]")
+    COMMANDS[args[0]](app, options)
+
+
+if __name__ == "__main__":
+    # "bin/instance run" sets the Zope application as `app`
+    main(globals()["app"], sys.argv[1:])
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+from os.path import abspath
+from os.path import dirname
+from os.path import join
+
+import unittest2 as unittest
+from senaite.instruments.columns import Column
+from senaite.instruments.columns import ProjectionPlan
+from senaite.instruments.columns import split_line
+
+path = join(abspath(dirname(__file__)), 'files', 'instruments')
+FN = join(path, 'agilent.masshunter.qualitative.csv')
+
+COLUMNS = (
+    Column('ar_id', 'Sample Name', 104, interim=False),
+    Column('mz', 'm/z', 67),
+    Column('AcqMethod', 'Acq Method', 110),
+    Column('Missing', 'Not in this file'),
+)
+
+
+class TestColumns(unittest.TestCase):
+
+    def setUp(self):
+        lines = open(FN, 'r').read().splitlines()
+        self.header = split_line(lines[2])
+        self.row = split_line(lines[3])
+
+    def test_split_line_keeps_quoted_tokens(self):
+        self.assertEqual(self.header[1], 'Diff (Bio, mDa)')
+        self.assertEqual(len(self.header), len(self.row))
+
+    def test_plan_resolves_labels(self):
+        plan = ProjectionPlan(COLUMNS, self.header)
+        projected = plan.project(self.row)
+        self.assertEqual(projected['ar_id'], 'H2O-0001')
+        self.assertEqual(projected['mz'], '583.3')
+        self.assertEqual(projected['AcqMethod'], 'AAS_SCR_MRM 2015.M')
+        self.assertEqual(projected['Missing'], '')
+        self.assertEqual(plan.missing, ['Missing'])
+
+    def test_plan_survives_column_reordering(self):
+        order = range(len(self.header))
+        order.reverse()
+        header = [self.header[i] for i in order]
+        row = [self.row[i] for i in order]
+        plan = ProjectionPlan(COLUMNS, header)
+        self.assertEqual(plan.project(row)['mz'], '583.3')
+
+    def test_plan_without_header_uses_positions(self):
+        plan = ProjectionPlan(COLUMNS)
+        projected = plan.project(self.row)
+        self.assertEqual(projected['ar_id'], 'H2O-0001')
+        self.assertEqual(projected['AcqMethod'], 'default.m')
+
+    def test_interims_are_coerced(self):
+        plan = ProjectionPlan(COLUMNS, self.header)
+        interims = plan.interims(plan.project(self.row),
+                                 lambda name, value: value.upper())
+        self.assertEqual(sorted(interims.keys()),
+                         ['AcqMethod', 'Missing', 'mz'])
+        self.assertEqual(interims['AcqMethod'], 'AAS_SCR_MRM 2015.M')
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestColumns))
+    return suite
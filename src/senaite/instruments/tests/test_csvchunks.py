@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+from os.path import abspath
+from os.path import dirname
+from os.path import join
+
+import unittest2 as unittest
+from senaite.instruments.columns import Column
+from senaite.instruments.columns import ProjectionPlan
+from senaite.instruments.columns import split_line
+from senaite.instruments.csvchunks import CELL
+from senaite.instruments.csvchunks import PREFIX
+from senaite.instruments.csvchunks import coerce_result
+from senaite.instruments.csvchunks import get_names
+from senaite.instruments.csvchunks import is_header
+from senaite.instruments.csvchunks import parse_chunk
+from senaite.instruments.csvchunks import split_ranges
+
+path = join(abspath(dirname(__file__)), 'files', 'instruments')
+FN = join(path, 'agilent.masshunter.quantitative.csv')
+
+COLUMNS = (
+    Column('ar_id', 'Name', 2, interim=False),
+    Column('ReturnTime', 'RT', 8),
+    Column('Resp', 'Resp.', 9),
+)
+RULE = (CELL, 'Name')
+
+
+def make_plan(header):
+    return ProjectionPlan(COLUMNS, header)
+
+
+def parse(data, header, start=0, end=None):
+    task = dict(delimiter=',', header=header, header_rule=RULE)
+    end = len(data) if end is None else end
+    return list(parse_chunk(data[start:end], task, make_plan, split_line))
+
+
+def parse_chunks(data, header, count):
+    """Parses the data in chunks, with the line numbers of the whole data
+    """
+    rows = []
+    base = 0
+    for start, end in split_ranges(data, 0, len(data), count):
+        for row in parse(data, header, start, end):
+            if row[0] == 'end':
+                base += row[1]
+            else:
+                rows.append((row[0], base + row[1]) + row[2:])
+    return rows
+
+
+class TestCSVChunks(unittest.TestCase):
+
+    def setUp(self):
+        lines = open(FN, 'r').read().splitlines()
+        self.header = split_line(lines[1])
+        row = lines[2]
+        rows = [row.replace('H2O-0001', 'H2O-{:04d}'.format(number))
+                for number in range(1, 201)]
+        # a blank line and a row with no number
+        rows[10] = ''
+        rows[20] = row.replace('26.563', 'n/a')
+        self.data = '\r\n'.join(rows) + '\r\n'
+
+    def test_split_ranges_on_line_boundaries(self):
+        ranges = split_ranges(self.data, 0, len(self.data), 4)
+        self.assertEqual(len(ranges), 4)
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], len(self.data))
+        for (start, end), (next_start, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(end, next_start)
+            self.assertEqual(self.data[end - 1], '\n')
+
+    def test_split_ranges_of_small_data(self):
+        self.assertEqual(split_ranges('a\nb\n', 0, 4, 8),
+                         [(0, 2), (2, 4)])
+        self.assertEqual(split_ranges('a\nb\n', 4, 4, 8), [])
+
+    def test_chunks_parse_as_a_whole(self):
+        whole = [row for row in parse(self.data, self.header)
+                 if row[0] != 'end']
+        self.assertEqual(len(whole), 199)
+        for count in (1, 3, 7, 64):
+            self.assertEqual(parse_chunks(self.data, self.header, count),
+                             whole)
+
+    def test_rows_are_projected_and_coerced(self):
+        rows = parse(self.data, self.header)
+        kind, numline, values, interims, invalid = rows[0]
+        self.assertEqual((kind, numline), ('row', 1))
+        self.assertEqual(values, ('H2O-0001', ))
+        self.assertEqual(interims, (26.563, 1091082.0))
+        self.assertEqual(invalid, ())
+        # the blank line is counted but not returned
+        self.assertEqual(rows[10][1], 12)
+        kind, numline, values, interims, invalid = rows[19]
+        self.assertEqual(numline, 21)
+        self.assertEqual(interims, (None, 1091082.0))
+        self.assertEqual(invalid, (('ReturnTime', 'n/a'), ))
+        self.assertEqual(rows[-1], ('end', 200, None))
+
+    def test_header_row_changes_the_plan(self):
+        data = self.data + 'Resp.,RT,Name\r\n1,2,H2O-0300\r\n'
+        rows = parse(data, self.header)
+        self.assertEqual(rows[-3][0], 'header')
+        self.assertEqual(rows[-2][2], ('H2O-0300', ))
+        self.assertEqual(rows[-2][3], (2.0, 1.0))
+
+    def test_get_names(self):
+        self.assertEqual(get_names(COLUMNS),
+                         (('ar_id', ), ('ReturnTime', 'Resp')))
+
+    def test_is_header(self):
+        self.assertTrue(is_header(self.header, RULE))
+        self.assertTrue(is_header(['Score (Bio)', 'x'], (PREFIX, 'Score')))
+        self.assertFalse(is_header(['x', 'Score'], (PREFIX, 'Score')))
+        self.assertFalse(is_header([], (PREFIX, 'Score')))
+
+    def test_coerce_result(self):
+        self.assertEqual(coerce_result('1.5'), 1.5)
+        self.assertEqual(coerce_result('-1.5'), 0.0)
+        self.assertEqual(coerce_result('ND'), 0.0)
+        self.assertEqual(coerce_result(''), 0.0)
+        self.assertEqual(coerce_result('--'), 0.0)
+        self.assertEqual(coerce_result('n/a'), None)
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestCSVChunks))
+    return suite
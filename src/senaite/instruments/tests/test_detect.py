@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+from os.path import abspath
+from os.path import dirname
+from os.path import join
+from StringIO import StringIO
+
+import unittest2 as unittest
+from senaite.instruments.detect import detect
+from senaite.instruments.instruments.agilent.masshunter.qualitative import \
+    qualitativeimport
+from senaite.instruments.instruments.auto.auto import AutoImportRun
+from senaite.instruments.instruments.auto.auto import autoimport
+
+path = join(abspath(dirname(__file__)), 'files', 'instruments')
+
+FILES = (
+    ('agilent.chemstation.chemstation.xls', 'chemstation_importer', 'xls'),
+    ('agilent.masshunter.aorc.xls', 'masshunter_aorc_importer', 'xls'),
+    ('agilent.masshunter.qualitative.csv',
+     'masshunter_qualitative_importer', 'csv'),
+    ('agilent.masshunter.quantitative.csv',
+     'masshunter_quantitative_importer', 'csv'),
+    ('brukers8tiger/DU-0001.csv', 's8tiger_importer', 'csv'),
+    ('brukers8tiger/DU-0001-234987347.xlsx', 's8tiger_importer', 'xlsx'),
+    ('perkinelmer/winlab32.csv', 'pe900h8300_importer', 'csv'),
+)
+
+
+class TestDetect(unittest.TestCase):
+
+    def test_files(self):
+        for fn, name, file_format in FILES:
+            with open(join(path, fn), 'rb') as infile:
+                factory, detected_format = detect(infile)
+                self.assertEqual(infile.tell(), 0)
+            self.assertIsNotNone(factory, fn)
+            self.assertEqual(factory.name, name, fn)
+            self.assertEqual(detected_format, file_format, fn)
+
+    def test_unknown(self):
+        factory, file_format = detect(StringIO('a,b,c\n1,2,3\n'))
+        self.assertIsNone(factory)
+        self.assertEqual(file_format, 'csv')
+
+
+class Request(object):
+
+    def __init__(self, **form):
+        self.form = form
+
+
+def upload(fn, filename):
+    infile = StringIO(open(join(path, fn), 'rb').read())
+    infile.filename = filename
+    return infile
+
+
+class TestAutoImportRun(unittest.TestCase):
+
+    def make_run(self, infile):
+        return AutoImportRun(autoimport, None,
+                             Request(instrument_results_file=infile))
+
+    def test_detected_interface_is_validated(self):
+        run = self.make_run(upload('agilent.masshunter.qualitative.csv',
+                                   'results.csv'))
+        self.assertTrue(run.validate())
+        self.assertIs(run.interface, qualitativeimport)
+        self.assertEqual(run.form['instrument_results_file_format'], 'csv')
+        # the formats of the detected interface are checked
+        run = self.make_run(upload('agilent.masshunter.qualitative.csv',
+                                   'results.txt'))
+        self.assertFalse(run.validate())
+        self.assertIs(run.interface, qualitativeimport)
+        self.assertEqual(len(run.errors), 1)
+
+    def test_unknown(self):
+        infile = StringIO('a,b,c\n1,2,3\n')
+        infile.filename = 'results.csv'
+        run = self.make_run(infile)
+        self.assertFalse(run.validate())
+        self.assertIs(run.interface, autoimport)
+        self.assertEqual(len(run.errors), 1)
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestDetect))
+    suite.addTest(unittest.makeSuite(TestAutoImportRun))
+    return suite
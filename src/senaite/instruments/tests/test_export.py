@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+import zipfile
+
+import unittest2 as unittest
+from senaite.instruments import lookup
+from senaite.instruments.browser import export
+from senaite.instruments.browser.export import BulkExportView
+from senaite.instruments.lookup import ExportLookup
+
+
+class Content(object):
+
+    def __init__(self, uid, id=None, **attributes):
+        self.uid = uid
+        self.id = id or uid
+        self.__dict__.update(attributes)
+
+    def UID(self):
+        return self.uid
+
+
+class Worksheet(Content):
+
+    def getLayout(self):
+        return [{"analysis_uid": "{}-an".format(self.uid)}]
+
+
+class Brain(object):
+
+    def __init__(self, uid, **metadata):
+        self.UID = uid
+        self.__dict__.update(metadata)
+
+
+class API(object):
+    """The bika.lims.api functions the export uses, over the given objects
+    """
+
+    def __init__(self, objects=(), brains=()):
+        self.objects = dict((obj.uid, obj) for obj in objects)
+        self.brains = list(brains)
+
+    def search(self, query, catalog=None):
+        if query.get("portal_type") == "Worksheet":
+            values = query.get("UID") or query.get("getId")
+            key = "uid" if "UID" in query else "id"
+            # the catalogs return the worksheets in their own order
+            return [obj for obj in sorted(self.objects.values(),
+                                          key=lambda obj: obj.id)
+                    if getattr(obj, key) in values]
+        return [brain for brain in self.brains if brain.UID in query["UID"]]
+
+    def get_uid(self, obj):
+        return obj.UID if isinstance(obj, Brain) else obj.uid
+
+    def get_id(self, obj):
+        return obj.id
+
+    def get_object(self, obj):
+        if isinstance(obj, Brain):
+            return self.objects[obj.UID]
+        return obj
+
+    def get_object_by_uid(self, uid, default=None):
+        return self.objects.get(uid, default)
+
+
+class Response(object):
+
+    def setHeader(self, name, value):
+        pass
+
+
+class Request(object):
+
+    def __init__(self, **form):
+        self.form = form
+        self.RESPONSE = Response()
+
+
+class Exporter(object):
+
+    def render(self, worksheet, lookup=None):
+        if worksheet.id == "WS-FAIL":
+            raise ValueError("Oops")
+        return [("{}.csv".format(worksheet.id), "data")]
+
+
+class View(BulkExportView):
+
+    def get_exporter(self, worksheet):
+        return None if worksheet.id == "WS-NONE" else Exporter()
+
+
+class PatchedAPI(unittest.TestCase):
+
+    def patch_api(self, api):
+        originals = export.api, lookup.api
+        export.api = lookup.api = api
+
+        def restore():
+            export.api, lookup.api = originals
+        self.addCleanup(restore)
+
+
+class TestBulkExport(PatchedAPI):
+
+    def setUp(self):
+        self.worksheets = [Worksheet("uid-1", "WS-1"),
+                           Worksheet("uid-2", "WS-2"),
+                           Worksheet("uid-3", "WS-FAIL"),
+                           Worksheet("uid-4", "WS-NONE")]
+        self.patch_api(API(self.worksheets))
+
+    def get_worksheets(self, value):
+        view = View(None, Request(worksheets=value))
+        return [worksheet.id for worksheet in view.get_worksheets()]
+
+    def test_worksheets_in_the_order_given(self):
+        self.assertEqual(self.get_worksheets("WS-2,uid-1"), ["WS-2", "WS-1"])
+        self.assertEqual(self.get_worksheets(["uid-2", " WS-1 ", ""]),
+                         ["WS-2", "WS-1"])
+        self.assertEqual(self.get_worksheets(""), [])
+
+    def test_worksheets_are_not_repeated(self):
+        # given by ID and by UID, or twice
+        self.assertEqual(self.get_worksheets("WS-1,uid-2,uid-1,WS-2,WS-1"),
+                         ["WS-1", "WS-2"])
+
+    def read(self, worksheets):
+        view = View(None, Request())
+        archive, errors = view.export(worksheets)
+        archive.seek(0)
+        zf = zipfile.ZipFile(archive)
+        return errors, dict((name, zf.read(name)) for name in zf.namelist())
+
+    def test_export(self):
+        errors, files = self.read(self.worksheets[:2])
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(files), ["WS-1.csv", "WS-2.csv"])
+
+    def test_errors(self):
+        errors, files = self.read(self.worksheets)
+        self.assertEqual(sorted(files),
+                         ["WS-1.csv", "WS-2.csv", "errors.txt"])
+        self.assertEqual(files["errors.txt"],
+                         "WS-FAIL: the export failed\n"
+                         "WS-NONE: no sequence exporter\n")
+        self.assertEqual(len(errors), 2)
+
+    def test_no_worksheets(self):
+        errors, files = self.read([])
+        self.assertEqual(files, {"errors.txt": "No worksheets selected\n"})
+
+
+class TestExportLookup(PatchedAPI):
+
+    def setUp(self):
+        parent = Content("sample-uid")
+        self.patch_api(API(
+            objects=[Content("an-1", aq_parent=parent,
+                             getMethodUID=lambda: "method-1"),
+                     Content("an-2", aq_parent=parent,
+                             getMethodUID=lambda: "method-1")],
+            brains=[Brain("an-1", getParentUID="parent-1",
+                          getMethodUID="method-2"),
+                    Brain("an-2")]))
+
+    def test_get_parent_uid(self):
+        export_lookup = ExportLookup()
+        export_lookup.prefetch(["an-1", "an-2"])
+        self.assertEqual(export_lookup.get_parent_uid("an-1"), "parent-1")
+        # not in the catalog metadata
+        self.assertEqual(export_lookup.get_parent_uid("an-2"), "sample-uid")
+
+    def test_get_parent_uid_not_prefetched(self):
+        self.assertEqual(ExportLookup().get_parent_uid("an-1"), "sample-uid")
+
+    def test_get_methods(self):
+        self.assertEqual(ExportLookup().get_methods(["an-1", "an-2", None]),
+                         {"an-1": "method-2", "an-2": "method-1"})
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestBulkExport))
+    suite.addTest(unittest.makeSuite(TestExportLookup))
+    return suite
@@ -0,0 +1,447 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+import csv
+from os.path import abspath
+from os.path import dirname
+from os.path import join
+from StringIO import StringIO
+
+import unittest2 as unittest
+from senaite.core.exportimport.instruments.resultsimport import \
+    InstrumentResultsFileParser
+from senaite.instruments import importer as importer_module
+from senaite.instruments.importer import CHUNK_RETRIES
+from senaite.instruments.importer import ImportInterface
+from senaite.instruments.importer import ImportRun
+from senaite.instruments.instruments.perkinelmer.winlab32 import winlab32
+from senaite.instruments.normalize import normalize_keyword
+from senaite.instruments.normalize import normalize_sample_id
+from senaite.instruments.rawresults import Schema
+from ZODB.POSException import ConflictError
+
+path = join(abspath(dirname(__file__)), 'files', 'instruments')
+WINLAB32 = join(path, 'perkinelmer', 'winlab32.csv')
+S8TIGER = join(path, 'brukers8tiger', 'DU-0001-234987347.xlsx')
+
+
+class Request(object):
+
+    def __init__(self, **form):
+        self.form = form
+
+
+class Upload(object):
+
+    def __init__(self, filename):
+        self.filename = filename
+
+
+class Worksheet(object):
+
+    def UID(self):
+        return "ws-uid"
+
+    def getId(self):
+        return "WS-001"
+
+
+class Analysis(object):
+
+    def __init__(self, worksheet_uid):
+        self.worksheet_uid = worksheet_uid
+
+    def getWorksheetUID(self):
+        return self.worksheet_uid
+
+
+class importer(ImportInterface):
+    title = "Test import"
+    chunk_size = 50
+
+
+class incrementalimport(ImportInterface):
+    title = "Test incremental import"
+    incremental = True
+
+
+class TestImportRun(unittest.TestCase):
+
+    def make_run(self, **form):
+        return ImportRun(importer, None, Request(**form))
+
+    def test_chunk_size(self):
+        self.assertEqual(self.make_run().chunk_size, 50)
+        self.assertEqual(self.make_run(chunk_size="10").chunk_size, 10)
+        self.assertEqual(self.make_run(chunk_size=10).chunk_size, 10)
+        self.assertEqual(self.make_run(chunk_size="0").chunk_size, 50)
+        self.assertEqual(self.make_run(chunk_size="").chunk_size, 50)
+
+    def test_invalid_chunk_size(self):
+        for value in ("-10", -1, "ten"):
+            run = self.make_run(chunk_size=value)
+            self.assertEqual(run.chunk_size, 50)
+            self.assertEqual(run.warns, [
+                "Invalid chunk size {}, the default is used".format(value)])
+
+    def test_file_posted_more_than_once(self):
+        upload = Upload('results.csv')
+        run = self.make_run(instrument_results_file=['', upload, Upload(
+            'other.csv')])
+        self.assertIs(run.infile, upload)
+        run = self.make_run(instrument_results_file=['', ''])
+        self.assertIsNone(run.infile)
+        self.assertFalse(run.validate())
+
+    def test_incremental_import_without_instrument(self):
+        upload = Upload('results.csv')
+        run = ImportRun(incrementalimport, None, Request(
+            instrument_results_file=upload, incremental='1'))
+        self.assertFalse(run.validate())
+        self.assertEqual(len(run.errors), 1)
+        run = ImportRun(incrementalimport, None, Request(
+            instrument_results_file=upload, incremental='1',
+            instrument='instrument-uid'))
+        self.assertTrue(run.validate())
+        # the interface does not import incrementally
+        run = self.make_run(instrument_results_file=upload, incremental='1')
+        self.assertTrue(run.validate())
+
+    def test_interface_without_parser(self):
+        run = self.make_run()
+        self.assertIsNone(importer.get_parser(run))
+        self.assertEqual(len(run.errors), 1)
+
+    def test_search_analyses_of_an_import(self):
+        run = self.make_run()
+        analyses = [Analysis(None), Analysis("other-uid")]
+        self.assertEqual(run.search_analyses(lambda objid: analyses,
+                                             "W-0001"), analyses)
+        self.assertEqual(run.warns, [])
+
+    def test_search_analyses_of_a_worksheet_import(self):
+        run = self.make_run()
+        run.worksheet = Worksheet()
+        reference = Analysis("ws-uid")
+        analyses = {"QC-0001": [reference, Analysis("other-uid")],
+                    "W-0099": [Analysis("other-uid"), Analysis(None)]}
+        self.assertEqual(run.search_analyses(analyses.get, "QC-0001"),
+                         [reference])
+        self.assertEqual(run.warns, [])
+        # a sample outside the worksheet
+        self.assertEqual(run.search_analyses(analyses.get, "W-0099"), [])
+        self.assertEqual(len(run.warns), 1)
+        self.assertTrue(run.warns[0].startswith(
+            "W-0099 is not in worksheet WS-001"))
+
+
+class TestDecode(unittest.TestCase):
+
+    def decode(self, fn, filename):
+        upload = StringIO(open(fn, 'rb').read())
+        upload.filename = filename
+        run = ImportRun(importer, None, Request(instrument_results_file=upload))
+        return run, run.decode()
+
+    def test_csv(self):
+        run, lines = self.decode(WINLAB32, 'winlab32.csv')
+        self.assertEqual(lines, open(WINLAB32, 'rb').readlines())
+
+    def test_xlsx(self):
+        run, lines = self.decode(S8TIGER, 'results.xlsx')
+        self.assertTrue(lines[0].startswith('Formula,'))
+        self.assertEqual(dict(run.timings).keys(), ['decode'])
+        # the other format is tried if the extension is wrong
+        self.assertEqual(self.decode(S8TIGER, 'results.xls')[1], lines)
+
+    def test_not_a_spreadsheet(self):
+        run, lines = self.decode(WINLAB32, 'winlab32.xlsx')
+        self.assertIsNone(lines)
+        self.assertEqual(run.errors,
+                         ["Can't parse input file as XLS, XLSX, or CSV."])
+
+
+class Brain(object):
+
+    def __init__(self, keyword, review_state="unassigned"):
+        self.getKeyword = keyword
+        self.review_state = review_state
+
+
+class Lookup(object):
+    """Session lookup knowing the given sample IDs, each with one analysis
+    of the given keyword
+    """
+
+    def __init__(self, sample_ids, keyword):
+        self.sample_ids = sample_ids
+        self.keyword = keyword
+
+    def prefetch(self, sample_ids):
+        pass
+
+    def has_sample(self, sample_id):
+        return sample_id in self.sample_ids
+
+    def get_sample(self, sample_id):
+        return sample_id if sample_id in self.sample_ids else None
+
+    def get_analyses(self, sample):
+        if sample is None:
+            return {}
+        return {self.keyword: [Brain(self.keyword)]}
+
+
+class ResultsImporter(object):
+    """Results importer that writes nothing
+    """
+
+    def __init__(self, parser, **kwargs):
+        self.parser = parser
+        self.errors = []
+        self.logs = []
+        self.warns = []
+
+    def _getZODBAnalyses(self, objid):
+        return []
+
+    def getAllowedARStates(self):
+        return ["sample_received"]
+
+    def getAllowedAnalysisStates(self):
+        return ["unassigned", "assigned"]
+
+    def warn(self, msg, mapping=None):
+        for key, value in (mapping or {}).items():
+            msg = msg.replace("${%s}" % key, value)
+        self.warns.append(msg)
+
+    def process(self):
+        pass
+
+
+class winlab32import(winlab32.importer):
+    importer_class = ResultsImporter
+
+
+class TestImportStats(unittest.TestCase):
+
+    def test_winlab32_rows(self):
+        rows = list(csv.DictReader(open(WINLAB32, 'rb')))
+        keyword = normalize_keyword('Au 242.80')
+        # the ZK5 samples are found, their gold results imported
+        sample_ids = set(normalize_sample_id(row['Sample ID'])
+                         for row in rows
+                         if row['Sample ID'].startswith('ZK5'))
+        imported = [row for row in rows
+                    if normalize_sample_id(row['Sample ID']) in sample_ids
+                    and normalize_keyword(row['Analyte Name']) == keyword]
+        upload = StringIO(open(WINLAB32, 'rb').read())
+        upload.filename = 'winlab32.csv'
+        run = ImportRun(winlab32import, None,
+                        Request(instrument_results_file=upload))
+        run.session.lookup = Lookup(sample_ids, keyword)
+        run.process()
+        stats = run.get_stats()
+        self.assertEqual(stats['status'], 'ok', run.errors)
+        self.assertEqual(stats['rows'], len(rows))
+        self.assertEqual(stats['rejected_rows'], len(rows) - len(imported))
+        self.assertEqual(stats['results_written'], len(imported))
+        self.assertTrue(0 < len(imported) < len(rows))
+
+
+class Savepoint(object):
+
+    def __init__(self, transaction):
+        self.transaction = transaction
+
+    def rollback(self):
+        self.transaction.events.append("rollback")
+
+
+class Transaction(object):
+    """The transaction module, recording what the chunks do
+    """
+
+    def __init__(self):
+        self.events = []
+
+    def savepoint(self, optimistic=False):
+        return Savepoint(self)
+
+    def commit(self):
+        self.events.append("commit")
+
+    def abort(self):
+        self.events.append("abort")
+
+
+class Portal(object):
+
+    class _p_jar(object):
+
+        @staticmethod
+        def cacheGC():
+            pass
+
+
+class API(object):
+
+    def get_portal(self):
+        return Portal()
+
+
+class ChunkImporter(ResultsImporter):
+    """Results importer that consumes the values of the results, failing
+    with the errors given per sample for its successive attempts
+    """
+    # sample ID -> exceptions raised by the attempts
+    failures = {}
+    imported = []
+
+    def process(self):
+        for resid, resultslist in self.parser.getRawResults().items():
+            for results in resultslist:
+                for keyword, values in results.items():
+                    self.imported.append((resid, values.pop('reading')))
+            failures = self.failures.get(resid)
+            if failures:
+                raise failures.pop(0)
+
+
+class chunkimport(ImportInterface):
+    title = "Test chunked import"
+    chunk_size = 1
+    importer_class = ChunkImporter
+
+
+class TestProcessChunks(unittest.TestCase):
+
+    def setUp(self):
+        originals = importer_module.api, importer_module.transaction
+        self.transaction = Transaction()
+        importer_module.api = API()
+        importer_module.transaction = self.transaction
+
+        def restore():
+            importer_module.api, importer_module.transaction = originals
+        self.addCleanup(restore)
+        ChunkImporter.imported = []
+        self.run = ImportRun(chunkimport, None, Request())
+        self.parser = InstrumentResultsFileParser(None, 'CSV')
+        schema = Schema(('reading', ))
+        for number in (1, 2, 3):
+            self.parser._addRawResult("W-{}".format(number), {
+                "Cu": schema.record(reading=number)})
+
+    def process(self, **failures):
+        ChunkImporter.failures = failures
+        self.run.process_chunks(self.parser)
+        return [chunk['status'] for chunk in self.run.chunks]
+
+    def test_retried_after_a_conflict(self):
+        statuses = self.process(**{"W-2": [ConflictError()]})
+        self.assertEqual(statuses, ["committed"] * 3)
+        self.assertEqual(self.run.conflicts, 1)
+        self.assertEqual(self.run.written, 3)
+        # the retry imports the values the conflict consumed
+        self.assertEqual(ChunkImporter.imported, [
+            ("W-1", 1), ("W-2", 2), ("W-2", 2), ("W-3", 3)])
+        self.assertEqual(self.transaction.events,
+                         ["commit", "abort", "commit", "commit"])
+        # the committed results are released
+        self.assertEqual(self.parser.getRawResults(), {})
+
+    def test_failed_chunk(self):
+        statuses = self.process(**{"W-2": [ValueError("Oops")]})
+        self.assertEqual(statuses, ["committed", "failed", "committed"])
+        self.assertEqual(self.transaction.events,
+                         ["commit", "rollback", "commit"])
+        self.assertEqual(self.run.written, 2)
+        self.assertEqual(len(self.run.errors), 1)
+        self.assertIn("ValueError: Oops", self.run.errors[0])
+        self.assertEqual(self.parser.getRawResults().keys(), ["W-2"])
+
+    def test_conflict_retries_exhausted(self):
+        conflicts = [ConflictError() for i in range(CHUNK_RETRIES + 1)]
+        statuses = self.process(**{"W-2": conflicts})
+        self.assertEqual(statuses, ["committed", "conflict", "committed"])
+        self.assertEqual(self.run.conflicts, CHUNK_RETRIES + 1)
+        self.assertEqual(self.run.written, 2)
+        self.assertEqual(self.run.errors, [
+            "Chunk not imported after {} conflict errors".format(
+                CHUNK_RETRIES + 1)])
+        self.assertEqual([value for resid, value in ChunkImporter.imported
+                          if resid == "W-2"], [2] * (CHUNK_RETRIES + 1))
+
+
+class Sample(object):
+
+    def __init__(self, review_state):
+        self.review_state = review_state
+
+
+class ScopeAPI(object):
+
+    def get_review_status(self, sample):
+        return sample.review_state
+
+    def get_object(self, brain):
+        return brain
+
+
+class TestScopeImporter(unittest.TestCase):
+
+    def setUp(self):
+        original = importer_module.api
+        importer_module.api = ScopeAPI()
+
+        def restore():
+            importer_module.api = original
+        self.addCleanup(restore)
+        run = ImportRun(importer, None, Request())
+        run.session.lookup = self
+        self.samples = {}
+        self.importer = ResultsImporter(None)
+        run.scope_importer(self.importer)
+
+    def has_sample(self, sample_id):
+        return sample_id in self.samples
+
+    def get_sample(self, sample_id):
+        return self.samples[sample_id]
+
+    def get_analyses(self, sample):
+        return {"Cu": [Brain("Cu")]}
+
+    def test_analyses_of_a_sample(self):
+        self.samples["W-1"] = Sample("sample_received")
+        analyses = self.importer._getZODBAnalyses("W-1")
+        self.assertEqual([analysis.getKeyword for analysis in analyses],
+                         ["Cu"])
+        self.assertEqual(self.importer.warns, [])
+
+    def test_sample_state_not_allowed(self):
+        self.samples["W-1"] = Sample("published")
+        self.assertEqual(self.importer._getZODBAnalyses("W-1"), [])
+        self.assertEqual(self.importer.warns, [
+            "No analyses 'unassigned, assigned' states found for W-1"])
+
+    def test_analysis_state_not_allowed(self):
+        self.samples["W-1"] = Sample("sample_received")
+        self.get_analyses = lambda sample: {"Cu": [Brain("Cu", "verified")]}
+        self.assertEqual(self.importer._getZODBAnalyses("W-1"), [])
+        self.assertEqual(len(self.importer.warns), 1)
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestImportRun))
+    suite.addTest(unittest.makeSuite(TestDecode))
+    suite.addTest(unittest.makeSuite(TestImportStats))
+    suite.addTest(unittest.makeSuite(TestProcessChunks))
+    suite.addTest(unittest.makeSuite(TestScopeImporter))
+    return suite
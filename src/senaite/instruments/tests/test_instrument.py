@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+import mmap
+import tempfile
+from os.path import abspath
+from os.path import dirname
+from os.path import join
+
+import unittest2 as unittest
+from senaite.instruments.instrument import LineStream
+from senaite.instruments.instrument import get_source
+from senaite.instruments.instrument import spreadsheet_lines
+from senaite.instruments.memprofile import MemoryProfile
+from senaite.instruments.memprofile import memory_phase
+from senaite.instruments.memprofile import profile_memory
+from senaite.instruments.spreadsheet import iter_xlsx_lines
+
+path = join(abspath(dirname(__file__)), 'files', 'instruments')
+FN = join(path, 'brukers8tiger', 'DU-0001-234987347.xlsx')
+
+
+class TestInstrument(unittest.TestCase):
+
+    def upload(self, data):
+        """Returns a file like the uploads Zope keeps in a temporary file
+        """
+        upload = tempfile.TemporaryFile()
+        upload.write(data)
+        upload.seek(0)
+        self.addCleanup(upload.close)
+        return upload
+
+    def test_get_source_of_a_file_on_disk(self):
+        with open(FN, 'rb') as infile:
+            self.assertEqual(get_source(infile), dict(path=FN))
+
+    def test_get_source_of_a_temporary_file(self):
+        data = open(FN, 'rb').read()
+        source = get_source(self.upload(data))
+        self.assertTrue(isinstance(source['contents'], mmap.mmap))
+        self.assertEqual(source['contents'][:], data)
+
+    def test_xlsx_lines_of_a_temporary_file(self):
+        data = open(FN, 'rb').read()
+        lines = list(iter_xlsx_lines(**get_source(self.upload(data))))
+        self.assertEqual(lines, list(iter_xlsx_lines(path=FN)))
+        self.assertTrue(lines)
+
+    def test_line_stream(self):
+        data = open(FN, 'rb').read()
+        stream = LineStream(iter_xlsx_lines(**get_source(self.upload(data))))
+        lines = list(iter_xlsx_lines(path=FN))
+        self.assertEqual(stream.readline(), lines[0])
+        self.assertEqual(stream.readlines(), lines[1:])
+        self.assertEqual(stream.readline(), '')
+
+    def parse_profiled(self, parse):
+        """Returns the memory phases of parsing the lines of FN
+        """
+        profile = MemoryProfile()
+        with profile_memory(profile):
+            stream = spreadsheet_lines(open(FN, 'rb'), 'xlsx')
+            with memory_phase('parse'):
+                try:
+                    parse(stream)
+                finally:
+                    stream.close()
+        return [phase['phase'] for phase in profile.summary()['phases']]
+
+    def test_lines_are_decoded_while_parsed(self):
+        phases = self.parse_profiled(lambda stream: stream.readlines())
+        self.assertEqual(phases, ['open', 'decode', 'parse'])
+
+    def test_lines_left_when_the_parse_stops(self):
+        phases = self.parse_profiled(
+            lambda stream: [stream.readline() for i in range(2)])
+        self.assertEqual(phases, ['open', 'decode', 'parse'])
+
+    def test_line_stream_of_no_lines(self):
+        self.assertEqual(LineStream([]).read(), '')
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestInstrument))
+    return suite
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+import unittest2 as unittest
+from senaite.instruments.lookup import add_analysis
+
+
+class Brain(object):
+
+    def __init__(self, uid, keyword, review_state="unassigned"):
+        self.UID = uid
+        self.getKeyword = keyword
+        self.review_state = review_state
+
+
+class TestLookup(unittest.TestCase):
+
+    def test_retest_is_kept_with_the_retracted_analysis(self):
+        analyses = {}
+        retracted = Brain("1", "Cu", "retracted")
+        retest = Brain("2", "Cu")
+        other = Brain("3", "Zn")
+        for brain in (retracted, retest, other):
+            add_analysis(analyses, brain)
+        self.assertEqual(analyses, {"Cu": [retracted, retest],
+                                    "Zn": [other]})
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestLookup))
+    return suite
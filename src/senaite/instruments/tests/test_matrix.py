@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+import unittest2 as unittest
+from senaite.instruments.matrix import numeric_mask
+from senaite.instruments.matrix import numpy
+from senaite.instruments.matrix import to_matrix
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class TestMatrix(unittest.TestCase):
+
+    def test_coercion(self):
+        rows = [{"Au": "1.5", "Ag": "<0.1", "Cu": ""},
+                {"Au": " 2 ", "Ag": "3e-2", "Cu": "n/a"}]
+        matrix = to_matrix(rows, ["Au", "Ag", "Cu"])
+        self.assertEqual(matrix.shape, (2, 3))
+        self.assertEqual(numeric_mask(matrix).tolist(),
+                         [[True, False, False], [True, True, False]])
+        self.assertEqual(matrix[1][0], 2.0)
+        self.assertEqual(matrix[1][1], 0.03)
+
+    def test_single_row_and_column(self):
+        self.assertEqual(to_matrix([{"Au": "1"}], ["Au"]).shape, (1, 1))
+        self.assertEqual(
+            to_matrix([{"Au": "1"}, {"Au": "2"}], ["Au"]).shape, (2, 1))
+
+    def test_single_column_with_empty_cells(self):
+        matrix = to_matrix([{"Au": "1"}, {"Au": ""}, {}, {"Au": "4"}],
+                           ["Au"])
+        self.assertEqual(matrix.shape, (4, 1))
+        self.assertEqual(numeric_mask(matrix).tolist(),
+                         [[True], [False], [False], [True]])
+        self.assertEqual(matrix[3][0], 4.0)
+
+    def test_text_in_a_numeric_column(self):
+        rows = [{"Au": "1", "Ag": "0.5"}, {"Au": "abc", "Ag": "1e3"},
+                {"Au": " 2.5", "Ag": "-1"}]
+        matrix = to_matrix(rows, ["Au", "Ag"])
+        self.assertEqual(numeric_mask(matrix).tolist(),
+                         [[True, True], [False, True], [True, True]])
+        self.assertEqual(matrix[:, 1].tolist(), [0.5, 1000.0, -1.0])
+        self.assertEqual(matrix[2].tolist(), [2.5, -1.0])
+
+    def test_empty(self):
+        self.assertEqual(to_matrix([], ["Au"]).shape, (0, 1))
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestMatrix))
+    return suite
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+import threading
+
+import unittest2 as unittest
+from senaite.instruments.memprofile import MemoryProfile
+from senaite.instruments.memprofile import enabled
+from senaite.instruments.memprofile import memory_phase
+from senaite.instruments.memprofile import profile_memory
+
+
+class TestMemoryProfile(unittest.TestCase):
+
+    def test_enabled(self):
+        self.assertTrue(enabled({'memory_profile': '1'}))
+        self.assertFalse(enabled({}))
+
+    def test_phases(self):
+        profile = MemoryProfile()
+        with profile_memory(profile):
+            with memory_phase('parse'):
+                with memory_phase('decode'):
+                    data = [dict(value=i) for i in range(10000)]
+            with memory_phase('commit'):
+                pass
+        names = [phase['phase'] for phase in profile.summary()['phases']]
+        self.assertEqual(names, ['decode', 'parse', 'commit'])
+        decode, parse = profile.phases[:2]
+        if profile.tracer == 'tracemalloc':
+            self.assertGreaterEqual(parse.peak, decode.peak)
+        else:
+            # the RSS tells the growth of a phase, not its peak
+            self.assertIsNone(decode.peak)
+            self.assertIn('decode rss ', profile.message())
+        self.assertTrue(decode.top)
+        self.assertEqual(len(data), 10000)
+
+    def test_profiles_run_one_at_a_time(self):
+        events = []
+
+        def run():
+            with profile_memory(MemoryProfile()):
+                events.append('other')
+
+        with profile_memory(MemoryProfile()):
+            thread = threading.Thread(target=run)
+            thread.start()
+            thread.join(0.2)
+            events.append('first')
+        thread.join()
+        self.assertEqual(events, ['first', 'other'])
+
+    def test_inactive(self):
+        with memory_phase('parse') as phase:
+            self.assertIsNone(phase)
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestMemoryProfile))
+    return suite
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+import os
+
+import unittest2 as unittest
+from senaite.instruments import metrics
+from senaite.instruments.browser.metrics import ALLOWED_ADDRESSES_ENV
+from senaite.instruments.browser.metrics import is_allowed
+from senaite.instruments.metrics import Metrics
+
+STATS = dict(status="ok", rows=120, rejected_rows=2, results_written=100,
+             decoded_bytes=4096)
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.original = metrics._metrics
+        metrics._metrics = Metrics()
+
+    def tearDown(self):
+        metrics._metrics = self.original
+
+    def render(self):
+        return metrics.get_metrics().render().splitlines()
+
+    def test_counters_add_up(self):
+        metrics.record_import("Nexion", STATS, [], 1.0)
+        metrics.record_import("Nexion", dict(STATS, status="failed"), [], 1.0)
+        lines = self.render()
+        prefix = 'senaite_instruments_import_'
+        self.assertIn(prefix + 'files_total{interface="Nexion",status="ok"} 1',
+                      lines)
+        self.assertIn(
+            prefix + 'files_total{interface="Nexion",status="failed"} 1',
+            lines)
+        self.assertIn(prefix + 'rows_total{interface="Nexion"} 240', lines)
+        self.assertIn(prefix + 'decoded_bytes_total{interface="Nexion"} 8192',
+                      lines)
+        self.assertIn('# TYPE ' + prefix + 'rows_total counter', lines)
+
+    def test_histograms_are_cumulative(self):
+        metrics.record_import("X", STATS, [("parse", 0.2), ("commit", 3.0)],
+                              3.2)
+        metrics.record_import("X", STATS, [("parse", 0.7)], 0.7)
+        lines = self.render()
+        name = 'senaite_instruments_import_phase_seconds'
+        self.assertIn(name + '_bucket{interface="X",phase="parse",le="0.1"} 0',
+                      lines)
+        self.assertIn(
+            name + '_bucket{interface="X",phase="parse",le="0.25"} 1', lines)
+        self.assertIn(name + '_bucket{interface="X",phase="parse",le="1.0"} 2',
+                      lines)
+        self.assertIn(
+            name + '_bucket{interface="X",phase="parse",le="+Inf"} 2', lines)
+        self.assertIn(name + '_count{interface="X",phase="parse"} 2', lines)
+        self.assertIn(name + '_sum{interface="X",phase="commit"} 3.0', lines)
+        self.assertIn('# TYPE ' + name + ' histogram', lines)
+
+    def test_label_values_are_escaped(self):
+        metrics.record_import(u'A "B"\\ \xe9', STATS, [], 0.1)
+        lines = self.render()
+        self.assertIn('senaite_instruments_import_rows_total'
+                      '{interface="A \\"B\\"\\\\ \xc3\xa9"} 120', lines)
+
+
+class Request(dict):
+
+    def __init__(self, address, **headers):
+        super(Request, self).__init__(REMOTE_ADDR=address)
+        self.headers = headers
+
+    def getHeader(self, name, default=None):
+        return self.headers.get(name.replace("-", "_"), default)
+
+
+class TestMetricsAccess(unittest.TestCase):
+
+    def setUp(self):
+        self.original = os.environ.pop(ALLOWED_ADDRESSES_ENV, None)
+
+    def tearDown(self):
+        os.environ.pop(ALLOWED_ADDRESSES_ENV, None)
+        if self.original is not None:
+            os.environ[ALLOWED_ADDRESSES_ENV] = self.original
+
+    def test_local_clients(self):
+        self.assertTrue(is_allowed(Request("127.0.0.1")))
+        self.assertTrue(is_allowed(Request("::1")))
+        self.assertFalse(is_allowed(Request("10.0.0.5")))
+
+    def test_proxied_clients(self):
+        # behind a local proxy every client comes from 127.0.0.1
+        self.assertFalse(is_allowed(Request("127.0.0.1",
+                                            X_Forwarded_For="1.2.3.4")))
+        self.assertFalse(is_allowed(Request("127.0.0.1",
+                                            X_Real_IP="1.2.3.4")))
+
+    def test_allowed_addresses(self):
+        os.environ[ALLOWED_ADDRESSES_ENV] = "10.0.0.5, 10.0.0.6"
+        self.assertTrue(is_allowed(Request("10.0.0.6")))
+        self.assertFalse(is_allowed(Request("127.0.0.1")))
+        os.environ[ALLOWED_ADDRESSES_ENV] = "*"
+        self.assertTrue(is_allowed(Request("1.2.3.4",
+                                           X_Forwarded_For="5.6.7.8")))
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestMetrics))
+    suite.addTest(unittest.makeSuite(TestMetricsAccess))
+    return suite
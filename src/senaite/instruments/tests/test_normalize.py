@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+import unittest2 as unittest
+from senaite.instruments.normalize import lru_cache
+from senaite.instruments.normalize import normalize_keyword
+from senaite.instruments.normalize import normalize_sample_id
+from senaite.instruments.normalize import strip_non_numeric
+from senaite.instruments.normalize import strip_non_word
+
+
+class TestNormalize(unittest.TestCase):
+
+    def test_sample_id(self):
+        self.assertEqual(normalize_sample_id("Gold - 0001"), "Gold-0001")
+        self.assertEqual(normalize_sample_id("ZK5 - 1 - H01"), "ZK5-1-H01")
+        self.assertEqual(normalize_sample_id(None), "")
+
+    def test_keyword(self):
+        self.assertEqual(normalize_keyword("Au 242.80"), "Au24280")
+        self.assertEqual(normalize_keyword("Ag-107"), "Ag107")
+
+    def test_non_word(self):
+        self.assertEqual(strip_non_word("Total Terpenes (%)"),
+                         "TotalTerpenes")
+
+    def test_non_numeric(self):
+        self.assertEqual(strip_non_numeric("67.8 % +"), "67.8")
+
+    def test_lru_cache(self):
+        calls = []
+
+        @lru_cache(maxsize=2)
+        def upper(value):
+            calls.append(value)
+            return value.upper()
+
+        self.assertEqual(upper("a"), "A")
+        self.assertEqual(upper("a"), "A")
+        self.assertEqual(calls, ["a"])
+        upper("b")
+        upper("a")
+        # "b" is the least recently used now
+        upper("c")
+        self.assertEqual(upper.cache.keys(), ["a", "c"])
+        upper("b")
+        self.assertEqual(calls, ["a", "b", "c", "b"])
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestNormalize))
+    return suite
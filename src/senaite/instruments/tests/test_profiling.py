@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+import os
+import shutil
+import tempfile
+
+import unittest2 as unittest
+from senaite.instruments import profiling
+
+
+def work():
+    return sum(i * i for i in range(10000))
+
+
+class TestProfiling(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        os.environ[profiling.PROFILE_DIR_ENV] = self.path
+
+    def tearDown(self):
+        del os.environ[profiling.PROFILE_DIR_ENV]
+        shutil.rmtree(self.path)
+
+    def test_profile_is_saved(self):
+        with profiling.profile("Perkin Elmer Nexion350X") as capture:
+            work()
+        self.assertTrue(capture.id.endswith(".prof"))
+        self.assertIn("Perkin-Elmer-Nexion350X", capture.id)
+        path = profiling.get_profile_path(capture.id)
+        self.assertEqual(path, os.path.join(self.path, capture.id))
+
+    def test_summary_holds_the_top_functions(self):
+        with profiling.profile("test") as capture:
+            work()
+        summary = capture.summary(limit=5)
+        self.assertEqual(summary["id"], capture.id)
+        self.assertTrue(0 < len(summary["top"]) <= 5)
+        functions = [item["function"] for item in summary["top"]]
+        self.assertTrue([name for name in functions if "(work)" in name])
+        cumtimes = [item["cumtime"] for item in summary["top"]]
+        self.assertEqual(cumtimes, sorted(cumtimes, reverse=True))
+
+    def test_profile_path_is_checked(self):
+        self.assertEqual(profiling.get_profile_path(None), None)
+        self.assertEqual(profiling.get_profile_path("missing.prof"), None)
+        self.assertEqual(profiling.get_profile_path("../secret.prof"), None)
+        open(os.path.join(self.path, "notes.txt"), "w").close()
+        self.assertEqual(profiling.get_profile_path("notes.txt"), None)
+
+    def test_old_profiles_are_removed(self):
+        for number in range(5):
+            name = "2019010{}-000000-test.prof".format(number)
+            open(os.path.join(self.path, name), "w").close()
+        profiling.remove_old_profiles(keep=2)
+        self.assertEqual(sorted(os.listdir(self.path)),
+                         ["20190103-000000-test.prof",
+                          "20190104-000000-test.prof"])
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestProfiling))
+    return suite
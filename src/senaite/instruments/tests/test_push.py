@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+import json
+
+import unittest2 as unittest
+from senaite.instruments.browser.push import PushResultsView
+from senaite.instruments.push import check_record
+from senaite.instruments.push import decode_payload
+from senaite.instruments.push import is_json_request
+
+RECORDS = [
+    {"sample": "W-0001", "keyword": "Cu", "interims": {"Conc": 1.2}},
+    {"sample": "W-0002", "keyword": "Cu", "result": "0.5"},
+]
+
+
+class TestPush(unittest.TestCase):
+
+    def test_list(self):
+        options, records = decode_payload(json.dumps(RECORDS))
+        self.assertEqual(options, {})
+        self.assertEqual(records, RECORDS)
+
+    def test_object_with_options(self):
+        body = json.dumps(dict(records=RECORDS, instrument=u"abc",
+                               chunk_size=10, worksheet=None))
+        options, records = decode_payload(body)
+        self.assertEqual(options, {"instrument": "abc", "chunk_size": 10})
+        self.assertEqual(records, RECORDS)
+
+    def test_single_record(self):
+        options, records = decode_payload(json.dumps(RECORDS[0]))
+        self.assertEqual(records, RECORDS[:1])
+
+    def test_json_lines(self):
+        body = "\n".join(map(json.dumps, RECORDS)) + "\n\n"
+        options, records = decode_payload(body)
+        self.assertEqual(records, RECORDS)
+
+    def test_invalid_payloads(self):
+        self.assertRaises(ValueError, decode_payload, "")
+        self.assertRaises(ValueError, decode_payload, '"text"')
+        with self.assertRaises(ValueError) as context:
+            decode_payload(json.dumps(RECORDS[0]) + "\n{oops\n")
+        self.assertTrue(str(context.exception).startswith("Line 2:"))
+
+    def test_check_record(self):
+        for record in RECORDS:
+            self.assertEqual(check_record(record), None)
+        self.assertEqual(check_record([]), "The record is no object")
+        self.assertEqual(check_record({"keyword": "Cu", "result": 1}),
+                         "The record has no sample")
+        self.assertEqual(check_record({"sample": "W-0001", "keyword": " ",
+                                       "result": 1}),
+                         "The record has no keyword")
+        self.assertEqual(check_record({"sample": "W-0001", "keyword": "Cu",
+                                       "interims": [1]}),
+                         "The interims of the record are no object")
+        self.assertEqual(check_record({"sample": "W-0001", "keyword": "Cu",
+                                       "interims": {}}),
+                         "The record has no result nor interims")
+
+
+class Response(object):
+
+    def __init__(self):
+        self.status = 200
+        self.headers = {}
+
+    def setHeader(self, name, value):
+        self.headers[name] = value
+
+    def setStatus(self, status):
+        self.status = status
+
+
+class Request(dict):
+
+    def __init__(self, method="POST", content_type=None, body=""):
+        super(Request, self).__init__(REQUEST_METHOD=method, BODY=body)
+        self.headers = {"Content-Type": content_type}
+        self.form = {}
+        self.RESPONSE = Response()
+
+    def getHeader(self, name, default=None):
+        return self.headers.get(name) or default
+
+
+class TestPushResultsView(unittest.TestCase):
+
+    def call(self, request):
+        return json.loads(PushResultsView(None, request)())
+
+    def test_is_json_request(self):
+        self.assertTrue(is_json_request(Request(
+            content_type="application/json; charset=utf-8")))
+        self.assertTrue(is_json_request(Request(
+            content_type="application/x-ndjson")))
+        self.assertFalse(is_json_request(Request(content_type="text/plain")))
+        self.assertFalse(is_json_request(Request()))
+
+    def test_results_must_be_posted(self):
+        request = Request(method="GET", content_type="application/json")
+        self.assertTrue(self.call(request)["errors"])
+        self.assertEqual(request.RESPONSE.status, 405)
+
+    def test_forms_are_refused(self):
+        # What a form posted cross-site can send
+        for content_type in ("text/plain", "multipart/form-data",
+                             "application/x-www-form-urlencoded"):
+            request = Request(content_type=content_type,
+                              body=json.dumps(RECORDS[0]))
+            self.assertTrue(self.call(request)["errors"])
+            self.assertEqual(request.RESPONSE.status, 415)
+            self.assertEqual(request.form, {})
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestPush))
+    suite.addTest(unittest.makeSuite(TestPushResultsView))
+    return suite
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+import json
+import threading
+
+import unittest2 as unittest
+from senaite.instruments.querycount import _recording
+from senaite.instruments.querycount import count_queries
+from senaite.instruments.querycount import record_queries
+
+
+class Catalog(object):
+    """Catalog with the search methods of ZCatalog, wrapped for recording
+    """
+
+    def getId(self):
+        return "catalog"
+
+    def searchResults(self, REQUEST=None, **kw):
+        return [REQUEST, kw]
+
+    def __call__(self, REQUEST=None, **kw):
+        return self.searchResults(REQUEST, **kw)
+
+    searchResults = _recording(searchResults)
+    __call__ = _recording(__call__)
+
+
+class TestQueryCount(unittest.TestCase):
+
+    def setUp(self):
+        self.catalog = Catalog()
+
+    def test_signature_is_kept(self):
+        query = dict(portal_type="Analysis")
+        for recording in (False, True):
+            with record_queries() if recording else NoRecorder():
+                self.assertEqual(self.catalog.searchResults(query),
+                                 [query, {}])
+                self.assertEqual(self.catalog.searchResults(REQUEST=query),
+                                 [query, {}])
+                self.assertEqual(self.catalog(REQUEST=query, getId="W-1"),
+                                 [query, {"getId": "W-1"}])
+
+    def test_top_repeated_queries(self):
+        with record_queries() as recorder:
+            for sample_id in ("W-1", "W-2", "W-1", "W-1", "W-2", "W-3"):
+                self.catalog(getId=sample_id)
+        self.assertEqual(recorder.count, 6)
+        top = recorder.top()
+        self.assertEqual([(query["query"], query["count"]) for query in top],
+                         [("catalog(getId='W-1')", 3),
+                          ("catalog(getId='W-2')", 2)])
+
+    def test_nested_searches_are_counted_once(self):
+        # __call__ calls searchResults, which is wrapped too
+        with record_queries() as recorder:
+            self.catalog(dict(getId="W-1"))
+            self.catalog.searchResults(dict(getId="W-1"))
+        self.assertEqual(recorder.count, 2)
+        self.assertEqual(recorder.top()[0]["count"], 2)
+
+    def test_recording_per_thread(self):
+        thread = threading.Thread(target=self.catalog, kwargs=dict(getId="X"))
+        with record_queries() as recorder:
+            thread.start()
+            thread.join()
+            self.catalog(getId="W-1")
+        self.assertEqual(recorder.count, 1)
+        self.catalog(getId="W-2")
+        self.assertEqual(recorder.count, 1)
+
+    def test_count_queries(self):
+        catalog = self.catalog
+
+        @count_queries
+        def Import():
+            catalog(getId="W-1")
+            catalog(getId="W-1")
+            return json.dumps(dict(errors=[], log=["Parsed"]))
+
+        results = json.loads(Import())
+        self.assertEqual(len(results["log"]), 2)
+        self.assertTrue(results["log"][1].startswith("2 catalog queries"))
+        self.assertEqual(results["catalog_queries"]["count"], 2)
+        self.assertEqual(results["catalog_queries"]["top"][0]["count"], 2)
+
+    def test_count_queries_of_an_export(self):
+        @count_queries
+        def Export():
+            return None
+
+        self.assertIsNone(Export())
+
+
+class NoRecorder(object):
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestQueryCount))
+    return suite
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+import cPickle
+from copy import deepcopy
+
+import unittest2 as unittest
+from senaite.instruments.rawresults import Schema
+
+
+class TestRawResults(unittest.TestCase):
+
+    def setUp(self):
+        self.schema = Schema(('DefaultResult', 'Remarks', 'DateTime'))
+
+    def test_mapping(self):
+        record = self.schema.record(
+            {'DefaultResult': None, 'Remarks': ''}, DateTime='20190101')
+        self.assertEqual(record, {
+            'DefaultResult': None, 'Remarks': '', 'DateTime': '20190101'})
+        self.assertEqual(record.keys(), ['DefaultResult', 'Remarks',
+                                         'DateTime'])
+        self.assertEqual(record.get('Area', ''), '')
+        self.assertFalse('Area' in record)
+
+    def test_delete(self):
+        # the results importer consumes the DateTime
+        record = self.schema.record(DateTime='20190101', Remarks='')
+        del record['DateTime']
+        self.assertFalse('DateTime' in record.keys())
+        self.assertEqual(len(record), 1)
+        with self.assertRaises(KeyError):
+            del record['DateTime']
+
+    def test_new_fields(self):
+        first = self.schema.record(Ion1Area=1.0)
+        second = self.schema.record(Remarks='')
+        self.assertEqual(self.schema.fields[-1], 'Ion1Area')
+        self.assertEqual(first, {'Ion1Area': 1.0})
+        self.assertEqual(second, {'Remarks': ''})
+
+    def test_copy(self):
+        record = self.schema.record(DefaultResult=None, Remarks='')
+        copied = deepcopy({'Au': record})['Au']
+        self.assertIs(copied.schema, self.schema)
+        del copied['Remarks']
+        self.assertEqual(record, {'DefaultResult': None, 'Remarks': ''})
+        pickled = cPickle.loads(cPickle.dumps(record))
+        self.assertEqual(pickled, record)
+
+    def test_slots(self):
+        record = self.schema.record()
+        self.assertFalse(hasattr(record, '__dict__'))
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestRawResults))
+    return suite
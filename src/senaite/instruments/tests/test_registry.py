@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+import unittest2 as unittest
+from senaite.instruments.registry import EXPORT
+from senaite.instruments.registry import IMPORT
+from senaite.instruments.registry import get_interfaces
+
+
+class TestRegistry(unittest.TestCase):
+
+    def test_metadata(self):
+        # the registry metadata must match the interfaces it loads
+        for factory in get_interfaces():
+            klass = factory.resolve()
+            self.assertEqual(factory.title, klass.title)
+            self.assertEqual(factory.kind == IMPORT,
+                             hasattr(klass, "Import"), factory.name)
+            self.assertEqual(factory.kind == EXPORT,
+                             hasattr(klass, "Export"), factory.name)
+
+    def test_adapt(self):
+        for factory in get_interfaces(IMPORT):
+            adapter = factory(object())
+            self.assertIsInstance(adapter, factory.resolve())
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestRegistry))
+    return suite
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+import unittest2 as unittest
+from senaite.instruments.sequence import get_samples
+from senaite.instruments.sequence import get_tray_options
+from senaite.instruments.sequence import schedule
+from senaite.instruments.sequence import sequence_filename
+
+LAYOUT = [
+    dict(position='2', container_uid='s2', analysis_uid='a3'),
+    dict(position='1', container_uid='s1', analysis_uid='a1'),
+    dict(position='1', container_uid='s1', analysis_uid='a2'),
+    dict(position='3', container_uid='s3', analysis_uid='a4'),
+]
+
+
+def items(methods):
+    return [dict(position=position, method=method)
+            for position, method in enumerate(methods, 1)]
+
+
+def trays(sequence):
+    return [(item['position'], item['tray'], item['vial'])
+            for item in sequence]
+
+
+class TestSequence(unittest.TestCase):
+
+    def test_samples(self):
+        methods = dict(a1='m1', a2='m2', a3='m1')
+        samples = get_samples(LAYOUT, methods)
+        self.assertEqual([s['parent_uid'] for s in samples],
+                         ['s2', 's1', 's3'])
+        self.assertEqual([s['method'] for s in samples],
+                         [('m1',), ('m1', 'm2'), ()])
+        self.assertEqual(samples[1]['position'], 1)
+
+    def test_options(self):
+        self.assertEqual(get_tray_options({}), (0, 0))
+        self.assertEqual(
+            get_tray_options(dict(tray_capacity='40', trays='x')), (40, 0))
+
+    def test_no_capacity(self):
+        sequences = schedule(items('abab'))
+        self.assertEqual(trays(sequences[0]),
+                         [(1, 1, 1), (2, 1, 2), (3, 1, 3), (4, 1, 4)])
+
+    def test_trays(self):
+        sequences = schedule(items('abab'), capacity=3)
+        self.assertEqual(len(sequences), 1)
+        # grouped by method
+        self.assertEqual(trays(sequences[0]),
+                         [(1, 1, 1), (3, 1, 2), (2, 1, 3), (4, 2, 1)])
+
+    def test_sequences(self):
+        sequences = schedule(items('aaabbc'), capacity=2, trays=1)
+        self.assertEqual([[item['method'] for item in sequence]
+                          for sequence in sequences],
+                         [['a', 'a'], ['a', 'c'], ['b', 'b']])
+        self.assertEqual(trays(sequences[1]), [(3, 1, 1), (6, 1, 2)])
+
+    def test_filename(self):
+        self.assertEqual(sequence_filename('WS-1.csv', 1, 1), 'WS-1.csv')
+        self.assertEqual(sequence_filename('WS-1.csv', 2, 3), 'WS-1-2.csv')
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestSequence))
+    return suite
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+import unittest2 as unittest
+from senaite.instruments.instruments.agilent.masshunter.quantitative import \
+    QuantitativeParser
+from senaite.instruments.session import ImportSession
+
+
+class TestImportSession(unittest.TestCase):
+
+    def setUp(self):
+        self.session = ImportSession()
+        self.date_format = QuantitativeParser.date_format
+
+    def test_acquisition_date(self):
+        # February 3rd, not March 2nd, and after midnight
+        self.assertEqual(
+            self.session.result_date("2/3/2019 12:14 AM", self.date_format),
+            "20190203 00:14:00")
+        self.assertEqual(
+            self.session.result_date("12/13/2019 1:05 PM", self.date_format),
+            "20191213 13:05:00")
+
+    def test_unreadable_date(self):
+        run_date = self.session.result_date()
+        for value in ("2019-02-03 00:14", "13/2/2019 12:14 AM"):
+            self.assertEqual(
+                self.session.result_date(value, self.date_format), run_date)
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestImportSession))
+    return suite
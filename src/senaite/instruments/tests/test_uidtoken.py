@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+import unittest2 as unittest
+from senaite.instruments.uidtoken import embed_uid
+from senaite.instruments.uidtoken import split_uid
+
+UID = "0123456789abcdef0123456789abcdef"
+
+
+class TestUIDToken(unittest.TestCase):
+
+    def test_round_trip(self):
+        name = embed_uid("H2O-0001", UID)
+        self.assertEqual(name, "H2O-0001~" + UID)
+        self.assertEqual(split_uid(name), ("H2O-0001", UID))
+        self.assertEqual(split_uid(" {} ".format(name)), ("H2O-0001", UID))
+
+    def test_bare_uid(self):
+        self.assertEqual(split_uid(UID), ("", UID))
+
+    def test_no_token(self):
+        self.assertEqual(split_uid("H2O-0001"), ("H2O-0001", None))
+        self.assertEqual(split_uid("H2O-0001~1234"), ("H2O-0001~1234", None))
+        self.assertEqual(split_uid(None), (None, None))
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestUIDToken))
+    return suite
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+import unittest2 as unittest
+from senaite.instruments.unchanged import is_unchanged
+from senaite.instruments.unchanged import same_value
+from senaite.instruments.unchanged import skip_unchanged
+
+
+class Brain(object):
+
+    def __init__(self, keyword, result):
+        self.getKeyword = keyword
+        self.getResult = result
+
+
+class Lookup(object):
+    """Session lookup over samples given as sample ID -> list of brains
+    """
+
+    def __init__(self, samples):
+        self.samples = samples
+
+    def prefetch(self, sample_ids):
+        pass
+
+    def prefetch_analyses(self, samples):
+        pass
+
+    def get_sample(self, sample_id):
+        return sample_id if sample_id in self.samples else None
+
+    def get_analyses(self, sample):
+        analyses = {}
+        for brain in self.samples[sample]:
+            analyses.setdefault(brain.getKeyword, []).append(brain)
+        return analyses
+
+
+def record(result, **interims):
+    values = dict(DefaultResult="Conc", Remarks="", DateTime=None,
+                  Conc=result)
+    values.update(interims)
+    return values
+
+
+class TestUnchanged(unittest.TestCase):
+
+    def test_same_value(self):
+        self.assertTrue(same_value("1.50", 1.5))
+        self.assertTrue(same_value("abc", "abc"))
+        self.assertTrue(same_value(None, ""))
+        self.assertFalse(same_value("1.5", "1.6"))
+        self.assertFalse(same_value("1.5", ""))
+        self.assertFalse(same_value("", "0"))
+        self.assertFalse(same_value("abc", "abd"))
+
+    def test_is_unchanged(self):
+        brain = Brain("Cu", "1.5")
+        self.assertTrue(is_unchanged(brain, record("1.500")))
+        self.assertFalse(is_unchanged(brain, record("2")))
+        # empty values are not written
+        self.assertTrue(is_unchanged(brain, record("")))
+        self.assertTrue(is_unchanged(brain, record(None, Dil="")))
+
+    def test_is_unchanged_with_empty_values_written(self):
+        self.assertFalse(is_unchanged(Brain("Cu", "1.5"), record(""),
+                                      empty=True))
+        self.assertTrue(is_unchanged(Brain("Cu", ""), record(None),
+                                     empty=True))
+        self.assertTrue(is_unchanged(Brain("Cu", "1.5"), record("1.5"),
+                                     empty=True))
+
+    def test_skip_unchanged(self):
+        lookup = Lookup({"W-0001": [Brain("Cu", "1.5"), Brain("Zn", "2")],
+                         "W-0002": [Brain("Cu", "3")]})
+        rawresults = {
+            "W-0001": [{"Cu": record("1.5"), "Zn": record("2.5")}],
+            "W-0002": [{"Cu": record("3")}],
+            "QC-0001": [{"Cu": record("1")}],
+        }
+        self.assertEqual(skip_unchanged(rawresults, lookup), 2)
+        self.assertEqual(rawresults, {
+            "W-0001": [{"Zn": record("2.5")}],
+            "QC-0001": [{"Cu": record("1")}],
+        })
+
+    def test_skip_unchanged_clears_results(self):
+        lookup = Lookup({"W-0001": [Brain("Cu", "1.5")]})
+        rawresults = {"W-0001": [{"Cu": record("")}]}
+        self.assertEqual(skip_unchanged(rawresults, lookup), 1)
+        rawresults = {"W-0001": [{"Cu": record("")}]}
+        self.assertEqual(skip_unchanged(rawresults, lookup, empty=True), 0)
+        self.assertEqual(rawresults, {"W-0001": [{"Cu": record("")}]})
+
+    def test_skip_unchanged_with_a_retest(self):
+        # the retest and the retracted analysis share the keyword
+        lookup = Lookup({"W-0001": [Brain("Cu", "1.5"), Brain("Cu", "")]})
+        rawresults = {"W-0001": [{"Cu": record("1.5")}]}
+        self.assertEqual(skip_unchanged(rawresults, lookup), 0)
+        self.assertEqual(rawresults, {"W-0001": [{"Cu": record("1.5")}]})
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestUnchanged))
+    return suite
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+from os.path import abspath
+from os.path import dirname
+from os.path import join
+
+import unittest2 as unittest
+from senaite.instruments import workers
+from senaite.instruments.spreadsheet import iter_xlsx_lines
+from senaite.instruments.workers import Busy
+from senaite.instruments.workers import DecoderPool
+
+path = join(abspath(dirname(__file__)), 'files', 'instruments')
+FN = join(path, 'brukers8tiger', 'DU-0001-234987347.xlsx')
+
+
+class BusyWorker(object):
+
+    def alive(self):
+        return True
+
+
+class TestDecoderPool(unittest.TestCase):
+
+    def setUp(self):
+        # A pool whose only worker is decoding another upload
+        self.pool = DecoderPool(1)
+        self.pool.spawned.append(BusyWorker())
+        original = workers.get_pool
+
+        def restore():
+            workers.get_pool = original
+        self.addCleanup(restore)
+        workers.get_pool = lambda: self.pool
+
+    def test_acquire_does_not_wait(self):
+        self.assertRaises(Busy, self.pool.acquire)
+        self.assertRaises(Busy, self.pool.map, [{}])
+
+    def test_decoded_in_process_when_busy(self):
+        self.assertEqual(list(workers.iter_lines('xlsx', path=FN)),
+                         list(iter_xlsx_lines(path=FN)))
+
+
+def test_suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TestDecoderPool))
+    return suite
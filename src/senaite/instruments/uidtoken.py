@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+"""UID tokens written by the exporters into the sample names.
+
+An exported sample name is "<sample id>~<sample uid>". When the name comes
+back in a results file, the sample is resolved by its UID directly instead
+of searching its ID. A bare UID (as written by the ChemStation exporter) is
+recognised too.
+"""
+
+import re
+
+TOKEN_SEPARATOR = "~"
+
+TOKEN_RE = re.compile(r"^(?:(.*)~)?([0-9a-f]{32})$")
+
+
+def embed_uid(name, uid):
+    """Returns the name with the UID token appended
+    """
+    return "{}{}{}".format(name, TOKEN_SEPARATOR, uid)
+
+
+def split_uid(value):
+    """Returns the name and the UID of a value read from a results file.
+    The UID is None if the value holds no token
+    """
+    match = TOKEN_RE.match((value or "").strip())
+    if not match:
+        return value, None
+    return match.group(1) or "", match.group(2)
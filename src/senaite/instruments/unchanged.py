@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+"""Removal of the raw results that would not change anything.
+
+When results are overridden, the results importer writes every parsed
+result and interim, even if the analysis holds the same values already,
+which triggers the workflow checks, the reindexing and the ZODB writes for
+nothing. The raw results of analyses whose result and interims would stay
+the same are removed before the import.
+
+The results are compared with the catalog metadata of the analyses,
+fetched for all the samples at once. The analysis objects are only loaded
+for the records holding interim values.
+"""
+
+from bika.lims import api
+
+# Fields of the raw result records that are no analysis values
+RECORD_FIELDS = ("DefaultResult", "Remarks", "DateTime")
+
+
+def is_empty(value):
+    return value is None or value == ""
+
+
+def is_written(value, empty=False):
+    """The results importer writes empty values only when told to override
+    the results with them (the `empty` flag of the override)
+    """
+    return empty or not is_empty(value)
+
+
+def same_value(current, value):
+    if is_empty(value) or is_empty(current):
+        return is_empty(value) and is_empty(current)
+    if api.is_floatable(current) and api.is_floatable(value):
+        return api.to_float(current) == api.to_float(value)
+    return str(current) == str(value)
+
+
+def get_result(brain):
+    result = getattr(brain, "getResult", None)
+    if result is None:
+        result = api.get_object(brain).getResult()
+    return result
+
+
+def is_unchanged(brain, record, empty=False):
+    """Returns whether importing the record would leave the result and the
+    interims of the analysis as they are. `empty` tells whether the empty
+    values of the record are written
+    """
+    result_key = record.get("DefaultResult")
+    if result_key and result_key in record and \
+            is_written(record[result_key], empty):
+        if not same_value(get_result(brain), record[result_key]):
+            return False
+    interim_keys = [key for key in record.keys()
+                    if key not in RECORD_FIELDS and key != result_key
+                    and is_written(record[key], empty)]
+    if not interim_keys:
+        return True
+    interims = {}
+    for interim in api.get_object(brain).getInterimFields() or []:
+        interims[interim.get("keyword")] = interim.get("value")
+        interims[interim.get("title")] = interim.get("value")
+    for key in interim_keys:
+        if key in interims and not same_value(interims[key], record[key]):
+            return False
+    return True
+
+
+def skip_unchanged(rawresults, lookup, empty=False):
+    """Removes the unchanged results from the raw results of a parser
+    (sample ID -> list of {keyword: record}). Returns the number of results
+    removed. `empty` tells whether the empty values are written
+    """
+    lookup.prefetch(rawresults.keys())
+    samples = dict((objid, lookup.get_sample(objid)) for objid in rawresults)
+    lookup.prefetch_analyses(samples.values())
+    skipped = 0
+    for objid, results in rawresults.items():
+        sample = samples[objid]
+        if not sample:
+            # Not a sample (e.g. a reference sample), left as is
+            continue
+        analyses = lookup.get_analyses(sample)
+        for values in results:
+            for keyword, record in values.items():
+                brains = analyses.get(keyword)
+                if not brains or not hasattr(record, "get"):
+                    continue
+                # A retest shares the keyword of the retracted analysis
+                if all(is_unchanged(brain, record, empty)
+                       for brain in brains):
+                    del values[keyword]
+                    skipped += 1
+        results[:] = filter(None, results)
+        if not results:
+            del rawresults[objid]
+    return skipped
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.INSTRUMENTS
+#
+# Copyright 2019 by it's authors.
+
+"""Pool of local worker processes decoding XLS/XLSX uploads.
+
+Decoding a spreadsheet is CPU bound and holds the GIL for the whole time,
+stalling every other request served by the same Zope instance. The pool
+keeps a few warm decodeworker.py processes around, so uploads are decoded
+outside of the web threads and several of them on multiple cores at once.
+
+The pool size is read from the SENAITE_INSTRUMENTS_DECODE_WORKERS
+environment variable (default 2). Set it to 0 to decode in-process.
+
+A second pool of the same workers parses the chunks of large CSV files
+(see csvchunks.py), its size is read from the
+SENAITE_INSTRUMENTS_PARSE_WORKERS environment variable (default the number
+of CPUs). Set it to 0 to parse in-process.
+
+When all the workers of a pool are busy the work is done in-process, an
+import does not wait for the workers of the other imports.
+"""
+
+import atexit
+import cPickle
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+from Queue import Empty
+from Queue import Queue
+
+from senaite.instruments import logger
+
+WORKERS_ENV = "SENAITE_INSTRUMENTS_DECODE_WORKERS"
+DEFAULT_WORKERS = 2
+PARSE_WORKERS_ENV = "SENAITE_INSTRUMENTS_PARSE_WORKERS"
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(__file__), "decodeworker.py")
+
+
+def get_cpu_count():
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return DEFAULT_WORKERS
+
+
+def get_pool_size(env=WORKERS_ENV, default=DEFAULT_WORKERS):
+    try:
+        return max(int(os.environ.get(env, default)), 0)
+    except ValueError:
+        return default
+
+
+class DecoderProcess(object):
+    """A decodeworker.py process
+    """
+
+    def __init__(self):
+        env = dict(os.environ)
+        # The worker needs the same spreadsheet libraries as we do
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, sys.path))
+        self.process = subprocess.Popen(
+            [sys.executable, WORKER_SCRIPT],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            bufsize=-1,
+            env=env,
+            close_fds=True)
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def run(self, task):
+        """Sends the task and yields the decoded lines (or parsed rows) as
+        they arrive
+        """
+        cPickle.dump(task, self.process.stdin, cPickle.HIGHEST_PROTOCOL)
+        self.process.stdin.flush()
+        while True:
+            kind, payload = cPickle.load(self.process.stdout)
+            if kind == "batch":
+                for item in payload:
+                    yield item
+            elif kind == "done":
+                return
+            else:
+                raise ValueError(payload)
+
+    def kill(self):
+        if self.alive():
+            self.process.kill()
+        self.process.wait()
+
+
+class Busy(Exception):
+    """All the workers of a pool are busy
+    """
+
+
+class DecoderPool(object):
+    """Hands decoding tasks to warm worker processes.
+
+    Workers are spawned lazily, up to `size`. A worker that failed, or
+    whose lines were not consumed to the end, is killed rather than
+    returned to the pool, so the next task never reads a stale reply.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.idle = Queue()
+        self.spawned = []
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Returns an idle worker, or a new one if the pool is not full.
+        Raises Busy otherwise: the caller does the work in-process rather
+        than waiting for a worker
+        """
+        try:
+            return self.idle.get_nowait()
+        except Empty:
+            pass
+        with self.lock:
+            if len(self.spawned) < self.size:
+                worker = DecoderProcess()
+                self.spawned.append(worker)
+                return worker
+        raise Busy("All the {} workers are busy".format(self.size))
+
+    def release(self, worker, healthy=True):
+        if healthy and worker.alive():
+            self.idle.put(worker)
+            return
+        worker.kill()
+        with self.lock:
+            self.spawned.remove(worker)
+
+    def decode(self, fmt, contents, worksheet=0, delimiter=",", path=None):
+        """Yields the lines of the given spreadsheet contents, or of the
+        spreadsheet file at `path`
+        """
+        if contents is not None and not isinstance(contents, str):
+            # e.g. a mmap, sent as a string
+            contents = contents[:]
+        task = {
+            "kind": "decode",
+            "format": fmt,
+            "worksheet": worksheet,
+            "delimiter": delimiter,
+            "contents": None if path else contents,
+            "path": path,
+        }
+        worker = self.acquire()
+        healthy = False
+        try:
+            for line in worker.run(task):
+                yield line
+            healthy = True
+        except ValueError:
+            # Decoding error reported by the worker, which is still usable
+            healthy = True
+            raise
+        finally:
+            self.release(worker, healthy)
+
+    def map(self, tasks):
+        """Runs the tasks on as many workers as are idle or can be spawned
+        (at least one, raises Busy if there is none). Returns an iterator
+        over the replies of each task in order, as a list, None for the
+        tasks that failed.
+        """
+        workers = [self.acquire()]
+        while len(workers) < len(tasks):
+            try:
+                workers.append(self.acquire())
+            except (Busy, EnvironmentError):
+                break
+        pending = Queue()
+        for index in range(len(tasks)):
+            pending.put(index)
+        replies = [None] * len(tasks)
+        done = [threading.Event() for task in tasks]
+
+        def run(worker):
+            # A worker that failed marks the tasks it takes as failed, so
+            # none is left waiting
+            healthy = True
+            while True:
+                try:
+                    index = pending.get_nowait()
+                except Empty:
+                    break
+                try:
+                    if healthy:
+                        replies[index] = list(worker.run(tasks[index]))
+                except ValueError as e:
+                    logger.warn("Task {} failed: {}".format(index, e))
+                except Exception as e:
+                    logger.warn("Worker failed: {}".format(e))
+                    healthy = False
+                finally:
+                    done[index].set()
+            self.release(worker, healthy)
+
+        for worker in workers:
+            thread = threading.Thread(target=run, args=(worker, ))
+            thread.daemon = True
+            thread.start()
+
+        def iter_replies():
+            for index in range(len(tasks)):
+                done[index].wait()
+                reply, replies[index] = replies[index], None
+                yield reply
+
+        return iter_replies()
+
+    def shutdown(self):
+        with self.lock:
+            for worker in self.spawned:
+                worker.kill()
+            self.spawned = []
+        self.idle = Queue()
+
+
+_pools = {}
+_pool_lock = threading.Lock()
+
+
+def get_pool(env=WORKERS_ENV, default=DEFAULT_WORKERS):
+    """Returns the decoder pool sized by the `env` variable, None when
+    working out-of-process is off
+    """
+    pool = _pools.get(env)
+    if pool is None:
+        with _pool_lock:
+            pool = _pools.get(env)
+            if pool is None:
+                pool = _pools[env] = DecoderPool(get_pool_size(env, default))
+                atexit.register(pool.shutdown)
+    return pool if pool.size else None
+
+
+def get_parse_pool():
+    """Returns the pool parsing the chunks of CSV files, None when parsing
+    out-of-process is off
+    """
+    return get_pool(PARSE_WORKERS_ENV, get_cpu_count())
+
+
+def iter_lines(fmt, contents=None, worksheet=0, delimiter=",", path=None):
+    """Yields the lines of a XLS/XLSX file as they are decoded.
+
+    Decoded by the worker pool, or in-process when the pool is disabled or
+    not usable (e.g. the worker could not be spawned). A file the worker
+    can not decode raises a ValueError. The file is read from `path` if
+    given, else `contents` holds it.
+    """
+    pool = get_pool()
+    if pool is not None:
+        started = False
+        try:
+            for line in pool.decode(fmt, contents, worksheet=worksheet,
+                                    delimiter=delimiter, path=path):
+                started = True
+                yield line
+            return
+        except ValueError:
+            raise
+        except Busy as e:
+            logger.info("{}, decoding in-process".format(e))
+        except Exception as e:
+            if started:
+                # Part of the lines were handed out already
+                raise
+            logger.warn("Decoding worker failed, decoding in-process: "
+                        "{}".format(e))
+    from senaite.instruments.spreadsheet import DECODERS
+    for line in DECODERS[fmt](contents, worksheet=worksheet,
+                              delimiter=delimiter, path=path):
+        yield line
+
+
+def decode_lines(fmt, contents=None, worksheet=0, delimiter=",", path=None):
+    """Returns the lines of a XLS/XLSX file as a list
+    """
+    return list(iter_lines(fmt, contents, worksheet=worksheet,
+                           delimiter=delimiter, path=path))